@@ -1,28 +1,35 @@
 # api_gpt.py
 
 import openai
-import os
-from dotenv import load_dotenv
 import openai.error
+import time
+from metrics import timed, observe
+from config_service import config
+
+SYSTEM_PROMPT = "Eres un asistente útil."
+GPT_MODEL = "gpt-4o-mini"
 
 class ApiGPT:
     def __init__(self):
-        load_dotenv()
-        self.api_key = os.getenv('API_OPENAI')
+        self.api_key = config.get('API_OPENAI')
         if not self.api_key:
             raise ValueError("La clave de API de OpenAI no está definida en las variables de entorno.")
         openai.api_key = self.api_key
 
+    def _messages(self, prompt):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+
     def gpt4_request(self, prompt):
         try:
             print("Enviando solicitud a GPT-4")
-            response = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "Eres un asistente útil."},
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            with timed('gpt_call'):
+                response = openai.ChatCompletion.create(
+                    model=GPT_MODEL,
+                    messages=self._messages(prompt)
+                )
             result = response.choices[0].message['content'].strip()
             print(f"Respuesta de GPT-4 recibida: {result[:50]}")
             return result
@@ -38,3 +45,32 @@ class ApiGPT:
         except Exception as e:
             print(f"Error inesperado al generar respuesta con GPT: {e}")
             return None
+
+    def gpt4_stream(self, prompt):
+        """
+        Genera la respuesta en modo streaming, devolviendo los fragmentos de texto a medida que llegan.
+        Los errores de la API se propagan al llamador. Cerrar el generador cierra la conexión con OpenAI.
+        """
+        print("Enviando solicitud en streaming a GPT-4")
+        start = time.perf_counter()
+        response = openai.ChatCompletion.create(
+            model=GPT_MODEL,
+            messages=self._messages(prompt),
+            stream=True
+        )
+        first = True
+        try:
+            for chunk in response:
+                content = chunk.choices[0].delta.get('content') if chunk.choices else None
+                if not content:
+                    continue
+                if first:
+                    observe('gpt_first_token', time.perf_counter() - start)
+                    first = False
+                yield content
+            observe('gpt_stream', time.perf_counter() - start)
+        finally:
+            # Reached on completion and when the consumer stops early (client disconnected)
+            close = getattr(response, 'close', None)
+            if close:
+                close()
@@ -2,16 +2,17 @@ import os
 from flask import Flask, render_template, request, redirect, url_for, flash
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.engine import make_url
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
+from auth import load_cached_user, login_limiter, ip_login_limiter, HashPoolBusy
+from db_routing import RoutingSession, InstrumentedQueuePool, READ_BIND_PREFIX
+# Load environment variables (.env is read once by the config service)
+from config_service import config, EMAIL_KEYS
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 app = Flask(__name__)
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -20,32 +21,54 @@ login_manager.login_view = 'login'
 # Add secret key for Flask sessions
 app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24)
 
+# Prompt and info files for the agent (the benchmarks point this at a scratch copy)
+AGENTE_IA_DIR = os.getenv('AGENTE_IA_DIR') or os.path.join(app.root_path, 'agente_ia')
+
+# Connection pool configuration (per engine)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))  # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '300'))
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', str(DB_POOL_SIZE)))
+# Comma-separated read replicas for the read-only views; the same URL as DATABASE_URL only isolates their pool
+DATABASE_READ_URLS = [u.strip() for u in os.getenv('DATABASE_READ_URLS', '').split(',') if u.strip()]
+
+def engine_options(url, name, pool_size):
+    options = {
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    parsed = make_url(url) if url else None
+    if parsed is None or (parsed.get_backend_name() == 'sqlite' and parsed.database in (None, '', ':memory:')):
+        # In-memory SQLite keeps its single shared connection
+        return options
+    options.update({
+        "poolclass": InstrumentedQueuePool,
+        "pool_logging_name": name,
+        "pool_size": pool_size,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    })
+    return options
+
 # Setup configuration
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-
-# Load email configuration
-email_config = {
-    'IMAP_SERVER': os.getenv('IMAP_SERVER', ''),
-    'IMAP_PORT': os.getenv('IMAP_PORT', ''),
-    'SMTP_SERVER': os.getenv('SMTP_SERVER', ''),
-    'SMTP_PORT': os.getenv('SMTP_PORT', ''),
-    'EMAIL_ADDRESS': os.getenv('EMAIL_ADDRESS', ''),
-    'EMAIL_PASSWORD': os.getenv('EMAIL_PASSWORD', '')
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(os.environ.get("DATABASE_URL"), 'writer', DB_POOL_SIZE)
+app.config["SQLALCHEMY_BINDS"] = {
+    f'{READ_BIND_PREFIX}{i}': {'url': url, **engine_options(url, f'{READ_BIND_PREFIX}{i}', DB_READ_POOL_SIZE)}
+    for i, url in enumerate(DATABASE_READ_URLS)
 }
 
-# Add email configuration to app.config
-app.config.update(email_config)
+# Add email configuration to app.config and keep it in sync with saved changes
+app.config.update(config.email_settings())
+config.subscribe(lambda changed, version: app.config.update(config.email_settings()), EMAIL_KEYS)
 
 db.init_app(app)
 
 @login_manager.user_loader
 def load_user(user_id):
     from models import User
-    return User.query.get(int(user_id))
+    return load_cached_user(user_id, lambda uid: db.session.get(User, int(uid)))
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -56,12 +79,28 @@ def login():
         from models import User
         email = request.form.get('email')
         password = request.form.get('password')
+        # Lock out an (account, address) pair, not the account itself, so nobody can lock out a known email.
+        # The whole address has its own, higher limit so typos behind a shared NAT don't lock everyone out.
+        limiter_key = f'{email}|{request.remote_addr}'
+        if login_limiter.is_blocked(limiter_key) or ip_login_limiter.is_blocked(request.remote_addr):
+            flash('Too many login attempts. Please try again later.', 'danger')
+            return render_template('login.html'), 429
+
         user = User.query.filter_by(email=email).first()
         
-        if user and user.check_password(password):
+        try:
+            authenticated = user is not None and user.check_password(password)
+        except HashPoolBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('login.html'), 503
+
+        if authenticated:
+            login_limiter.reset(limiter_key)
             login_user(user)
             return redirect(url_for('index'))
         else:
+            login_limiter.record_failure(limiter_key)
+            ip_login_limiter.record_failure(request.remote_addr)
             flash('Invalid email or password', 'danger')
     
     return render_template('login.html')
@@ -72,11 +111,6 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
-@app.route('/')
-@login_required
-def index():
-    return render_template('base.html')
-
 with app.app_context():
     import models
     db.create_all()
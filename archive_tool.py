@@ -0,0 +1,333 @@
+#archive_tool.py
+
+"""
+Exportación e importación masiva del archivo de correo (hilos, mensajes, referencias y logs).
+
+Formato: un directorio con manifest.json y ficheros por bloques de CHUNK_ROWS filas,
+en JSONL comprimido (gzip, o zstd si está instalado `zstandard`) o Parquet (si está
+instalado `pyarrow`). La exportación lee con cursores de servidor; la importación usa
+COPY en Postgres y executemany por lotes en SQLite. También se puede exportar a mbox.
+
+Uso:
+    python archive_tool.py export backup/ [--format jsonl|parquet] [--compression gzip|zstd]
+    python archive_tool.py export-mbox archivo.mbox
+    python archive_tool.py import backup/ [--replace]
+"""
+
+import argparse
+import gzip
+import io
+import json
+import mailbox
+import os
+import time
+from datetime import datetime
+from email.message import EmailMessage as MIMEMessage
+from email.utils import formataddr, format_datetime
+from sqlalchemy import select, DateTime
+from app import app, db
+from models import EmailMessage
+import stats
+import contacts
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency, gzip is used without it
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Optional dependency, only needed for --format parquet
+    pyarrow = None
+
+# Archive configuration
+CHUNK_ROWS = int(os.getenv('ARCHIVE_CHUNK_ROWS', '50000'))  # Rows per exported file
+BATCH_ROWS = int(os.getenv('ARCHIVE_BATCH_ROWS', '10000'))  # Rows per COPY/executemany call
+
+# Parents before children so foreign keys are satisfied during import
+ARCHIVE_TABLES = ['email_thread', 'email_message', 'thread_reference', 'log']
+ARCHIVE_VERSION = 1
+
+def _extension(fmt, compression):
+    if fmt == 'parquet':
+        return 'parquet'
+    return 'jsonl.zst' if compression == 'zstd' else 'jsonl.gz'
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+def _open_text(path, mode, compression):
+    """Open a compressed JSONL chunk for reading ('r') or writing ('w')"""
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd compression requires the zstandard package')
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=6)
+
+def _write_chunk(path, fmt, compression, columns, rows):
+    if fmt == 'parquet':
+        table = pyarrow.Table.from_pylist([dict(zip(columns, row)) for row in rows])
+        pyarrow.parquet.write_table(table, path, compression='zstd')
+        return
+    with _open_text(path, 'w', compression) as f:
+        for row in rows:
+            f.write(json.dumps(list(row), default=_json_default, ensure_ascii=False, separators=(',', ':')))
+            f.write('\n')
+
+def _read_chunk(path, fmt, compression, columns):
+    """Yield rows as lists in `columns` order"""
+    if fmt == 'parquet':
+        if pyarrow is None:
+            raise RuntimeError('Parquet archives require the pyarrow package')
+        table = pyarrow.parquet.read_table(path, columns=columns)
+        for batch in table.to_batches():
+            for row in zip(*(column.to_pylist() for column in batch.columns)):
+                yield list(row)
+        return
+    with _open_text(path, 'r', compression) as f:
+        for line in f:
+            yield json.loads(line)
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+def export_archive(output_dir, fmt='jsonl', compression='gzip', chunk_rows=CHUNK_ROWS, tables=ARCHIVE_TABLES):
+    """Stream every table to chunked files in `output_dir` and write the manifest. Returns the manifest."""
+    if fmt == 'parquet' and pyarrow is None:
+        raise RuntimeError('Parquet export requires the pyarrow package')
+    if compression == 'zstd' and zstandard is None:
+        raise RuntimeError('zstd compression requires the zstandard package')
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {
+        'version': ARCHIVE_VERSION,
+        'created': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'format': fmt,
+        'compression': None if fmt == 'parquet' else compression,
+        'tables': {}
+    }
+
+    with db.engine.connect() as conn:
+        # Server-side cursor where the driver has one; rows arrive in chunk_rows partitions
+        conn = conn.execution_options(stream_results=True, yield_per=chunk_rows)
+        for name in tables:
+            table = db.metadata.tables[name]
+            columns = [column.name for column in table.columns]
+            result = conn.execute(select(table).order_by(*table.primary_key.columns))
+
+            chunks = []
+            total = 0
+            for index, rows in enumerate(result.partitions()):
+                filename = f'{name}.{index:05d}.{_extension(fmt, compression)}'
+                _write_chunk(os.path.join(output_dir, filename), fmt, compression, columns, rows)
+                chunks.append(filename)
+                total += len(rows)
+
+            manifest['tables'][name] = {'columns': columns, 'rows': total, 'chunks': chunks}
+            print(f'{name}: {total} rows in {len(chunks)} chunks')
+
+    # Written last and atomically, so a partial export is never mistaken for a complete one
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+def _to_mime(message):
+    mime = MIMEMessage()
+    mime['From'] = formataddr((message.from_name or '', message.from_email))
+    mime['Subject'] = message.subject or ''
+    if message.date:
+        mime['Date'] = format_datetime(message.date)
+    mime['Message-ID'] = message.message_id
+    if message.in_reply_to:
+        mime['In-Reply-To'] = message.in_reply_to
+    references = json.loads(message.references or '[]')
+    if references:
+        mime['References'] = ' '.join(references)
+    mime['X-Folder'] = message.folder
+    mime.set_content(message.body or '')
+    return mime
+
+def export_mbox(path, chunk_rows=CHUNK_ROWS):
+    """Write every stored message to an mbox file, grouped by thread in thread order"""
+    box = mailbox.mbox(path, create=True)
+    box.lock()
+    count = 0
+    try:
+        query = select(EmailMessage).order_by(
+            EmailMessage.thread_id, EmailMessage.thread_position, EmailMessage.date
+        ).execution_options(yield_per=chunk_rows)
+        for message in db.session.execute(query).scalars():
+            box.add(_to_mime(message))
+            count += 1
+        box.flush()
+    finally:
+        box.unlock()
+        box.close()
+    print(f'{count} messages written to {path}')
+    return count
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+def _copy_field(value):
+    """Encode a value for COPY ... FROM STDIN in text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _copy_rows(conn, table, columns, rows):
+    preparer = conn.dialect.identifier_preparer
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_field(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    column_list = ', '.join(preparer.quote(c) for c in columns)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {preparer.format_table(table)} ({column_list}) FROM STDIN', buffer)
+    finally:
+        cursor.close()
+
+def _insert_rows(conn, table, columns, rows):
+    preparer = conn.dialect.identifier_preparer
+    processors = [table.c[c].type.dialect_impl(conn.dialect).bind_processor(conn.dialect) for c in columns]
+    datetimes = [isinstance(table.c[c].type, DateTime) for c in columns]
+
+    def encode(row):
+        values = []
+        for value, processor, is_datetime in zip(row, processors, datetimes):
+            if is_datetime and isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            values.append(processor(value) if processor and value is not None else value)
+        return tuple(values)
+
+    column_list = ', '.join(preparer.quote(c) for c in columns)
+    placeholders = ', '.join('?' for _ in columns)
+    conn.exec_driver_sql(
+        f'INSERT INTO {preparer.format_table(table)} ({column_list}) VALUES ({placeholders})',
+        [encode(row) for row in rows]
+    )
+
+def _reset_sequence(conn, table):
+    """Move the Postgres id sequence past the imported ids"""
+    if 'id' not in table.c or not table.c.id.autoincrement:
+        return
+    conn.exec_driver_sql(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table.name}"
+    )
+
+def _clear_archived_tables():
+    """
+    Empty the archived tables and every table that references them (reply jobs, summaries,
+    cached prompts, contact links), children first. Users and other tables are kept.
+    """
+    names = set(ARCHIVE_TABLES)
+    for table in db.metadata.sorted_tables:  # Parents before children
+        if any(fk.column.table.name in names for fk in table.foreign_keys):
+            names.add(table.name)
+    with db.engine.begin() as conn:
+        for table in reversed(db.metadata.sorted_tables):
+            if table.name in names:
+                conn.execute(table.delete())
+
+def import_archive(input_dir, replace=False, batch_rows=BATCH_ROWS):
+    """Bulk-load an archive written by export_archive. Returns {table: rows}."""
+    with open(os.path.join(input_dir, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != ARCHIVE_VERSION:
+        raise ValueError(f'Unsupported archive version: {manifest.get("version")}')
+
+    if replace:
+        db.session.remove()
+        db.create_all()
+        _clear_archived_tables()
+
+    postgres = db.engine.dialect.name == 'postgresql'
+    loader = _copy_rows if postgres else _insert_rows
+    counts = {}
+
+    for name in ARCHIVE_TABLES:
+        info = manifest['tables'].get(name)
+        if info is None:
+            continue
+        table = db.metadata.tables[name]
+        # Columns dropped from the model since the export are ignored
+        indexes = [i for i, c in enumerate(info['columns']) if c in table.c]
+        columns = [info['columns'][i] for i in indexes]
+
+        started = time.perf_counter()
+        total = 0
+        with db.engine.begin() as conn:
+            for chunk in info['chunks']:
+                rows = _read_chunk(os.path.join(input_dir, chunk), manifest['format'], manifest['compression'], info['columns'])
+                for batch in _batched(rows, batch_rows):
+                    loader(conn, table, columns, [[row[i] for i in indexes] for row in batch])
+                    total += len(batch)
+            if postgres:
+                _reset_sequence(conn, table)
+
+        elapsed = time.perf_counter() - started
+        counts[name] = total
+        print(f'{name}: {total} rows in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} rows/s)')
+
+    # Counters and contacts are derived data: recompute them instead of shipping them
+    stats.rebuild_stats()
+    contacts.rebuild_contacts()
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Bulk export/import of the mail archive')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='export tables to a chunked archive directory')
+    export.add_argument('output_dir')
+    export.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl')
+    export.add_argument('--compression', choices=['gzip', 'zstd'], default='gzip', help='for jsonl archives')
+    export.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    export.add_argument('--tables', nargs='+', choices=ARCHIVE_TABLES, default=ARCHIVE_TABLES)
+
+    mbox = commands.add_parser('export-mbox', help='export messages to an mbox file')
+    mbox.add_argument('path')
+
+    load = commands.add_parser('import', help='bulk-load an archive directory')
+    load.add_argument('input_dir')
+    load.add_argument('--replace', action='store_true', help='empty the archived tables (and the tables that reference them) first')
+    load.add_argument('--batch-rows', type=int, default=BATCH_ROWS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with app.app_context():
+        if args.command == 'export':
+            export_archive(args.output_dir, args.format, args.compression, args.chunk_rows, args.tables)
+        elif args.command == 'export-mbox':
+            export_mbox(args.path)
+        else:
+            import_archive(args.input_dir, args.replace, args.batch_rows)
@@ -0,0 +1,313 @@
+#async_email_client.py
+
+"""
+Cliente IMAP basado en asyncio, la única implementación de IMAP/SMTP del proyecto.
+
+Los comandos FETCH se envían en bloque (pipelining) y todas las conexiones comparten
+un único event loop, así que muchos buzones se pueden atender sin un hilo por buzón.
+EmailClient (email_client.py) es una envoltura síncrona que ejecuta estas corrutinas en
+el loop compartido con run_sync. El envío SMTP sigue usando smtplib en un hilo auxiliar,
+ya que es poco frecuente.
+"""
+
+import asyncio
+import email
+import os
+import re
+import smtplib
+import ssl
+import threading
+from email.message import EmailMessage
+from metrics import timed, inc
+from config_service import config
+
+LITERAL_RE = re.compile(rb'\{(\d+)\}\r\n$')
+FETCH_RE = re.compile(rb'^\* (\d+) FETCH')
+EXISTS_RE = re.compile(rb'^\* (\d+) EXISTS')
+
+# Longest response line accepted (imaplib's _MAXLINE); literals are read separately
+IMAP_LINE_LIMIT = int(os.getenv('IMAP_LINE_LIMIT', str(1024 * 1024)))
+IMAP_TIMEOUT = float(os.getenv('IMAP_TIMEOUT', '60'))  # Seconds to wait for any server response
+
+class IMAPError(Exception):
+    pass
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _shared_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name='email-io')
+            thread.daemon = True
+            thread.start()
+        return _loop
+
+def run_sync(coro):
+    """Run a coroutine on the shared email event loop from a regular thread and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, _shared_loop()).result()
+
+class AsyncEmailClient:
+    def __init__(self, imap_server=None, imap_port=None, smtp_server=None, smtp_port=None,
+                 email_address=None, email_password=None, use_ssl=None):
+        self.imap_server = imap_server or config.get('IMAP_SERVER')
+        self.imap_port = int(imap_port or config.get_int('IMAP_PORT', 993))
+        self.smtp_server = smtp_server or config.get('SMTP_SERVER')
+        self.smtp_port = int(smtp_port or config.get_int('SMTP_PORT', 465))
+        self.email_address = email_address or config.get('EMAIL_ADDRESS')
+        self.email_password = email_password or config.get('EMAIL_PASSWORD')
+        self.use_ssl = use_ssl if use_ssl is not None else config.get('EMAIL_USE_SSL', '1') == '1'
+        self.reader = None
+        self.writer = None
+        self.smtp_connection = None
+        self._tag = 0
+        self._lock = asyncio.Lock()
+
+    # ------------------------------------------------------------------
+    # IMAP protocol helpers
+    # ------------------------------------------------------------------
+
+    def _next_tag(self):
+        self._tag += 1
+        return f'A{self._tag:04d}'
+
+    @staticmethod
+    def _quote(value):
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    async def _readline(self):
+        line = await asyncio.wait_for(self.reader.readline(), IMAP_TIMEOUT)
+        if not line:
+            raise ConnectionError('IMAP connection closed')
+        return line
+
+    async def _read_response(self):
+        """Read one response line, including any literals it announces. Returns (line, literals)."""
+        line = await self._readline()
+        first_line = line
+        literals = []
+        while True:
+            match = LITERAL_RE.search(line)
+            if not match:
+                break
+            literals.append(await asyncio.wait_for(self.reader.readexactly(int(match.group(1))), IMAP_TIMEOUT))
+            line = await self._readline()
+        return first_line, literals
+
+    def _send(self, command):
+        tag = self._next_tag()
+        self.writer.write(f'{tag} {command}\r\n'.encode())
+        return tag
+
+    async def _collect(self, tags):
+        """Read responses until every tag in `tags` has completed. Returns (statuses, untagged)."""
+        pending = set(tags)
+        statuses = {}
+        untagged = []
+        while pending:
+            line, literals = await self._read_response()
+            if line.startswith(b'* '):
+                untagged.append((line, literals))
+                continue
+            tag, _, rest = line.decode(errors='ignore').partition(' ')
+            if tag in pending:
+                pending.discard(tag)
+                statuses[tag] = rest.split(' ', 1)[0].upper()
+        return statuses, untagged
+
+    async def _send_args(self, name, *args):
+        """
+        Send a command with string arguments: quoted when ASCII, otherwise as synchronizing
+        literals, since many servers reject 8-bit data inside quoted strings.
+        """
+        tag = self._next_tag()
+        line = f'{tag} {name}'.encode()
+        for value in args:
+            if value.isascii():
+                line += b' ' + self._quote(value).encode()
+                continue
+            data = value.encode('utf-8')
+            self.writer.write(line + b' {%d}\r\n' % len(data))
+            await self.writer.drain()
+            reply = await self._readline()
+            if not reply.startswith(b'+'):
+                raise IMAPError(f'Server refused literal: {reply!r}')
+            line = data
+        self.writer.write(line + b'\r\n')
+        await self.writer.drain()
+        return tag
+
+    async def _command(self, command):
+        tag = self._send(command)
+        await self.writer.drain()
+        statuses, untagged = await self._collect([tag])
+        return statuses[tag], untagged
+
+    # ------------------------------------------------------------------
+    # Public interface (wrapped synchronously by EmailClient)
+    # ------------------------------------------------------------------
+
+    async def connect(self):
+        if not all([self.imap_server, self.imap_port, self.smtp_server,
+                   self.smtp_port, self.email_address, self.email_password]):
+            raise ValueError("Email configuration is incomplete")
+
+        with timed('imap_connect'):
+            ssl_context = ssl.create_default_context() if self.use_ssl else None
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(
+                self.imap_server, self.imap_port, ssl=ssl_context, limit=IMAP_LINE_LIMIT), IMAP_TIMEOUT)
+            greeting, _ = await self._read_response()
+            if not greeting.startswith(b'* OK'):
+                raise IMAPError(f'Unexpected IMAP greeting: {greeting!r}')
+            tag = await self._send_args('LOGIN', self.email_address, self.email_password)
+            statuses, _ = await self._collect([tag])
+            if statuses[tag] != 'OK':
+                raise IMAPError('IMAP login failed')
+        print("Conectado al servidor IMAP exitosamente (async).")
+
+        await asyncio.to_thread(self._connect_smtp)
+
+    def _connect_smtp(self):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        with timed('smtp_connect'):
+            self.smtp_connection = smtp_class(self.smtp_server, self.smtp_port)
+            self.smtp_connection.login(self.email_address, self.email_password)
+
+    async def reconnect_imap(self):
+        await self._close_imap()
+        await self.connect()
+
+    async def reconnect_smtp(self):
+        def reconnect():
+            try:
+                if self.smtp_connection:
+                    self.smtp_connection.quit()
+            except Exception:
+                pass
+            self._connect_smtp()
+        await asyncio.to_thread(reconnect)
+
+    async def _close_imap(self):
+        if self.writer is None:
+            return
+        try:
+            await asyncio.wait_for(self._command('LOGOUT'), timeout=5)
+        except Exception:
+            pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+        self.reader = self.writer = None
+
+    async def close_connection(self):
+        await self._close_imap()
+        if self.smtp_connection:
+            try:
+                await asyncio.to_thread(self.smtp_connection.quit)
+            except smtplib.SMTPException as e:
+                print(f"Error al cerrar la conexión SMTP: {e}")
+            self.smtp_connection = None
+
+    async def _fetch_folder(self, folder, max_emails):
+        with timed('imap_search'):
+            status, untagged = await self._command(f'EXAMINE {self._quote(folder)}')
+            if status != 'OK':
+                print(f"Error al seleccionar la carpeta {folder}")
+                return []
+            exists = max((int(m.group(1)) for m in (EXISTS_RE.match(line) for line, _ in untagged) if m), default=0)
+            if not exists:
+                return []
+            # Only the newest sequence numbers: SEARCH ALL returns the whole mailbox on one line
+            status, untagged = await self._command(f'SEARCH {max(1, exists - max_emails + 1)}:*')
+            if status != 'OK':
+                print(f"Error al buscar correos en {folder}")
+                return []
+
+        numbers = []
+        for line, _ in untagged:
+            if line.startswith(b'* SEARCH'):
+                numbers.extend(line.split()[2:])
+        # Newest first, limited per folder
+        numbers = [n.decode() for n in numbers[::-1][:max_emails]]
+        if not numbers:
+            return []
+
+        # Pipeline: send every FETCH before reading any response
+        with timed('imap_fetch'):
+            tags = [self._send(f'FETCH {num} (RFC822)') for num in numbers]
+            await self.writer.drain()
+            statuses, untagged = await self._collect(tags)
+
+        bodies = {}
+        for line, literals in untagged:
+            match = FETCH_RE.match(line)
+            if match and literals:
+                bodies[match.group(1).decode()] = literals[0]
+
+        emails = []
+        for num in numbers:
+            if num not in bodies:
+                print(f"Error al obtener el correo {num} de {folder}")
+                continue
+            with timed('parse'):
+                email_message = email.message_from_bytes(bodies[num])
+            emails.append((num, email_message, folder))
+            inc('bot_emails_fetched_total', folder=folder)
+        return emails
+
+    async def fetch_emails(self, folders=None, max_emails=50):
+        """Fetch the newest messages of each folder, reconnecting once if the connection dropped"""
+        async with self._lock:
+            emails = []
+            for folder in folders or ('INBOX',):
+                try:
+                    emails.extend(await self._fetch_folder(folder, max_emails))
+                except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    print(f"Conexión IMAP perdida en {folder}, reconectando")
+                    await self.reconnect_imap()
+                    emails.extend(await self._fetch_folder(folder, max_emails))
+                except Exception as e:
+                    print(f"Error al acceder a la carpeta {folder}: {e}")
+                    # Part of the response may still be unread; later commands need a fresh connection
+                    await self.reconnect_imap()
+            return emails
+
+    async def send_email(self, to_email, subject, body, in_reply_to=None, references=None, max_retries=3):
+        msg = EmailMessage()
+        msg['From'] = self.email_address
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        msg.set_content(body)
+
+        if in_reply_to:
+            msg['In-Reply-To'] = in_reply_to
+        if references:
+            msg['References'] = references
+
+        for attempt in range(max_retries):
+            try:
+                with timed('smtp_send'):
+                    await asyncio.to_thread(self.smtp_connection.send_message, msg)
+                print(f"Correo enviado a {to_email}")
+                inc('smtp_emails_sent_total')
+                return True
+            except smtplib.SMTPException as e:
+                print(f"Error al enviar correo a {to_email}: {e}")
+                if attempt < max_retries - 1:
+                    print("Intentando reconectar al servidor SMTP.")
+                    await self.reconnect_smtp()
+                    await asyncio.sleep(5)
+
+        print(f"No se pudo enviar el correo a {to_email} después de {max_retries} intentos.")
+        return False
+
+async def fetch_all(clients, folders=('INBOX',), max_emails=50):
+    """Fetch from many mailboxes concurrently on the current event loop. Returns one result (or exception) per client."""
+    return await asyncio.gather(
+        *(client.fetch_emails(folders, max_emails) for client in clients),
+        return_exceptions=True
+    )
@@ -0,0 +1,153 @@
+#auth.py
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from flask_login import UserMixin
+from werkzeug.security import check_password_hash
+
+# Auth configuration
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '60'))  # Seconds a loaded user stays cached
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+LOGIN_MAX_ATTEMPTS = int(os.getenv('LOGIN_MAX_ATTEMPTS', '5'))  # Per (email, IP) pair
+# Per client address; much higher because NAT and proxies put many users behind one address
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv('LOGIN_MAX_ATTEMPTS_PER_IP', '100'))
+LOGIN_WINDOW = int(os.getenv('LOGIN_WINDOW', '300'))  # Seconds failed attempts are remembered
+LOGIN_TRACKED_KEYS = int(os.getenv('LOGIN_TRACKED_KEYS', '10000'))  # Keys with failures kept in memory at most
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', '2'))
+HASH_QUEUE = int(os.getenv('HASH_QUEUE', '4'))  # Verifications allowed to wait for a worker
+HASH_WAIT = float(os.getenv('HASH_WAIT', '2'))  # Seconds to wait for a slot before giving up
+
+class UserIdentity(UserMixin):
+    """Detached snapshot of a User, safe to share between requests and sessions"""
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_user_cache = TTLCache(USER_CACHE_TTL, USER_CACHE_SIZE)
+
+def load_cached_user(user_id, loader):
+    """Return the cached identity for user_id, calling loader(user_id) on a miss"""
+    key = str(user_id)
+    identity = _user_cache.get(key)
+    if identity is None:
+        user = loader(user_id)
+        if user is None:
+            return None
+        identity = UserIdentity(user.id, user.username, user.email)
+        _user_cache.set(key, identity)
+    return identity
+
+def invalidate_user(user_id):
+    if user_id is not None:
+        _user_cache.invalidate(str(user_id))
+
+class LoginLimiter:
+    """Count failed logins per key in a sliding window. At most `max_keys` keys are tracked (least recently failed go first)."""
+
+    def __init__(self, max_attempts, window, max_keys=LOGIN_TRACKED_KEYS):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = OrderedDict()
+        self._next_sweep = time.monotonic() + window
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        attempts = self._failures.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] < now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self._failures[key]
+            return None
+        return attempts
+
+    def _sweep(self, now):
+        # Keys that are never checked again would otherwise stay forever
+        for key in [key for key, attempts in self._failures.items() if attempts[-1] < now - self.window]:
+            del self._failures[key]
+        self._next_sweep = now + self.window
+
+    def is_blocked(self, key):
+        with self._lock:
+            attempts = self._recent(key, time.monotonic())
+            return attempts is not None and len(attempts) >= self.max_attempts
+
+    def record_failure(self, key):
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._sweep(now)
+            attempts = self._recent(key, now)
+            if attempts is None:
+                attempts = self._failures[key] = deque(maxlen=self.max_attempts)
+            attempts.append(now)
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+login_limiter = LoginLimiter(LOGIN_MAX_ATTEMPTS, LOGIN_WINDOW)
+ip_login_limiter = LoginLimiter(LOGIN_MAX_ATTEMPTS_PER_IP, LOGIN_WINDOW)
+
+class HashPoolBusy(Exception):
+    """Raised when every password hashing slot is taken"""
+
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+_hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+
+def verify_password(password_hash, password):
+    """Check a password on the bounded hashing pool so bursts cannot pin every request worker"""
+    if not password_hash or password is None:
+        return False
+    if not _hash_slots.acquire(timeout=HASH_WAIT):
+        raise HashPoolBusy()
+    try:
+        return _hash_pool.submit(check_password_hash, password_hash, password).result()
+    finally:
+        _hash_slots.release()
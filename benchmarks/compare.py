@@ -0,0 +1,53 @@
+#benchmarks/compare.py
+
+"""
+Compara dos ficheros de resultados de benchmarks/run.py.
+
+Uso:
+    python -m benchmarks.compare base.json new.json [--threshold 0.10]
+
+Sale con código 1 si alguna mediana empeora más que el umbral.
+"""
+
+import argparse
+import json
+import sys
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed relative slowdown of the median')
+    args = parser.parse_args()
+
+    base = load(args.base)
+    new = load(args.new)
+    print(f'{"benchmark":45} {base["commit"]:>12} {new["commit"]:>12} {"change":>9}')
+
+    regressions = []
+    for name in sorted(set(base['results']) | set(new['results'])):
+        old_result = base['results'].get(name, {})
+        new_result = new['results'].get(name, {})
+        if 'median_s' not in old_result or 'median_s' not in new_result:
+            print(f'{name:45} {"-":>12} {"-":>12} {"n/a":>9}')
+            continue
+
+        old_ms = old_result['median_s'] * 1000
+        new_ms = new_result['median_s'] * 1000
+        change = (new_ms - old_ms) / old_ms if old_ms else 0.0
+        flag = ''
+        if change > args.threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:45} {old_ms:10.2f}ms {new_ms:10.2f}ms {change:+8.1%}{flag}')
+
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) above {args.threshold:.0%}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
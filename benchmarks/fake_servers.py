@@ -0,0 +1,251 @@
+#benchmarks/fake_servers.py
+
+"""
+Servidores locales que imitan IMAP, SMTP y la API de OpenAI para los benchmarks.
+Hablan texto plano (sin TLS); run.py sustituye IMAP4_SSL/SMTP_SSL por las clases sin SSL.
+"""
+
+import json
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _BackgroundServer:
+    """Run a socketserver in a daemon thread on a free local port"""
+
+    def __init__(self, server):
+        self.server = server
+        self.host, self.port = server.server_address[:2]
+        self.thread = threading.Thread(target=server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# ---------------------------------------------------------------------------
+# IMAP
+# ---------------------------------------------------------------------------
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    def send(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        mailboxes = self.server.mailboxes
+        selected = None
+        self.send('* OK [CAPABILITY IMAP4rev1] Fake IMAP ready')
+
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            # Synchronizing literals ({n}): acknowledge, then read n bytes and the rest of the line
+            literal = re.search(rb'\{(\d+)\}\r\n$', raw)
+            while literal:
+                self.send('+ Ready for literal data')
+                data = self.rfile.read(int(literal.group(1)))
+                rest = self.rfile.readline()
+                raw = raw[:literal.start()] + b'"' + data + b'"' + rest
+                literal = re.search(rb'\{(\d+)\}\r\n$', rest)
+            parts = raw.decode().rstrip('\r\n').split(' ', 2)
+            tag = parts[0]
+            command = parts[1].upper() if len(parts) > 1 else ''
+            args = parts[2] if len(parts) > 2 else ''
+
+            if command == 'CAPABILITY':
+                self.send('* CAPABILITY IMAP4rev1 AUTH=PLAIN')
+                self.send(f'{tag} OK CAPABILITY completed')
+            elif command == 'LOGIN':
+                self.send(f'{tag} OK LOGIN completed')
+            elif command in ('SELECT', 'EXAMINE'):
+                folder = args.strip('"')
+                if folder not in mailboxes:
+                    self.send(f'{tag} NO Mailbox does not exist')
+                    continue
+                selected = mailboxes[folder]
+                self.send(f'* {len(selected)} EXISTS')
+                self.send('* 0 RECENT')
+                access = 'READ-ONLY' if command == 'EXAMINE' else 'READ-WRITE'
+                self.send(f'{tag} OK [{access}] {command} completed')
+            elif command == 'SEARCH':
+                # ALL, or a sequence set such as 951:*
+                total = len(selected or [])
+                criteria = args.strip().upper()
+                numbers = range(1, total + 1) if criteria in ('', 'ALL') else self._sequence(criteria, total)
+                numbers = ' '.join(str(i) for i in numbers if 1 <= i <= total)
+                self.send(f'* SEARCH {numbers}'.rstrip())
+                self.send(f'{tag} OK SEARCH completed')
+            elif command == 'FETCH':
+                match = re.match(r'(\S+)', args)
+                for num in self._sequence(match.group(1), len(selected or [])):
+                    data = selected[num - 1]
+                    self.wfile.write(f'* {num} FETCH (RFC822 {{{len(data)}}}\r\n'.encode())
+                    self.wfile.write(data)
+                    self.wfile.write(b')\r\n')
+                self.send(f'{tag} OK FETCH completed')
+            elif command == 'NOOP':
+                self.send(f'{tag} OK NOOP completed')
+            elif command == 'LOGOUT':
+                self.send('* BYE Fake IMAP logging out')
+                self.send(f'{tag} OK LOGOUT completed')
+                return
+            else:
+                self.send(f'{tag} BAD Unsupported command')
+
+    @staticmethod
+    def _sequence(spec, total):
+        numbers = []
+        for item in spec.split(','):
+            if ':' in item:
+                start, end = item.split(':')
+                end = total if end == '*' else int(end)
+                numbers.extend(range(int(start), end + 1))
+            else:
+                numbers.append(int(item))
+        return [n for n in numbers if 1 <= n <= total]
+
+def start_imap_server(mailboxes):
+    """Start a fake IMAP server serving {folder: [raw message bytes]}"""
+    server = _ThreadingTCPServer(('127.0.0.1', 0), _IMAPHandler)
+    server.mailboxes = mailboxes
+    return _BackgroundServer(server).start()
+
+# ---------------------------------------------------------------------------
+# SMTP
+# ---------------------------------------------------------------------------
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def send(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.send('220 fake ESMTP ready')
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            command = raw.decode(errors='ignore').strip().split(' ', 1)[0].upper()
+
+            if command == 'EHLO':
+                self.send('250-fake')
+                self.send('250-AUTH PLAIN LOGIN')
+                self.send('250 8BITMIME')
+            elif command == 'HELO':
+                self.send('250 fake')
+            elif command == 'AUTH':
+                self.send('235 Authentication successful')
+            elif command in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.send('250 OK')
+            elif command == 'DATA':
+                self.send('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line == b'.\r\n':
+                        break
+                    size += len(line)
+                with self.server.lock:
+                    self.server.sent.append(size)
+                self.send('250 OK queued')
+            elif command == 'QUIT':
+                self.send('221 Bye')
+                return
+            else:
+                self.send('502 Command not implemented')
+
+def start_smtp_server():
+    """Start a fake SMTP server that accepts and counts every message"""
+    server = _ThreadingTCPServer(('127.0.0.1', 0), _SMTPHandler)
+    server.sent = []
+    server.lock = threading.Lock()
+    return _BackgroundServer(server).start()
+
+# ---------------------------------------------------------------------------
+# OpenAI
+# ---------------------------------------------------------------------------
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(self.server.latency)
+
+        content = self.server.reply
+        if request.get('stream'):
+            self._stream(request, content)
+            return
+        body = json.dumps({
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        }).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, request, content):
+        """Send the reply word by word as chat.completion.chunk events, chunked like the real API"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send(data):
+            payload = f'data: {data}\n\n'.encode()
+            self.wfile.write(f'{len(payload):x}\r\n'.encode() + payload + b'\r\n')
+            self.wfile.flush()
+
+        tokens = re.findall(r'\S+\s*', content)
+        try:
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(self.server.token_latency)
+                send(json.dumps({
+                    'id': 'chatcmpl-fake',
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': request.get('model', 'fake'),
+                    'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+                }))
+            send('[DONE]')
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            self.close_connection = True
+
+def start_openai_server(reply='Gracias por su mensaje.', latency=0.0, token_latency=0.0):
+    """
+    Start a fake chat completions endpoint with a fixed reply and artificial latency.
+    Streaming requests wait `latency` before the first token and `token_latency` between tokens.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _OpenAIHandler)
+    server.daemon_threads = True
+    server.reply = reply
+    server.latency = latency
+    server.token_latency = token_latency
+    return _BackgroundServer(server).start()
@@ -0,0 +1,294 @@
+#benchmarks/load_test.py
+
+"""
+Prueba de carga HTTP de los endpoints del panel.
+
+Llena una base SQLite temporal con hilos, mensajes y logs sintéticos (benchmarks/mailbox_gen.py),
+levanta la app en un servidor WSGI local con hilos y lanza usuarios virtuales concurrentes que
+recorren una mezcla ponderada de endpoints. Para cada nivel de concurrencia informa del
+rendimiento, los percentiles de latencia y la tasa de errores por endpoint, en JSON.
+
+Uso (desde la raíz del repo):
+    python -m benchmarks.load_test [--users 1 10 50] [--duration 20] [--threads 2000] [--output load.json]
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8000   # servidor ya en marcha (sin seed)
+"""
+
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+from benchmarks.mailbox_gen import database_rows, knowledge_base
+from benchmarks.run import ROOT, RESULTS_DIR, git_commit, scratch_agente_dir
+
+LOGIN_EMAIL = 'load@example.com'
+LOGIN_PASSWORD = 'load-test-password'
+
+# name -> (method, path, weight): roughly what open dashboard tabs poll plus occasional page views
+ENDPOINTS = {
+    'logs_latest': ('GET', '/agente/logs/latest', 10),
+    'bot_status': ('GET', '/agente/bot/status', 10),
+    'database': ('GET', '/agente/database', 2),
+    'recursos': ('GET', '/agente/recursos', 2),
+    'prompt': ('GET', '/agente/prompt', 2),
+    'login': ('POST', '/login', 1),
+}
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(round(q * (len(samples) - 1))))]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load test the dashboard endpoints')
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 50], help='concurrent virtual users per step')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per step')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds of traffic before each step is measured')
+    parser.add_argument('--think-time', type=float, default=0.0, help='mean pause between requests of a user')
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    parser.add_argument('--timeout', type=float, default=30.0, help='request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--threads', type=int, default=2000, help='synthetic threads in the database')
+    parser.add_argument('--depth', type=int, default=5, help='average messages per thread')
+    parser.add_argument('--senders', type=int, default=300)
+    parser.add_argument('--logs', type=int, default=50000)
+    parser.add_argument('--kb-files', type=int, default=10, help='knowledge base files added to the scratch agente_ia/info')
+    parser.add_argument('--base-url', help='test an already running server instead of a seeded local one')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/load-<commit>.json)')
+    return parser.parse_args()
+
+def seed_database(app, db, args):
+    """Insert the synthetic rows in bulk and rebuild the counters and contacts derived from them"""
+    import stats
+    import contacts
+    from models import User
+
+    rows = database_rows(args.seed, args.threads, args.depth, args.senders, args.logs)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        with db.engine.begin() as conn:
+            for name in ('email_thread', 'email_message', 'log'):
+                conn.execute(db.metadata.tables[name].insert(), rows[name])
+        user = User(username='load', email=LOGIN_EMAIL)
+        user.set_password(LOGIN_PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        stats.rebuild_stats()
+        contacts.rebuild_contacts()
+    return {name: len(table_rows) for name, table_rows in rows.items()}
+
+def start_server(app):
+    """Serve the app from a local threaded WSGI server and return (server, base_url)"""
+    from werkzeug.serving import make_server
+
+    # One access log line per request would dominate the run
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Return redirects as responses: a redirect to /login is an error, not a rendered login page"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class VirtualUser(threading.Thread):
+    """Loops over the weighted endpoint mix until `stop` is set, recording (endpoint, seconds, error)"""
+
+    def __init__(self, base_url, endpoints, stop, record, think_time, timeout, seed):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.names = list(endpoints)
+        self.weights = [ENDPOINTS[name][2] for name in self.names]
+        self.stop = stop
+        self.record = record
+        self.think_time = think_time
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        # Each user keeps its own session cookie, like a browser tab
+        self.opener = self.new_opener()
+
+    @staticmethod
+    def new_opener():
+        return urllib.request.build_opener(NoRedirect(), urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def login(self, opener):
+        """POST the credentials; only the redirect of a successful login counts (a 200 is the form again)"""
+        data = urllib.parse.urlencode({'email': LOGIN_EMAIL, 'password': LOGIN_PASSWORD}).encode()
+        req = urllib.request.Request(self.base_url + ENDPOINTS['login'][1], data=data, method='POST')
+        try:
+            with opener.open(req, timeout=self.timeout) as response:
+                response.read()
+                return f'login failed (HTTP {response.status})'
+        except urllib.error.HTTPError as e:
+            e.read()
+            if e.code == 302 and urllib.parse.urlsplit(e.headers.get('Location', '')).path != ENDPOINTS['login'][1]:
+                return None
+            return f'HTTP {e.code}'
+
+    def request(self, name):
+        method, path, _ = ENDPOINTS[name]
+        start = time.perf_counter()
+        error = None
+        try:
+            if name == 'login':
+                # A fresh cookie jar, so every sample is a full credential check and not the already-logged-in redirect
+                error = self.login(self.new_opener())
+            else:
+                with self.opener.open(urllib.request.Request(self.base_url + path, method=method),
+                                      timeout=self.timeout) as response:
+                    response.read()
+        except urllib.error.HTTPError as e:
+            e.read()
+            error = f'HTTP {e.code}'
+        except Exception as e:
+            error = type(e).__name__
+        return time.perf_counter() - start, error
+
+    def run(self):
+        # Start with a logged-in session, like an open dashboard tab
+        try:
+            error = self.login(self.opener)
+        except Exception as e:
+            error = type(e).__name__
+        if error:
+            print(f'  {self.name}: {error}', flush=True)
+        while not self.stop.is_set():
+            name = self.rng.choices(self.names, self.weights)[0]
+            seconds, error = self.request(name)
+            self.record(name, seconds, error)
+            if self.think_time:
+                self.stop.wait(self.rng.expovariate(1 / self.think_time))
+
+def run_step(base_url, users, args):
+    """Run `users` virtual users and summarize the requests completed in the measured window"""
+    samples = []
+    measuring = threading.Event()
+    lock = threading.Lock()
+
+    def record(name, seconds, error):
+        if measuring.is_set():
+            with lock:
+                samples.append((name, seconds, error))
+
+    stop = threading.Event()
+    workers = [VirtualUser(base_url, args.endpoints, stop, record, args.think_time, args.timeout, args.seed + i)
+               for i in range(users)]
+    for worker in workers:
+        worker.start()
+    time.sleep(args.warmup)
+    measuring.set()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    measuring.clear()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for worker in workers:
+        worker.join(timeout=args.timeout)
+
+    def summarize(selected):
+        latencies = sorted(seconds for _, seconds, _ in selected)
+        errors = {}
+        for _, _, error in selected:
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+        failed = sum(errors.values())
+        return {
+            'requests': len(selected),
+            'throughput_rps': round(len(selected) / elapsed, 2),
+            'error_rate': round(failed / len(selected), 4) if selected else 0.0,
+            'errors': errors,
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+            **{f'p{int(q * 100)}_ms': round(percentile(latencies, q) * 1000, 2) if latencies else None
+               for q in (0.5, 0.9, 0.95, 0.99)},
+            'max_ms': round(latencies[-1] * 1000, 2) if latencies else None
+        }
+
+    return {
+        'users': users,
+        'duration_s': round(elapsed, 2),
+        'total': summarize(samples),
+        'endpoints': {name: summarize([s for s in samples if s[0] == name]) for name in args.endpoints}
+    }
+
+def main():
+    args = parse_args()
+    workdir = None
+    server = None
+    seeded = None
+
+    if args.base_url:
+        base_url = args.base_url.rstrip('/')
+    else:
+        workdir = tempfile.mkdtemp(prefix='load-')
+        # Point the app at a throwaway database and agente_ia copy before importing it
+        agente_dir = scratch_agente_dir(workdir)
+        for name, text in knowledge_base(args.seed, args.kb_files).items():
+            with open(os.path.join(agente_dir, 'info', f'load_{name}'), 'w', encoding='utf-8') as f:
+                f.write(text)
+        os.environ.update({
+            'DATABASE_URL': f'sqlite:///{os.path.join(workdir, "load.db")}',
+            'AGENTE_IA_DIR': agente_dir,
+            'ENV_FILE': os.path.join(workdir, '.env'),
+            'KNOWLEDGE_EMBEDDER': 'hashing',
+            # Background work triggered by the seed would compete with the measured requests
+            'PROMPT_CACHE_ENABLED': os.getenv('PROMPT_CACHE_ENABLED', '0')
+        })
+        sys.path.insert(0, ROOT)
+        from app import app, db
+        import routes  # Registers the dashboard routes
+
+        print(f'Seeding {args.threads} threads and {args.logs} log entries ...', flush=True)
+        seeded = seed_database(app, db, args)
+        server, base_url = start_server(app)
+
+    print(f'Load testing {base_url} ({", ".join(args.endpoints)})')
+    steps = []
+    try:
+        for users in args.users:
+            print(f'  {users} users ...', end='', flush=True)
+            step = run_step(base_url, users, args)
+            steps.append(step)
+            total = step['total']
+            print(f' {total["throughput_rps"]} req/s, p50 {total["p50_ms"]} ms, p95 {total["p95_ms"]} ms, '
+                  f'errors {total["error_rate"] * 100:.1f}%')
+    finally:
+        if server:
+            server.shutdown()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': vars(args),
+        'seeded': seeded,
+        'steps': steps
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'load-{report["commit"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#benchmarks/mailbox_gen.py
+
+"""
+Generadores deterministas de buzones sintéticos para los benchmarks.
+"""
+
+import random
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+WORDS = ('hola precio envío pedido factura consulta producto garantía gracias '
+         'información disponible semana cliente pago tienda oferta descuento '
+         'problema ayuda respuesta cuenta servicio entrega catálogo').split()
+
+BASE_DATE = datetime(2024, 1, 1, 9, 0, 0)
+
+def _sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def _paragraphs(rng, count):
+    return '\n\n'.join(_sentence(rng, rng.randint(8, 20)) for _ in range(count))
+
+def threaded_conversations(rng, threads=10, depth=5):
+    """Plain-text conversations where each reply quotes In-Reply-To/References and the previous body"""
+    messages = []
+    for t in range(threads):
+        sender = f'cliente{t}@example.com'
+        subject = f'Consulta {t}: {_sentence(rng, 4)}'
+        references = []
+        previous_body = None
+        for d in range(depth):
+            msg = EmailMessage()
+            message_id = f'<thread{t}-msg{d}@example.com>'
+            msg['From'] = f'Cliente {t} <{sender}>'
+            msg['To'] = 'soporte@example.com'
+            msg['Subject'] = subject if d == 0 else f'Re: {subject}'
+            msg['Message-ID'] = message_id
+            date = BASE_DATE + timedelta(hours=t, minutes=d * 7)
+            msg['Date'] = format_datetime(date)
+            body = _paragraphs(rng, 3)
+            if references:
+                msg['In-Reply-To'] = references[-1]
+                msg['References'] = ' '.join(references)
+                # Like most clients, quote the whole previous message under an attribution line
+                quoted = '\n'.join('> ' + line if line else '>' for line in previous_body.split('\n'))
+                body += f'\n\nEl {format_datetime(date - timedelta(minutes=7))}, Cliente {t} <{sender}> escribió:\n{quoted}'
+            msg.set_content(body + '\n')
+            previous_body = body
+            references.append(message_id)
+            messages.append(msg)
+    return messages
+
+def html_newsletters(rng, count=10):
+    """Multipart newsletters with a text part and a large HTML part"""
+    messages = []
+    for n in range(count):
+        msg = EmailMessage()
+        msg['From'] = f'Boletín <news{n}@example.org>'
+        msg['To'] = 'soporte@example.com'
+        msg['Subject'] = f'Boletín semanal {n}'
+        msg['Message-ID'] = f'<newsletter{n}@example.org>'
+        msg['Date'] = format_datetime(BASE_DATE + timedelta(days=n))
+        msg['List-Unsubscribe'] = f'<mailto:unsubscribe{n}@example.org>'
+        msg.set_content(_paragraphs(rng, 5))
+        rows = ''.join(
+            f'<tr><td><a href="https://example.org/{i}">{_sentence(rng, 6)}</a></td>'
+            f'<td style="color:#333">{_sentence(rng, 15)}</td></tr>'
+            for i in range(80)
+        )
+        msg.add_alternative(f'<html><body><table>{rows}</table></body></html>', subtype='html')
+        messages.append(msg)
+    return messages
+
+def with_attachments(rng, count=5, size=512 * 1024):
+    """Plain-text messages carrying a large binary attachment"""
+    messages = []
+    for n in range(count):
+        msg = EmailMessage()
+        msg['From'] = f'Proveedor {n} <proveedor{n}@example.net>'
+        msg['To'] = 'soporte@example.com'
+        msg['Subject'] = f'Factura {n}'
+        msg['Message-ID'] = f'<attachment{n}@example.net>'
+        msg['Date'] = format_datetime(BASE_DATE + timedelta(days=n, hours=3))
+        msg.set_content(_paragraphs(rng, 2))
+        payload = rng.randbytes(size)
+        msg.add_attachment(payload, maintype='application', subtype='pdf', filename=f'factura{n}.pdf')
+        messages.append(msg)
+    return messages
+
+def knowledge_base(seed=42, files=10, paragraphs=20):
+    """Return {filename: text} for a synthetic agente_ia/info directory"""
+    rng = random.Random(seed)
+    return {f'info_{n:04d}.txt': _paragraphs(rng, paragraphs) for n in range(files)}
+
+def generate_mailbox(seed=42, threads=10, depth=5, newsletters=10, attachments=5, attachment_size=512 * 1024):
+    """Return the generated messages grouped by kind"""
+    rng = random.Random(seed)
+    return {
+        'threaded': threaded_conversations(rng, threads, depth),
+        'newsletter': html_newsletters(rng, newsletters),
+        'attachment': with_attachments(rng, attachments, attachment_size)
+    }
+
+def to_raw(messages):
+    return [bytes(msg) for msg in messages]
+
+def database_rows(seed=42, threads=1000, depth=5, senders=200, logs=10000):
+    """
+    Return rows for the email_thread, email_message and log tables, ready for executemany.
+    Used to seed the load tests at scales where going through process_emails would be too slow.
+    """
+    rng = random.Random(seed)
+    rows = {'email_thread': [], 'email_message': [], 'log': []}
+    for t in range(threads):
+        sender = rng.randrange(senders)
+        subject = _sentence(rng, 5)
+        thread_id = f'<load-thread{t}-msg0@example.com>'
+        started = BASE_DATE + timedelta(minutes=t)
+        messages = rng.randint(1, depth * 2 - 1)
+        previous = None
+        for m in range(messages):
+            outgoing = m % 2 == 1
+            message_id = f'<load-thread{t}-msg{m}@example.com>'
+            rows['email_message'].append({
+                'message_id': message_id,
+                'thread_id': thread_id,
+                'from_name': 'Soporte' if outgoing else f'Cliente {sender}',
+                'from_email': 'soporte@example.com' if outgoing else f'cliente{sender}@example.com',
+                'subject': subject if m == 0 else f'Re: {subject}',
+                'body': _paragraphs(rng, rng.randint(1, 3)),
+                'date': started + timedelta(hours=m),
+                'in_reply_to': previous,
+                'references': '[]' if previous is None else f'["{previous}"]',
+                'folder': 'Sent' if outgoing else 'INBOX',
+                'reply_by_ia': outgoing,
+                'parent_message_id': previous,
+                'thread_position': m,
+                'thread_depth': m
+            })
+            previous = message_id
+        rows['email_thread'].append({
+            'thread_id': thread_id,
+            'subject': subject,
+            'last_updated': started + timedelta(hours=messages - 1),
+            'reply_by_ia': messages % 2 == 0,
+            'triage_status': 'reply'
+        })
+    levels = ('INFO', 'INFO', 'INFO', 'SUCCESS', 'WARNING', 'ERROR')
+    for n in range(logs):
+        rows['log'].append({
+            'timestamp': BASE_DATE + timedelta(seconds=n * 7),
+            'level': rng.choice(levels),
+            'message': _sentence(rng, rng.randint(6, 30))
+        })
+    return rows
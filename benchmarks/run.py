@@ -0,0 +1,252 @@
+#benchmarks/run.py
+
+"""
+Benchmarks reproducibles de los caminos críticos de ingesta y respuesta.
+
+Levanta servidores IMAP/SMTP/OpenAI locales (benchmarks/fake_servers.py), los llena con
+un buzón generado (benchmarks/mailbox_gen.py) y mide cada función contra una base SQLite
+temporal. Los resultados se guardan en JSON para compararlos con benchmarks/compare.py.
+
+Uso (desde la raíz del repo):
+    python -m benchmarks.run [--repeat 5] [--threads 20] [--output results.json]
+"""
+
+import argparse
+import email
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.fake_servers import start_imap_server, start_smtp_server, start_openai_server
+from benchmarks.mailbox_gen import generate_mailbox, knowledge_base, to_raw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+def measure(fn, repeat, setup=None):
+    """Run fn `repeat` times (calling setup before each run, untimed) and summarize the timings"""
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'runs': repeat,
+        'min_s': timings[0],
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.fmean(timings),
+        'p95_s': timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))],
+        'stdev_s': statistics.stdev(timings) if len(timings) > 1 else 0.0
+    }
+
+def scratch_agente_dir(workdir):
+    """Copy agente_ia/prompt and agente_ia/info into workdir so a run never writes to (or re-indexes) the repo copy"""
+    agente_dir = os.path.join(workdir, 'agente_ia')
+    for sub in ('prompt', 'info'):
+        src = os.path.join(ROOT, 'agente_ia', sub)
+        if os.path.isdir(src):
+            shutil.copytree(src, os.path.join(agente_dir, sub))
+        else:
+            os.makedirs(os.path.join(agente_dir, sub))
+    return agente_dir
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the ingest/reply benchmark suite')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per benchmark')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--threads', type=int, default=10, help='threaded conversations in the mailbox')
+    parser.add_argument('--depth', type=int, default=5, help='messages per conversation')
+    parser.add_argument('--newsletters', type=int, default=10)
+    parser.add_argument('--attachments', type=int, default=5)
+    parser.add_argument('--attachment-size', type=int, default=512 * 1024, help='bytes per attachment')
+    parser.add_argument('--kb-files', type=int, nargs='+', default=[1, 10, 100], help='knowledge base sizes (files of 20 paragraphs)')
+    parser.add_argument('--gpt-latency', type=float, default=0.0, help='artificial latency of the fake OpenAI endpoint')
+    parser.add_argument('--gpt-token-latency', type=float, default=0.0, help='artificial delay between streamed tokens')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<commit>.json)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='bench-')
+
+    mailbox = generate_mailbox(args.seed, args.threads, args.depth, args.newsletters,
+                               args.attachments, args.attachment_size)
+    all_messages = mailbox['threaded'] + mailbox['newsletter'] + mailbox['attachment']
+    raw_messages = to_raw(all_messages)
+
+    imap_server = start_imap_server({'INBOX': raw_messages})
+    smtp_server = start_smtp_server()
+    openai_server = start_openai_server(latency=args.gpt_latency, token_latency=args.gpt_token_latency)
+
+    # Point the app at a throwaway database, agente_ia copy and the local stand-ins before importing it
+    agente_dir = scratch_agente_dir(workdir)
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{os.path.join(workdir, "bench.db")}',
+        'AGENTE_IA_DIR': agente_dir,
+        'IMAP_SERVER': imap_server.host,
+        'IMAP_PORT': str(imap_server.port),
+        'SMTP_SERVER': smtp_server.host,
+        'SMTP_PORT': str(smtp_server.port),
+        'EMAIL_ADDRESS': 'soporte@example.com',
+        'EMAIL_PASSWORD': 'bench',
+        'API_OPENAI': 'sk-bench',
+        # Local embedding stand-in for the knowledge index
+        'KNOWLEDGE_EMBEDDER': 'hashing',
+        # The stand-ins speak plain text
+        'EMAIL_USE_SSL': '0',
+        # Measure rendering, not the server-side fragment cache
+        'FRAGMENT_CACHE_SIZE': '0'
+    })
+    sys.path.insert(0, ROOT)
+    from app import app, db
+    import routes
+    from email_client import EmailClient
+    from email_utils import get_email_body
+    from models import EmailThread, EmailMessage
+    from prompt_builder import build_thread_prompt
+
+    results = {}
+
+    def run(name, fn, setup=None, repeat=args.repeat):
+        print(f'  {name} ...', end='', flush=True)
+        results[name] = measure(fn, repeat, setup)
+        print(f' median {results[name]["median_s"] * 1000:.2f} ms')
+
+    def parsed_batch():
+        return [(str(i), email.message_from_bytes(raw), 'INBOX') for i, raw in enumerate(raw_messages, 1)]
+
+    def reset_database():
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
+
+    print(f'Benchmarking commit {git_commit()} ({len(raw_messages)} messages)')
+
+    # IMAP ingest
+    client = EmailClient()
+    client.connect()
+    run('email_client.fetch_emails', client.fetch_emails)
+    run('email_client.send_email', lambda: client.send_email('cliente@example.com', 'Re: bench', 'Gracias.'))
+    client.close_connection()
+
+    # Same fetch through the asyncio client, on one mailbox and on several concurrently
+    import asyncio
+    from async_email_client import AsyncEmailClient, fetch_all
+
+    async def async_fetch(mailboxes):
+        clients = [AsyncEmailClient() for _ in range(mailboxes)]
+        await asyncio.gather(*(c.connect() for c in clients))
+        try:
+            return await fetch_all(clients)
+        finally:
+            await asyncio.gather(*(c.close_connection() for c in clients))
+
+    run('async_email_client.fetch_emails', lambda: asyncio.run(async_fetch(1)))
+    run('async_email_client.fetch_all[8]', lambda: asyncio.run(async_fetch(8)))
+
+    # Body extraction per kind of message
+    for kind, messages in mailbox.items():
+        parsed = [email.message_from_bytes(raw) for raw in to_raw(messages)]
+        run(f'email_utils.get_email_body[{kind}]', lambda parsed=parsed: [get_email_body(m) for m in parsed])
+
+    # Storage: each run starts from an empty database
+    batch = []
+    def fresh_batch():
+        reset_database()
+        batch[:] = parsed_batch()
+    with app.app_context():
+        run('routes.process_emails', lambda: routes.process_emails(batch), setup=fresh_batch)
+
+    # Read paths over the stored mailbox
+    test_client = app.test_client()
+    run('routes.agente_database', lambda: test_client.get('/agente/database'))
+    run('routes.agente_prompt', lambda: test_client.get('/agente/prompt'))
+
+    with app.app_context():
+        longest = db.session.query(EmailMessage.thread_id).group_by(EmailMessage.thread_id).order_by(
+            db.func.count(EmailMessage.id).desc()
+        ).first()
+        thread = EmailThread.query.filter_by(thread_id=longest[0]).first()
+        run('prompt_builder.build_thread_prompt', lambda: build_thread_prompt(thread, agente_dir))
+
+        # Materialized prompt: one indexed lookup once precomputed
+        import prompt_cache
+        prompt_cache.get_entry(thread, agente_dir)
+        run('prompt_cache.get_prompt[hit]', lambda: prompt_cache.get_prompt(thread, agente_dir))
+
+        # Retrieval over knowledge bases of growing size: prompt size should stay flat
+        import knowledge_index
+        for files in args.kb_files:
+            kb_dir = os.path.join(workdir, f'kb{files}')
+            os.makedirs(os.path.join(kb_dir, 'prompt'))
+            os.makedirs(os.path.join(kb_dir, 'info'))
+            for name, text in knowledge_base(args.seed, files).items():
+                with open(os.path.join(kb_dir, 'info', name), 'w', encoding='utf-8') as f:
+                    f.write(text)
+            index = knowledge_index.KnowledgeIndex(kb_dir, knowledge_index.HashingEmbedder())
+            start = time.perf_counter()
+            index.refresh()
+            build_s = time.perf_counter() - start
+            run(f'knowledge_index.search[{files}]', lambda index=index: index.search('precio del envío y garantía del pedido'))
+            results[f'knowledge_index.search[{files}]'].update({'build_s': build_s, 'chunks': len(index.chunks)})
+            knowledge_index._indexes[kb_dir] = index
+            results[f'knowledge_index.search[{files}]']['prompt_chars'] = len(build_thread_prompt(thread, kb_dir))
+
+    # GPT round-trip against the fake endpoint (needs the pre-1.0 openai package used by ApiGPT)
+    try:
+        import openai
+        from api_gpt import ApiGPT
+        openai.api_base = f'http://{openai_server.host}:{openai_server.port}/v1'
+        gpt = ApiGPT()
+        run('api_gpt.gpt4_request', lambda: gpt.gpt4_request('Hola'))
+
+        # Streaming: time to first token (then cancel) and to the end of the stream
+        def first_token():
+            tokens = gpt.gpt4_stream('Hola')
+            next(tokens)
+            tokens.close()
+        run('api_gpt.gpt4_stream[first_token]', first_token)
+        run('api_gpt.gpt4_stream', lambda: ''.join(gpt.gpt4_stream('Hola')))
+    except ImportError as e:
+        print(f'  api_gpt skipped: {e}')
+        for name in ('api_gpt.gpt4_request', 'api_gpt.gpt4_stream[first_token]', 'api_gpt.gpt4_stream'):
+            results[name] = {'skipped': str(e)}
+
+    imap_server.stop()
+    smtp_server.stop()
+    openai_server.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': vars(args),
+        'results': results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{report["commit"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+#cluster.py
+
+"""
+Modo clúster de la ingesta (CLUSTER_MODE=1).
+
+Cada carpeta del buzón es un shard con un lease en la base de datos compartida. Los nodos
+registran latidos en cluster_node y reparten los shards entre los nodos vivos con hashing
+de rendezvous, así al entrar o salir un nodo solo se mueven los shards imprescindibles.
+Cada cambio de dueño incrementa el epoch del lease; process_emails comprueba el epoch en la
+misma transacción en la que guarda cada mensaje, de modo que un dueño obsoleto (pausado o
+desconectado) no puede guardar nada tras perder el lease.
+
+Varios nodos locales: python cluster.py (con la misma DATABASE_URL en cada proceso).
+"""
+
+import hashlib
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import ClusterNode, IngestLease
+from config_service import config
+
+# Cluster configuration
+CLUSTER_MODE = os.getenv('CLUSTER_MODE', '0') == '1'
+CLUSTER_NODE_ID = os.getenv('CLUSTER_NODE_ID') or f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+CLUSTER_LEASE_TTL = int(os.getenv('CLUSTER_LEASE_TTL', '30'))  # Seconds a lease stays valid without renewal
+CLUSTER_HEARTBEAT_INTERVAL = int(os.getenv('CLUSTER_HEARTBEAT_INTERVAL', '10'))
+CLUSTER_NODE_TIMEOUT = int(os.getenv('CLUSTER_NODE_TIMEOUT', '30'))  # Nodes silent for longer are considered gone
+INGEST_FOLDERS = [f.strip() for f in os.getenv('INGEST_FOLDERS', 'INBOX').split(',') if f.strip()]
+
+class LeaseLost(Exception):
+    """The node no longer owns the shard it is writing for"""
+
+def shard_name(mailbox, folder):
+    return f'{mailbox}/{folder}'
+
+def _rank(node_id, shard):
+    return int(hashlib.sha1(f'{node_id}|{shard}'.encode('utf-8')).hexdigest()[:16], 16)
+
+def desired_owner(shard, node_ids):
+    """Rendezvous hashing: the live node with the highest rank owns the shard"""
+    return max(node_ids, key=lambda node_id: _rank(node_id, shard))
+
+class IngestNode:
+    def __init__(self, node_id=CLUSTER_NODE_ID, mailbox=None, folders=None, on_gain=None):
+        self.node_id = node_id
+        self.mailbox = mailbox or config.get('EMAIL_ADDRESS', '')
+        self.folders = list(folders or INGEST_FOLDERS)
+        self.on_gain = on_gain  # Called when the node acquires new shards (e.g. to poll at once)
+        self.leases = {}  # shard -> epoch held by this node
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def shards(self):
+        return {shard_name(self.mailbox, folder): folder for folder in self.folders}
+
+    # ------------------------------------------------------------------
+    # Membership and leases (run from the heartbeat thread)
+    # ------------------------------------------------------------------
+
+    def _register(self, now):
+        node = db.session.get(ClusterNode, self.node_id)
+        if node is None:
+            try:
+                with db.session.begin_nested():
+                    node = ClusterNode()
+                    node.node_id = self.node_id
+                    node.hostname = socket.gethostname()
+                    node.started_at = now
+                    node.heartbeat_at = now
+                    db.session.add(node)
+            except IntegrityError:
+                node = db.session.get(ClusterNode, self.node_id)
+        node.heartbeat_at = now
+        db.session.commit()
+
+    def _lease(self, shard):
+        lease = db.session.get(IngestLease, shard)
+        if lease is None:
+            try:
+                with db.session.begin_nested():
+                    lease = IngestLease()
+                    lease.shard = shard
+                    lease.epoch = 0
+                    db.session.add(lease)
+            except IntegrityError:
+                # Created by another node
+                lease = db.session.get(IngestLease, shard)
+        return lease
+
+    def _acquire(self, lease, now):
+        """Take a free, expired or own stale lease, bumping its epoch. Compare-and-set on the epoch."""
+        epoch = lease.epoch
+        result = db.session.execute(
+            update(IngestLease).where(
+                IngestLease.shard == lease.shard,
+                IngestLease.epoch == epoch,
+                (IngestLease.owner == None) | (IngestLease.owner == self.node_id) | (IngestLease.expires_at <= now)
+            ).values(
+                owner=self.node_id,
+                epoch=epoch + 1,
+                expires_at=now + timedelta(seconds=CLUSTER_LEASE_TTL),
+                acquired_at=now
+            ).execution_options(synchronize_session=False)
+        )
+        return epoch + 1 if result.rowcount == 1 else None
+
+    def _renew(self, shard, epoch, now):
+        result = db.session.execute(
+            update(IngestLease).where(
+                IngestLease.shard == shard,
+                IngestLease.owner == self.node_id,
+                IngestLease.epoch == epoch
+            ).values(expires_at=now + timedelta(seconds=CLUSTER_LEASE_TTL)).execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def _release(self, shard, epoch):
+        db.session.execute(
+            update(IngestLease).where(
+                IngestLease.shard == shard,
+                IngestLease.owner == self.node_id,
+                IngestLease.epoch == epoch
+            ).values(owner=None, expires_at=None).execution_options(synchronize_session=False)
+        )
+
+    def heartbeat(self):
+        """Renew membership, then claim, renew or hand off each shard. Returns the shards gained."""
+        now = datetime.utcnow()
+        self._register(now)
+
+        live = [node_id for (node_id,) in db.session.query(ClusterNode.node_id).filter(
+            ClusterNode.heartbeat_at >= now - timedelta(seconds=CLUSTER_NODE_TIMEOUT)
+        )]
+        if self.node_id not in live:
+            live.append(self.node_id)
+
+        gained = []
+        for shard in self.shards():
+            lease = self._lease(shard)
+            with self._lock:
+                held = self.leases.get(shard)
+            if desired_owner(shard, live) == self.node_id:
+                if held is not None and self._renew(shard, held, now):
+                    continue
+                epoch = self._acquire(lease, now)
+                with self._lock:
+                    if epoch is not None:
+                        self.leases[shard] = epoch
+                        gained.append(shard)
+                    else:
+                        self.leases.pop(shard, None)
+            elif held is not None:
+                # Rebalance: hand the shard to its new owner, which claims it on its next heartbeat
+                with self._lock:
+                    self.leases.pop(shard, None)
+                self._release(shard, held)
+
+        # Forget nodes that have been gone for a long time
+        ClusterNode.query.filter(
+            ClusterNode.heartbeat_at < now - timedelta(seconds=CLUSTER_NODE_TIMEOUT * 10)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return gained
+
+    def leave(self):
+        """Release every lease and deregister so the other nodes take over at once"""
+        with self._lock:
+            held = dict(self.leases)
+            self.leases.clear()
+        for shard, epoch in held.items():
+            self._release(shard, epoch)
+        ClusterNode.query.filter_by(node_id=self.node_id).delete(synchronize_session=False)
+        db.session.commit()
+
+    # ------------------------------------------------------------------
+    # Used by the ingestion loop
+    # ------------------------------------------------------------------
+
+    def owned_folders(self):
+        """{folder: epoch} of the shards this node currently holds"""
+        shards = self.shards()
+        with self._lock:
+            return {shards[shard]: epoch for shard, epoch in self.leases.items() if shard in shards}
+
+    def fence(self, folder, epoch):
+        """
+        Check, inside the caller's transaction, that the lease on `folder` is still ours at `epoch`.
+        The no-op UPDATE locks the lease row until commit, so a takeover cannot interleave.
+        """
+        result = db.session.execute(
+            update(IngestLease).where(
+                IngestLease.shard == shard_name(self.mailbox, folder),
+                IngestLease.owner == self.node_id,
+                IngestLease.epoch == epoch,
+                IngestLease.expires_at > datetime.utcnow()
+            ).values(epoch=IngestLease.epoch).execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            with self._lock:
+                if self.leases.get(shard_name(self.mailbox, folder)) == epoch:
+                    self.leases.pop(shard_name(self.mailbox, folder), None)
+            raise LeaseLost(f'Lease on {folder} (epoch {epoch}) is no longer held by {self.node_id}')
+
+    # ------------------------------------------------------------------
+    # Heartbeat thread
+    # ------------------------------------------------------------------
+
+    def _beat(self):
+        from log_utils import add_log
+
+        try:
+            gained = self.heartbeat()
+        except Exception as e:
+            db.session.rollback()
+            add_log('ERROR', f'Cluster heartbeat failed on {self.node_id}: {str(e)}')
+            return
+        if gained:
+            add_log('INFO', f'Node {self.node_id} acquired {", ".join(gained)}')
+            if self.on_gain:
+                self.on_gain()
+
+    def _run(self):
+        with app.app_context():
+            while not self._stop.wait(CLUSTER_HEARTBEAT_INTERVAL):
+                self._beat()
+            try:
+                self.leave()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error al abandonar el clúster: {e}")
+            db.session.remove()
+
+    def start(self):
+        """First heartbeat in the calling thread (so leases are known at once), then keep beating in the background"""
+        self._beat()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='cluster-heartbeat')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=CLUSTER_HEARTBEAT_INTERVAL)
+
+def cluster_status():
+    """Nodes and leases as seen from the shared database"""
+    now = datetime.utcnow()
+    timeout = timedelta(seconds=CLUSTER_NODE_TIMEOUT)
+    return {
+        'node_id': CLUSTER_NODE_ID,
+        'nodes': [{
+            'node_id': node.node_id,
+            'hostname': node.hostname,
+            'heartbeat_at': node.heartbeat_at.isoformat(),
+            'alive': node.heartbeat_at >= now - timeout
+        } for node in ClusterNode.query.order_by(ClusterNode.node_id)],
+        'leases': [{
+            'shard': lease.shard,
+            'owner': lease.owner if lease.expires_at and lease.expires_at > now else None,
+            'epoch': lease.epoch,
+            'expires_at': lease.expires_at.isoformat() if lease.expires_at else None
+        } for lease in IngestLease.query.order_by(IngestLease.shard)]
+    }
+
+if __name__ == "__main__":
+    # Headless ingestion node: python cluster.py
+    import signal
+
+    os.environ['CLUSTER_MODE'] = '1'
+    os.environ.setdefault('CLUSTER_NODE_ID', CLUSTER_NODE_ID)
+    import routes
+    import poll_scheduler
+
+    def shutdown(signum, frame):
+        routes.bot_running = False
+        poll_scheduler.scheduler.wake()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    with app.app_context():
+        db.create_all()
+    print(f"Nodo de ingesta {os.environ['CLUSTER_NODE_ID']} iniciado")
+    routes.bot_running = True
+    routes.bot_process()
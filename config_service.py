@@ -0,0 +1,109 @@
+#config_service.py
+
+"""
+Configuración central de la aplicación.
+
+Lee .env una sola vez al arrancar (las variables del proceso tienen prioridad, como con
+load_dotenv), guarda los cambios reescribiendo .env de forma atómica en una sola pasada,
+incrementa una versión en cada cambio y avisa a los suscriptores solo cuando cambian las
+claves que les interesan (por ejemplo, el bot y los workers reconectan al cambiar el servidor
+de correo, no al guardar los mismos valores).
+"""
+
+import os
+import re
+import tempfile
+import threading
+from dotenv import dotenv_values
+
+EMAIL_KEYS = ('IMAP_SERVER', 'IMAP_PORT', 'SMTP_SERVER', 'SMTP_PORT', 'EMAIL_ADDRESS', 'EMAIL_PASSWORD')
+
+class ConfigService:
+    def __init__(self, env_path='.env'):
+        self.env_path = env_path
+        self.version = 0
+        self._lock = threading.RLock()
+        self._subscribers = []  # (callback, keys or None for every change)
+        self.load()
+
+    def load(self):
+        """Read the .env file into the process environment without overriding variables already set"""
+        with self._lock:
+            if os.path.exists(self.env_path):
+                for key, value in dotenv_values(self.env_path).items():
+                    if value is not None and key not in os.environ:
+                        os.environ[key] = value
+
+    def get(self, key, default=None):
+        return os.environ.get(key, default)
+
+    def get_int(self, key, default):
+        value = os.environ.get(key)
+        return int(value) if value else default
+
+    def email_settings(self):
+        return {key: self.get(key, '') for key in EMAIL_KEYS}
+
+    def subscribe(self, callback, keys=None):
+        """Call callback(changed_keys, version) after an update that changes any of `keys` (any key if None)"""
+        with self._lock:
+            self._subscribers.append((callback, set(keys) if keys else None))
+
+    def update(self, values):
+        """Persist the changed values to .env in one atomic write and notify subscribers. Returns the changed keys."""
+        values = {key: str(value) for key, value in values.items()}
+        with self._lock:
+            changed = {key for key, value in values.items() if os.environ.get(key) != value}
+            if not changed:
+                return set()
+            self._write({key: value for key, value in values.items() if key in changed})
+            for key in changed:
+                os.environ[key] = values[key]
+            self.version += 1
+            version = self.version
+            subscribers = list(self._subscribers)
+
+        for callback, keys in subscribers:
+            if keys is None or keys & changed:
+                try:
+                    callback(changed, version)
+                except Exception as e:
+                    print(f"Error notificando el cambio de configuración: {e}")
+        return changed
+
+    def _write(self, values):
+        lines = []
+        if os.path.exists(self.env_path):
+            with open(self.env_path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+
+        pending = dict(values)
+        output = []
+        for line in lines:
+            match = re.match(r'\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_.]*)\s*=', line)
+            if match and match.group(1) in values:
+                key = match.group(1)
+                if key in pending:
+                    output.append(_format_line(key, pending.pop(key)))
+                continue  # Drop duplicate definitions of an updated key
+            output.append(line)
+        output.extend(_format_line(key, value) for key, value in pending.items())
+
+        directory = os.path.dirname(os.path.abspath(self.env_path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.env.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(output) + '\n')
+            if os.path.exists(self.env_path):
+                os.chmod(tmp_path, os.stat(self.env_path).st_mode & 0o777)
+            os.replace(tmp_path, self.env_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+def _format_line(key, value):
+    # Same single-quoted format python-dotenv's set_key writes
+    escaped = value.replace('\\', '\\\\').replace("'", "\\'")
+    return f"{key}='{escaped}'"
+
+config = ConfigService(os.getenv('ENV_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
@@ -0,0 +1,194 @@
+#contacts.py
+
+"""
+Remitentes del buzón con totales incrementales.
+
+process_emails actualiza el contacto de cada mensaje guardado (contadores de mensajes e hilos,
+primera y última actividad) y stats.set_thread_answered mantiene al día los hilos sin responder
+de cada contacto, así /agente/database lista y ordena remitentes sin recorrer email_message.
+
+Reconstruir desde los mensajes (bases existentes o tras una importación): python contacts.py
+"""
+
+from datetime import timezone
+from sqlalchemy import update, delete, case, func, or_
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import Contact, ContactThread, EmailThread, EmailMessage
+
+def normalize_email(address):
+    return (address or '').strip().lower()
+
+def _utc(moment):
+    # Message dates keep the sender's offset; contacts compare them as naive UTC
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def _bump(key, from_name, date):
+    values = {
+        'message_count': Contact.message_count + 1,
+        'first_seen': case((or_(Contact.first_seen == None, Contact.first_seen > date), date), else_=Contact.first_seen),
+        'last_seen': case((or_(Contact.last_seen == None, Contact.last_seen < date), date), else_=Contact.last_seen)
+    }
+    if from_name:
+        values['name'] = from_name
+    result = db.session.execute(
+        update(Contact).where(Contact.email == key).values(**values).execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def on_message_stored(from_email, from_name, thread, date):
+    """Count a new message in its sender's contact, inside the caller's transaction. Returns True for a new contact."""
+    key = normalize_email(from_email)
+    date = _utc(date)
+    created = False
+    if not _bump(key, from_name, date):
+        try:
+            with db.session.begin_nested():
+                contact = Contact()
+                contact.email = key
+                contact.name = from_name or None
+                contact.first_seen = date
+                contact.last_seen = date
+                contact.message_count = 1
+                contact.thread_count = 0
+                contact.unanswered_threads = 0
+                db.session.add(contact)
+            created = True
+        except IntegrityError:
+            # Created concurrently by another writer
+            _bump(key, from_name, date)
+
+    contact_id = db.session.query(Contact.id).filter_by(email=key).scalar()
+    if db.session.get(ContactThread, (contact_id, thread.thread_id)) is None:
+        try:
+            with db.session.begin_nested():
+                link = ContactThread()
+                link.contact_id = contact_id
+                link.thread_id = thread.thread_id
+                db.session.add(link)
+        except IntegrityError:
+            return created
+        db.session.execute(
+            update(Contact).where(Contact.id == contact_id).values(
+                thread_count=Contact.thread_count + 1,
+                unanswered_threads=Contact.unanswered_threads + (0 if thread.reply_by_ia else 1)
+            ).execution_options(synchronize_session=False)
+        )
+    return created
+
+def on_thread_answered(thread_id, answered):
+    """A thread was answered (or reopened by new mail): adjust the unanswered count of everyone in it"""
+    db.session.execute(
+        update(Contact).where(
+            Contact.id.in_(db.session.query(ContactThread.contact_id).filter(ContactThread.thread_id == thread_id))
+        ).values(
+            unanswered_threads=Contact.unanswered_threads + (-1 if answered else 1)
+        ).execution_options(synchronize_session=False)
+    )
+
+def merge_threads(winner, loser):
+    """Move the contact links of `loser` to `winner`. Call before the winner's answered state changes."""
+    in_winner = {
+        contact_id for (contact_id,) in
+        db.session.query(ContactThread.contact_id).filter(ContactThread.thread_id == winner.thread_id)
+    }
+    loser_unanswered = 0 if loser.reply_by_ia else 1
+    winner_unanswered = 0 if winner.reply_by_ia else 1
+    for (contact_id,) in db.session.query(ContactThread.contact_id).filter(ContactThread.thread_id == loser.thread_id).all():
+        if contact_id in in_winner:
+            # Both threads were one thread for this contact all along
+            values = {
+                'thread_count': Contact.thread_count - 1,
+                'unanswered_threads': Contact.unanswered_threads - loser_unanswered
+            }
+        else:
+            values = {'unanswered_threads': Contact.unanswered_threads + winner_unanswered - loser_unanswered}
+        db.session.execute(
+            update(Contact).where(Contact.id == contact_id).values(**values).execution_options(synchronize_session=False)
+        )
+
+    db.session.execute(
+        delete(ContactThread).where(
+            ContactThread.thread_id == loser.thread_id, ContactThread.contact_id.in_(in_winner)
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(ContactThread).where(ContactThread.thread_id == loser.thread_id).values(
+            thread_id=winner.thread_id
+        ).execution_options(synchronize_session=False)
+    )
+
+def contact_threads(contact, yield_per=None):
+    """Yield the threads of a contact, most recent first, with its messages and the replies sent in them"""
+    threads = db.session.query(EmailThread).join(
+        ContactThread, ContactThread.thread_id == EmailThread.thread_id
+    ).filter(ContactThread.contact_id == contact.id).order_by(EmailThread.last_updated.desc())
+    if yield_per:
+        threads = threads.yield_per(yield_per)
+
+    for thread in threads:
+        messages = EmailMessage.query.filter(
+            EmailMessage.thread_id == thread.thread_id,
+            or_(
+                func.lower(func.trim(EmailMessage.from_email)) == contact.email,
+                EmailMessage.folder == 'Sent'
+            )
+        ).order_by(EmailMessage.thread_position.asc(), EmailMessage.date.asc()).all()
+
+        if messages:
+            yield {
+                'thread': thread,
+                'messages': messages
+            }
+
+def rebuild_contacts():
+    """Recompute every contact and link from the stored messages"""
+    db.session.execute(delete(ContactThread))
+    db.session.execute(delete(Contact))
+
+    answered = dict(db.session.query(EmailThread.thread_id, EmailThread.reply_by_ia))
+    contacts = {}
+    for from_email, from_name, date, thread_id in db.session.query(
+        EmailMessage.from_email, EmailMessage.from_name, EmailMessage.date, EmailMessage.thread_id
+    ).order_by(EmailMessage.id).yield_per(1000):
+        key = normalize_email(from_email)
+        date = _utc(date)
+        contact = contacts.setdefault(key, {
+            'email': key, 'name': None, 'first_seen': date, 'last_seen': date, 'message_count': 0, 'threads': set()
+        })
+        contact['message_count'] += 1
+        if from_name:
+            contact['name'] = from_name
+        if date is not None:
+            if contact['first_seen'] is None or date < contact['first_seen']:
+                contact['first_seen'] = date
+            if contact['last_seen'] is None or date > contact['last_seen']:
+                contact['last_seen'] = date
+        contact['threads'].add(thread_id)
+
+    rows = [{
+        'email': contact['email'],
+        'name': contact['name'],
+        'first_seen': contact['first_seen'],
+        'last_seen': contact['last_seen'],
+        'message_count': contact['message_count'],
+        'thread_count': len(contact['threads']),
+        'unanswered_threads': sum(1 for thread_id in contact['threads'] if not answered.get(thread_id))
+    } for contact in contacts.values()]
+    if rows:
+        db.session.execute(Contact.__table__.insert(), rows)
+        ids = dict(db.session.query(Contact.email, Contact.id))
+        db.session.execute(ContactThread.__table__.insert(), [
+            {'contact_id': ids[key], 'thread_id': thread_id}
+            for key, contact in contacts.items() for thread_id in contact['threads']
+        ])
+    db.session.commit()
+    return len(rows)
+
+if __name__ == "__main__":
+    # Backfill existing databases: python contacts.py
+    with app.app_context():
+        db.create_all()
+        print(f"Rebuilt {rebuild_contacts()} contacts")
@@ -3,6 +3,8 @@
 import json
 import os
 from datetime import datetime, timezone
+from types import SimpleNamespace
+from email_threading import order_messages, reference_chain
 
 def load_conversations():
     """
@@ -47,6 +49,22 @@ def associate_to_thread(conversations, in_reply_to, references):
     
     return None
 
+def update_thread_order(conversations, thread_id):
+    """
+    Calcula y guarda el orden del hilo (algoritmo JWZ) como una lista de índices en
+    conversations["thread_order"], para que process_email no tenga que ordenar.
+    Debe llamarse cada vez que se añade un correo al hilo.
+    """
+    thread_emails = conversations["threads"].get(thread_id, [])
+    entries = []
+    for index, email in enumerate(thread_emails):
+        date = datetime.fromisoformat(email['date']).astimezone(timezone.utc) if email.get('date') else None
+        entries.append(SimpleNamespace(index=index, date=date, message_id=email.get('message_id') or f'<index-{index}>',
+                                       chain=reference_chain(email.get('references') or [], email.get('in_reply_to'))))
+
+    ordered = order_messages(entries, lambda e: e.message_id, lambda e: e.chain)
+    conversations.setdefault("thread_order", {})[thread_id] = [entry.index for entry in ordered]
+
 def process_email(conversations, thread_id, new_message_id=None):
     """
     Procesa el hilo de conversación asociado al thread_id.
@@ -59,13 +77,18 @@ def process_email(conversations, thread_id, new_message_id=None):
     # Recuperar todos los emails del hilo
     thread_emails = conversations["threads"][thread_id]
 
-    # Ordenar los correos con fecha basándose en UTC
-    sorted_emails = sorted(
-        [email for email in thread_emails if email['date']],
-        key=lambda x: datetime.fromisoformat(x['date']).astimezone(timezone.utc)
-    )
-    # Añadir los correos sin fecha al final
-    sorted_emails += [email for email in thread_emails if not email['date']]
+    # Usar el orden precalculado por update_thread_order si sigue vigente
+    order = conversations.get("thread_order", {}).get(thread_id)
+    if order is not None and len(order) == len(thread_emails):
+        sorted_emails = [thread_emails[i] for i in order]
+    else:
+        # Ordenar los correos con fecha basándose en UTC
+        sorted_emails = sorted(
+            [email for email in thread_emails if email['date']],
+            key=lambda x: datetime.fromisoformat(x['date']).astimezone(timezone.utc)
+        )
+        # Añadir los correos sin fecha al final
+        sorted_emails += [email for email in thread_emails if not email['date']]
 
     if not sorted_emails:
         print("El hilo de conversación está vacío.")
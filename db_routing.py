@@ -0,0 +1,91 @@
+#db_routing.py
+
+"""
+Enrutado lectura/escritura y pools de conexiones instrumentados.
+
+Las vistas marcadas con @read_only leen de las réplicas de DATABASE_READ_URLS (binds
+'replica_0', 'replica_1', ...); todo lo demás, y cualquier escritura, va al writer.
+InstrumentedQueuePool mide la espera de cada checkout (etapa db_pool_wait[<bind>]) y
+expone tamaño, conexiones en uso y utilización de cada pool como gauges de /metrics.
+"""
+
+import random
+import threading
+import time
+import weakref
+from functools import wraps
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+import metrics
+
+READ_BIND_PREFIX = 'replica_'
+
+_pools = weakref.WeakSet()
+_pools_lock = threading.Lock()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records checkout waits and timeouts. Pools are named after their bind (pool_logging_name)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with _pools_lock:
+            _pools.add(self)
+
+    @property
+    def bind_name(self):
+        return self.logging_name or 'default'
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            metrics.inc('db_pool_timeouts_total', bind=self.bind_name)
+            raise
+        finally:
+            metrics.observe(f'db_pool_wait[{self.bind_name}]', time.perf_counter() - start)
+
+def _pool_gauges():
+    with _pools_lock:
+        pools = list(_pools)
+    samples = []
+    for pool in pools:
+        samples.append(({'bind': pool.bind_name, 'state': 'checked_out'}, pool.checkedout()))
+        samples.append(({'bind': pool.bind_name, 'state': 'idle'}, pool.checkedin()))
+        samples.append(({'bind': pool.bind_name, 'state': 'overflow'}, max(pool.overflow(), 0)))
+    return samples
+
+def _pool_utilization():
+    with _pools_lock:
+        pools = list(_pools)
+    samples = []
+    for pool in pools:
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        samples.append(({'bind': pool.bind_name}, round(pool.checkedout() / capacity, 4) if capacity else 0))
+    return samples
+
+metrics.register_gauge('db_pool_connections', _pool_gauges)
+metrics.register_gauge('db_pool_utilization', _pool_utilization)
+
+class RoutingSession(Session):
+    """Sends reads inside @read_only views to a random replica; writes and flushes always go to the writer"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not isinstance(clause, UpdateBase)
+                and has_app_context() and g.get('db_read_only')):
+            replicas = [engine for key, engine in self._db.engines.items()
+                        if isinstance(key, str) and key.startswith(READ_BIND_PREFIX)]
+            if replicas:
+                return random.choice(replicas)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def read_only(view):
+    """Route the queries of a view (including streamed responses) to the read replicas, if any"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
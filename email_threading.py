@@ -0,0 +1,342 @@
+#email_threading.py
+
+"""
+Reconstrucción de hilos basada en el algoritmo JWZ (https://www.jwz.org/doc/threading.html).
+
+La parte pura (build_tree/order_messages) trabaja con cualquier objeto que tenga
+message_id, references e in_reply_to. Las funciones de base de datos mantienen la tabla
+thread_reference (Message-ID -> hilo, incluidos los mensajes aún no recibidos), fusionan
+hilos cuando un mensaje nuevo los enlaza y guardan el árbol materializado en cada
+EmailMessage (parent_message_id, thread_position, thread_depth).
+"""
+
+import json
+import uuid
+from datetime import datetime, timezone
+
+class Container:
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self.message = None
+        self.parent = None
+        self.children = []
+
+    def is_ancestor_of(self, other):
+        node = other
+        while node is not None:
+            if node is self:
+                return True
+            node = node.parent
+        return False
+
+    def set_parent(self, parent):
+        if self.parent is not None:
+            self.parent.children.remove(self)
+        self.parent = parent
+        if parent is not None:
+            parent.children.append(self)
+
+def reference_chain(references, in_reply_to):
+    """Ordered list of ancestors: References, then In-Reply-To if it is not already the last one"""
+    chain = [ref for ref in references if ref]
+    if in_reply_to and (not chain or chain[-1] != in_reply_to):
+        if in_reply_to in chain:
+            chain.remove(in_reply_to)
+        chain.append(in_reply_to)
+    return chain
+
+def _sort_key(container):
+    message = container.message
+    if message is None:
+        # Phantom containers sort by their earliest descendant
+        return min((_sort_key(child) for child in container.children), default=(datetime.max, ''))
+    date = message.date or datetime.max
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return (date, container.message_id)
+
+def build_tree(messages, get_id, get_chain):
+    """
+    Run the JWZ linking and pruning steps. Returns the sorted root containers.
+    get_id(message) returns its Message-ID, get_chain(message) its reference chain.
+    """
+    containers = {}
+
+    def container_for(message_id):
+        container = containers.get(message_id)
+        if container is None:
+            container = containers[message_id] = Container(message_id)
+        return container
+
+    for message in messages:
+        container = container_for(get_id(message))
+        container.message = message
+
+        # Link every reference to the next one, without creating loops or
+        # overriding links that were already established
+        previous = None
+        for ref in get_chain(message):
+            ref_container = container_for(ref)
+            if (previous is not None and ref_container.parent is None
+                    and ref_container is not previous and not ref_container.is_ancestor_of(previous)):
+                ref_container.set_parent(previous)
+            previous = ref_container
+
+        # The last reference is this message's parent
+        if previous is not None and (previous is container or container.is_ancestor_of(previous)):
+            previous = None
+        container.set_parent(previous)
+
+    roots = [c for c in containers.values() if c.parent is None]
+    roots = _prune(roots)
+    return sorted(roots, key=_sort_key)
+
+def _prune(siblings):
+    """Drop empty containers, promoting their children one level up"""
+    result = []
+    for container in siblings:
+        container.children = _prune(container.children)
+        for child in container.children:
+            child.parent = container
+        if container.message is not None:
+            result.append(container)
+        else:
+            for child in container.children:
+                child.parent = None
+            result.extend(container.children)
+    return result
+
+def walk(roots):
+    """Depth-first walk yielding (container, depth, parent_container) with siblings in date order"""
+    stack = [(root, 0, None) for root in reversed(roots)]
+    while stack:
+        container, depth, parent = stack.pop()
+        yield container, depth, parent
+        for child in sorted(container.children, key=_sort_key, reverse=True):
+            stack.append((child, depth + 1, container))
+
+def order_messages(messages, get_id, get_chain):
+    """Return the messages in thread order"""
+    return [container.message for container, _, _ in walk(build_tree(messages, get_id, get_chain))]
+
+# ---------------------------------------------------------------------------
+# Database integration
+# ---------------------------------------------------------------------------
+
+def message_chain(message):
+    """Reference chain of a stored EmailMessage"""
+    return reference_chain(json.loads(message.references or '[]'), message.in_reply_to)
+
+def merge_threads(winner, loser):
+    """Move everything from `loser` into `winner` and delete `loser`"""
+    from app import db
+    from models import EmailMessage, ReplyJob, ThreadReference, ThreadSummary, PromptCache
+    import stats
+    import contacts
+
+    EmailMessage.query.filter_by(thread_id=loser.thread_id).update(
+        {'thread_id': winner.thread_id}, synchronize_session=False)
+    ThreadReference.query.filter_by(thread_id=loser.thread_id).update(
+        {'thread_id': winner.thread_id}, synchronize_session=False)
+    ReplyJob.query.filter_by(thread_id=loser.thread_id).delete(synchronize_session=False)
+    # The winner's summary stays valid; the loser's messages are folded into it later
+    ThreadSummary.query.filter_by(thread_id=loser.thread_id).delete(synchronize_session=False)
+    # The winner's cached prompt lacks the loser's messages
+    PromptCache.query.filter(PromptCache.thread_id.in_([winner.thread_id, loser.thread_id])).delete(synchronize_session=False)
+
+    if loser.last_updated and (not winner.last_updated or loser.last_updated > winner.last_updated):
+        winner.last_updated = loser.last_updated
+    contacts.merge_threads(winner, loser)
+    if not loser.reply_by_ia:
+        stats.set_thread_answered(winner, False)
+    stats.on_thread_removed(not loser.reply_by_ia, loser.triage_status == 'skip')
+    db.session.delete(loser)
+    db.session.flush()
+
+def resolve_thread(message_id, chain, subject):
+    """
+    Find (or create) the thread for a new message from its Message-ID and reference chain,
+    merging every thread the message links together. Returns (thread, created, merged_thread_ids).
+    """
+    from app import db
+    from models import EmailThread, ThreadReference
+
+    ids = [message_id] + [ref for ref in chain if ref != message_id]
+    thread_ids = {
+        thread_id for (thread_id,) in
+        db.session.query(ThreadReference.thread_id).filter(ThreadReference.message_id.in_(ids)).distinct()
+    }
+
+    created = False
+    merged = []
+    if not thread_ids:
+        thread = EmailThread()
+        thread.thread_id = str(uuid.uuid4())
+        thread.subject = subject
+        db.session.add(thread)
+        db.session.flush()
+        created = True
+    else:
+        threads = EmailThread.query.filter(EmailThread.thread_id.in_(thread_ids)).order_by(EmailThread.id).all()
+        thread = threads[0]
+        for loser in threads[1:]:
+            merged.append(loser.thread_id)
+            merge_threads(thread, loser)
+
+    # Remember every id this message mentions, including parents we have not received yet
+    known = {ref.message_id: ref for ref in ThreadReference.query.filter(ThreadReference.message_id.in_(ids))}
+    for ref_id in ids:
+        ref = known.get(ref_id)
+        if ref is None:
+            ref = ThreadReference()
+            ref.message_id = ref_id
+            db.session.add(ref)
+        ref.thread_id = thread.thread_id
+    db.session.flush()
+
+    return thread, created, merged
+
+def rebuild_thread_tree(thread_id):
+    """Recompute parent, depth and position of every message in a thread"""
+    from app import db
+    from models import EmailMessage
+    from sqlalchemy.orm import load_only
+
+    # Only the threading columns, never the bodies
+    messages = EmailMessage.query.options(load_only(
+        EmailMessage.id, EmailMessage.message_id, EmailMessage.references, EmailMessage.in_reply_to, EmailMessage.date,
+        EmailMessage.parent_message_id, EmailMessage.thread_position, EmailMessage.thread_depth
+    )).filter_by(thread_id=thread_id).all()
+    roots = build_tree(messages, lambda m: m.message_id, message_chain)
+
+    for position, (container, depth, parent) in enumerate(walk(roots)):
+        message = container.message
+        parent_id = parent.message_id if parent is not None else None
+        if (message.thread_position, message.thread_depth, message.parent_message_id) != (position, depth, parent_id):
+            message.thread_position = position
+            message.thread_depth = depth
+            message.parent_message_id = parent_id
+    db.session.flush()
+
+def _message_key(date, message_id):
+    # Same order as _sort_key for stored messages
+    date = date or datetime.max
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return (date, message_id)
+
+def attach_message(message, merged=False):
+    """
+    Place a newly stored message in its thread's materialized tree: insert it among its
+    parent's children in date order and shift the positions after it. Only when the new
+    message adds no link but its own parent; otherwise (threads were merged, stored messages
+    already reply to it, its chain names messages we never stored or disagrees with the stored
+    parents) build_tree could move other messages too, so it falls back to rebuild_thread_tree.
+    """
+    from app import db
+    from models import EmailMessage
+    from sqlalchemy import update, func, or_
+
+    thread_id = message.thread_id
+    others = EmailMessage.query.filter(EmailMessage.thread_id == thread_id, EmailMessage.id != message.id)
+    if merged or others.filter(or_(
+        EmailMessage.thread_position == None,
+        EmailMessage.in_reply_to == message.message_id,
+        EmailMessage.references.contains(json.dumps(message.message_id))
+    )).with_entities(EmailMessage.id).first() is not None:
+        rebuild_thread_tree(thread_id)
+        return
+
+    chain = [ref for ref in message_chain(message) if ref != message.message_id]
+    stored = {
+        message_id: (parent_message_id, position, depth) for message_id, parent_message_id, position, depth in others.filter(
+            EmailMessage.message_id.in_(chain)
+        ).with_entities(EmailMessage.message_id, EmailMessage.parent_message_id,
+                        EmailMessage.thread_position, EmailMessage.thread_depth)
+    } if chain else {}
+    # Phantom ids link messages through each other, and a chain can adopt a stored root:
+    # each reference must be stored and already be the child of the one before it
+    if any(ref not in stored for ref in chain) or any(
+            stored[ref][0] != previous for previous, ref in zip(chain, chain[1:])):
+        rebuild_thread_tree(thread_id)
+        return
+    parent_id = chain[-1] if chain else None
+
+    if parent_id is not None:
+        _, parent_position, parent_depth = stored[parent_id]
+        depth = parent_depth + 1
+        # The parent's subtree ends at the next message that is not deeper than the parent
+        end = others.filter(
+            EmailMessage.thread_position > parent_position, EmailMessage.thread_depth <= parent_depth
+        ).with_entities(func.min(EmailMessage.thread_position)).scalar()
+        siblings = others.filter(EmailMessage.parent_message_id == parent_id, EmailMessage.thread_depth == depth)
+    else:
+        depth = 0
+        end = None
+        siblings = others.filter(EmailMessage.thread_depth == 0)
+    if end is None:
+        last = others.with_entities(func.max(EmailMessage.thread_position)).scalar()
+        end = last + 1 if last is not None else 0
+
+    # Before the first sibling that sorts after the new message, else at the end of the parent's subtree
+    key = _message_key(message.date, message.message_id)
+    later = [position for position, date, message_id in siblings.with_entities(
+        EmailMessage.thread_position, EmailMessage.date, EmailMessage.message_id
+    ) if _message_key(date, message_id) > key]
+    position = min(later) if later else end
+
+    db.session.execute(
+        update(EmailMessage).where(
+            EmailMessage.thread_id == thread_id,
+            EmailMessage.id != message.id,
+            EmailMessage.thread_position >= position
+        ).values(thread_position=EmailMessage.thread_position + 1).execution_options(synchronize_session=False)
+    )
+    message.parent_message_id = parent_id
+    message.thread_depth = depth
+    message.thread_position = position
+    db.session.flush()
+
+def rebuild_all_threads():
+    """Backfill thread_reference and the thread trees from the stored messages"""
+    from app import db
+    from models import EmailMessage, EmailThread, ThreadReference
+
+    ThreadReference.query.delete()
+    db.session.flush()
+
+    touched = set()
+    for message in EmailMessage.query.order_by(EmailMessage.date.asc(), EmailMessage.id.asc()).all():
+        thread_ids = {
+            thread_id for (thread_id,) in db.session.query(ThreadReference.thread_id).filter(
+                ThreadReference.message_id.in_([message.message_id] + message_chain(message))
+            ).distinct()
+        }
+        thread_ids.add(message.thread_id)
+        threads = EmailThread.query.filter(EmailThread.thread_id.in_(thread_ids)).order_by(EmailThread.id).all()
+        thread = threads[0]
+        for loser in threads[1:]:
+            touched.discard(loser.thread_id)
+            merge_threads(thread, loser)
+        db.session.refresh(message)
+
+        for ref_id in [message.message_id] + message_chain(message):
+            ref = db.session.get(ThreadReference, ref_id)
+            if ref is None:
+                ref = ThreadReference()
+                ref.message_id = ref_id
+                db.session.add(ref)
+            ref.thread_id = thread.thread_id
+        db.session.flush()
+        touched.add(thread.thread_id)
+
+    for thread_id in touched:
+        rebuild_thread_tree(thread_id)
+    db.session.commit()
+    return len(touched)
+
+if __name__ == "__main__":
+    # Backfill existing databases: python email_threading.py
+    from app import app
+    with app.app_context():
+        print(f"Rebuilt {rebuild_all_threads()} threads")
@@ -75,3 +75,100 @@ def get_email_body(msg):
                 print(f"Error al decodificar HTML: {e}")
                 body = ""
     return body
+
+# Attribution lines that introduce a quoted reply ("On ... wrote:", "El ... escribió:", ...)
+ATTRIBUTION_RE = re.compile(
+    r'^\s*(On\b.+\bwrote|El\b.+\bescribi[óo]|Em\b.+\bescreveu|Le\b.+\ba écrit|Am\b.+\bschrieb)\s*:\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+# Separators inserted by Outlook and other clients before the forwarded/quoted message
+SEPARATOR_RE = re.compile(
+    r'^\s*(-{2,}\s*(Original Message|Mensaje original|Forwarded message|Mensaje reenviado)\s*-{2,}|_{10,})\s*$',
+    re.IGNORECASE
+)
+HEADER_FROM_RE = re.compile(r'^\s*\*?(From|De)\s*:\*?\s+\S', re.IGNORECASE)
+HEADER_OTHER_RE = re.compile(r'^\s*\*?(Sent|Enviado el|Enviado|Date|Fecha|To|Para|Subject|Asunto)\s*:', re.IGNORECASE)
+SIGNATURE_DELIMITER_RE = re.compile(r'^-- ?$')
+MOBILE_SIGNATURE_RE = re.compile(
+    r'^\s*(Sent from my|Enviado desde mi|Get Outlook for|Obtener Outlook para)\b', re.IGNORECASE
+)
+
+def _quote_start(lines):
+    """Index of the first line of the quoted history, or None"""
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        # Attributions are often wrapped over two lines by the sending client
+        if ATTRIBUTION_RE.match(line) or (i + 1 < len(lines) and ATTRIBUTION_RE.match(line + ' ' + lines[i + 1])):
+            return i
+        if SEPARATOR_RE.match(line):
+            return i
+        if HEADER_FROM_RE.match(line) and sum(1 for l in lines[i + 1:i + 5] if HEADER_OTHER_RE.match(l)) >= 2:
+            return i
+
+    # A trailing block of '>' lines (inline replies interleaved with quotes are kept as they are)
+    start = None
+    for i in range(len(lines) - 1, -1, -1):
+        stripped = lines[i].strip()
+        if stripped.startswith('>'):
+            start = i
+        elif stripped:
+            break
+    return start
+
+def _signature_start(lines):
+    """Index of the first signature line, or None"""
+    for i, line in enumerate(lines):
+        if SIGNATURE_DELIMITER_RE.match(line):
+            return i
+    for i in range(len(lines) - 1, -1, -1):
+        if not lines[i].strip():
+            continue
+        return i if MOBILE_SIGNATURE_RE.match(lines[i]) else None
+    return None
+
+def split_reply(body):
+    """
+    Separa un cuerpo de correo en (texto nuevo, texto citado, firma).
+    Si no se detecta nada que recortar, el texto nuevo es el cuerpo completo.
+    """
+    if not body:
+        return body or '', '', ''
+
+    lines = body.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+
+    quoted = ''
+    start = _quote_start(lines)
+    if start is not None:
+        quoted = '\n'.join(lines[start:]).strip()
+        lines = lines[:start]
+
+    signature = ''
+    start = _signature_start(lines)
+    if start is not None:
+        signature = '\n'.join(lines[start:]).strip()
+        lines = lines[:start]
+
+    new_text = '\n'.join(lines).strip()
+    if not new_text:
+        # Nothing left (e.g. a bare forward): keep the original so no content is lost
+        return body.strip(), '', ''
+    return new_text, quoted, signature
+
+if __name__ == "__main__":
+    # Re-split bodies stored before the quoted-text stage existed: python email_utils.py
+    from app import app, db
+    from models import EmailMessage
+
+    with app.app_context():
+        updated = 0
+        for message in EmailMessage.query.filter(EmailMessage.quoted_body == None, EmailMessage.signature == None).yield_per(500):
+            new_text, quoted, signature = split_reply(message.body)
+            if new_text != message.body:
+                parent_stored = message.in_reply_to and db.session.query(EmailMessage.id).filter_by(message_id=message.in_reply_to).first()
+                message.body = new_text
+                message.quoted_body = None if parent_stored else quoted or None
+                message.signature = signature or None
+                updated += 1
+        db.session.commit()
+        print(f"Stripped quoted text from {updated} messages")
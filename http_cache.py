@@ -0,0 +1,97 @@
+#http_cache.py
+
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from flask import request, session, make_response
+
+try:
+    import brotli
+except ImportError:  # Optional dependency, gzip is used without it
+    brotli = None
+
+# Response caching configuration
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', '16'))  # 0 disables the server-side cache
+COMPRESSIBLE_TYPES = {'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript'}
+
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
+
+def make_etag(*parts):
+    """Build an ETag from the values that determine a response"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+def _fragment_get(key):
+    with _fragments_lock:
+        body = _fragments.get(key)
+        if body is not None:
+            _fragments.move_to_end(key)
+        return body
+
+def _fragment_set(key, body):
+    with _fragments_lock:
+        _fragments[key] = body
+        _fragments.move_to_end(key)
+        while len(_fragments) > FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+
+def cached_response(etag, render, last_modified=None):
+    """
+    Answer with 304 when the client already has `etag`, otherwise call render()
+    (or reuse a cached body for the same etag) and tag the response.
+    Pages with pending flash messages are always rendered fresh.
+    """
+    if session.get('_flashes'):
+        return make_response(render())
+
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        key = (request.endpoint, etag)
+        body = _fragment_get(key) if FRAGMENT_CACHE_SIZE else None
+        if body is None:
+            body = render()
+            if FRAGMENT_CACHE_SIZE and isinstance(body, (str, bytes)):
+                _fragment_set(key, body)
+        response = make_response(body)
+
+    # Weak, because the same entity may be sent gzip- or brotli-encoded
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def compress_response(response):
+    """Compress large text responses with brotli or gzip according to Accept-Encoding"""
+    if (response.direct_passthrough or response.is_streamed
+            or not 200 <= response.status_code < 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        data = brotli.compress(data, quality=min(COMPRESS_LEVEL, 11))
+        encoding = 'br'
+    elif accepted['gzip']:
+        data = gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+        encoding = 'gzip'
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def init_app(app):
+    app.after_request(compress_response)
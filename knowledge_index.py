@@ -0,0 +1,334 @@
+#knowledge_index.py
+
+"""
+Índice vectorial sobre los archivos de agente_ia/info para recuperar solo los fragmentos
+relevantes de cada hilo en lugar de incluir toda la base de conocimiento en el prompt.
+
+Los archivos se dividen en fragmentos por párrafos, cada fragmento se embebe una sola vez
+(se reutiliza por hash de contenido) y la búsqueda es por producto escalar con NumPy, o con
+hnswlib si está instalado y el índice es grande. HashingEmbedder es un sustituto local y
+determinista de la API de embeddings para pruebas y benchmarks.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+import zlib
+import numpy as np
+from metrics import timed
+from config_service import config
+
+try:
+    import hnswlib
+except ImportError:  # Optional dependency, brute force is used without it
+    hnswlib = None
+
+# Retrieval configuration
+KNOWLEDGE_RETRIEVAL = os.getenv('KNOWLEDGE_RETRIEVAL', '1') == '1'  # 0 puts info_principal.txt in every prompt as before
+KNOWLEDGE_TOP_K = int(os.getenv('KNOWLEDGE_TOP_K', '4'))
+KNOWLEDGE_CHUNK_CHARS = int(os.getenv('KNOWLEDGE_CHUNK_CHARS', '800'))
+KNOWLEDGE_EMBEDDER = os.getenv('KNOWLEDGE_EMBEDDER', '')  # 'openai' or 'hashing'; default depends on API_OPENAI
+KNOWLEDGE_EMBEDDING_MODEL = os.getenv('KNOWLEDGE_EMBEDDING_MODEL', 'text-embedding-3-small')
+KNOWLEDGE_ANN_MIN_CHUNKS = int(os.getenv('KNOWLEDGE_ANN_MIN_CHUNKS', '5000'))  # Below this brute force is faster
+
+TOKEN_RE = re.compile(r'\w{2,}')
+
+class HashingEmbedder:
+    """Signed feature hashing of words and word pairs. Needs no network or model files."""
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def _tokens(self, text):
+        text = unicodedata.normalize('NFKD', text.lower())
+        words = TOKEN_RE.findall(''.join(c for c in text if not unicodedata.combining(c)))
+        return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in self._tokens(text):
+                h = zlib.crc32(token.encode('utf-8'))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return _normalize(vectors)
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API, in batches"""
+
+    def __init__(self, model=KNOWLEDGE_EMBEDDING_MODEL, batch_size=100):
+        import openai
+        openai.api_key = config.get('API_OPENAI')
+        self.openai = openai
+        self.model = model
+        self.batch_size = batch_size
+        self.name = f'openai-{model}'
+
+    def embed(self, texts):
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            with timed('embedding_call'):
+                response = self.openai.Embedding.create(model=self.model, input=texts[start:start + self.batch_size])
+            rows.extend(item['embedding'] for item in sorted(response['data'], key=lambda item: item['index']))
+        return _normalize(np.array(rows, dtype=np.float32))
+
+def default_embedder():
+    name = KNOWLEDGE_EMBEDDER or ('openai' if config.get('API_OPENAI') else 'hashing')
+    return OpenAIEmbedder() if name == 'openai' else HashingEmbedder()
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def chunk_text(text, max_chars=KNOWLEDGE_CHUNK_CHARS):
+    """Split text into chunks of whole paragraphs (or sentences, for long paragraphs) up to max_chars"""
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if len(paragraph) <= max_chars:
+            if paragraph:
+                pieces.append(paragraph)
+            continue
+        for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+            while len(sentence) > max_chars:
+                pieces.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence:
+                pieces.append(sentence)
+
+    chunks = []
+    current = ''
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f'{current}\n\n{piece}' if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _info_state(info_dir):
+    state = []
+    if os.path.exists(info_dir):
+        for entry in sorted(os.scandir(info_dir), key=lambda e: e.name):
+            if entry.is_file() and entry.name.endswith('.txt'):
+                stat = entry.stat()
+                state.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(state)
+
+def _build_ann(chunks, vectors):
+    if hnswlib is None or len(chunks) < KNOWLEDGE_ANN_MIN_CHUNKS:
+        return None
+    ann = hnswlib.Index(space='ip', dim=vectors.shape[1])
+    ann.init_index(max_elements=len(chunks), ef_construction=200, M=16)
+    ann.add_items(vectors, np.arange(len(chunks)))
+    ann.set_ef(64)
+    return ann
+
+class KnowledgeIndex:
+    def __init__(self, agente_dir, embedder=None):
+        self.info_dir = os.path.join(agente_dir, 'info')
+        self.index_dir = os.path.join(agente_dir, 'index')
+        self.embedder = embedder or default_embedder()
+        self.files = {}  # filename -> {'mtime_ns', 'size', 'chunks': [{'hash', 'text'}]}
+        # (chunks, vectors, ann) swapped as one value so searches never mix two versions.
+        # chunks is a flat list of {'file', 'ordinal', 'hash', 'text'}, one per row of vectors.
+        self._snapshot = ([], np.zeros((0, 0), dtype=np.float32), None)
+        self.state = None  # _info_state of the indexed files, None until the index is built
+        self._lock = threading.Lock()  # Serializes refreshes
+        self._refreshing = None  # Background refresh thread, while one runs
+        self._rerun = False  # Files may have changed after the running refresh read them
+        self._callbacks = []  # then() of every refresh_async call not yet served
+        self._refreshing_lock = threading.Lock()
+        self._load()
+
+    @property
+    def chunks(self):
+        return self._snapshot[0]
+
+    @property
+    def vectors(self):
+        return self._snapshot[1]
+
+    def is_stale(self):
+        return _info_state(self.info_dir) != self.state
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def _load(self):
+        meta_path = os.path.join(self.index_dir, 'index.json')
+        vectors_path = os.path.join(self.index_dir, 'vectors.npy')
+        if not (os.path.exists(meta_path) and os.path.exists(vectors_path)):
+            return
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('embedder') != self.embedder.name:
+                return  # Vectors from another embedder are not comparable
+            vectors = np.load(vectors_path)
+            self._snapshot = (meta['chunks'], vectors, _build_ann(meta['chunks'], vectors))
+            self.files = meta['files']
+            self.state = tuple((name, info['mtime_ns'], info['size']) for name, info in sorted(self.files.items()))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Índice de conocimiento ilegible, se reconstruirá: {e}")
+            self.files, self.state = {}, None
+            self._snapshot = ([], np.zeros((0, 0), dtype=np.float32), None)
+
+    def _save(self, chunks, vectors):
+        os.makedirs(self.index_dir, exist_ok=True)
+        meta_path = os.path.join(self.index_dir, 'index.json')
+        vectors_path = os.path.join(self.index_dir, 'vectors.npy')
+        with open(vectors_path + '.tmp', 'wb') as f:
+            np.save(f, vectors)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'embedder': self.embedder.name, 'files': self.files, 'chunks': chunks}, f, ensure_ascii=False)
+        os.replace(vectors_path + '.tmp', vectors_path)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    # ------------------------------------------------------------------
+    # Indexing and search
+    # ------------------------------------------------------------------
+
+    def refresh(self):
+        """Re-chunk changed files and embed only chunks not seen before. Returns the number embedded."""
+        with self._lock:
+            state = _info_state(self.info_dir)
+            if state == self.state:
+                return 0
+
+            old_chunks, old_vectors, _ = self._snapshot
+            cached = {chunk['hash']: old_vectors[i] for i, chunk in enumerate(old_chunks)}
+            files = {}
+            chunks = []
+            for name, mtime_ns, size in state:
+                previous = self.files.get(name)
+                if previous and (previous['mtime_ns'], previous['size']) == (mtime_ns, size):
+                    file_chunks = previous['chunks']
+                else:
+                    with open(os.path.join(self.info_dir, name), 'r', encoding='utf-8') as f:
+                        file_chunks = [
+                            {'hash': hashlib.sha1(text.encode('utf-8')).hexdigest(), 'text': text}
+                            for text in chunk_text(f.read())
+                        ]
+                files[name] = {'mtime_ns': mtime_ns, 'size': size, 'chunks': file_chunks}
+                for ordinal, chunk in enumerate(file_chunks):
+                    chunks.append({'file': name, 'ordinal': ordinal, **chunk})
+
+            missing = {}
+            for chunk in chunks:
+                if chunk['hash'] not in cached:
+                    missing[chunk['hash']] = chunk['text']
+            if missing:
+                with timed('knowledge_embed'):
+                    vectors = self.embedder.embed(list(missing.values()))
+                cached.update(zip(missing.keys(), vectors))
+
+            if chunks:
+                vectors = np.vstack([cached[chunk['hash']] for chunk in chunks]).astype(np.float32)
+            else:
+                vectors = np.zeros((0, 0), dtype=np.float32)
+            # Everything is built before the swap; searches keep using the old snapshot until here
+            self._snapshot = (chunks, vectors, _build_ann(chunks, vectors))
+            self.files = files
+            self.state = state
+            self._save(chunks, vectors)
+            return len(missing)
+
+    def refresh_async(self, then=None):
+        """
+        Refresh in a background thread (one at a time), then call then(). A call while a
+        refresh runs queues one more pass and its callback. Returns the running thread.
+        """
+        with self._refreshing_lock:
+            if then is not None:
+                self._callbacks.append(then)
+            if self._refreshing is not None:
+                self._rerun = True
+                return self._refreshing
+            self._refreshing = threading.Thread(target=self._refresh_loop, name='knowledge-refresh')
+            self._refreshing.daemon = True
+            self._refreshing.start()
+            return self._refreshing
+
+    def _refresh_loop(self):
+        from log_utils import add_log
+
+        while True:
+            with self._refreshing_lock:
+                self._rerun = False
+                callbacks, self._callbacks = self._callbacks, []
+            try:
+                embedded = self.refresh()
+                add_log('INFO', f'Knowledge index refreshed ({embedded} new chunks embedded)')
+            except Exception as e:
+                add_log('ERROR', f'Error refreshing the knowledge index: {str(e)}')
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    add_log('ERROR', f'Error after refreshing the knowledge index: {str(e)}')
+            with self._refreshing_lock:
+                if not self._rerun and not self._callbacks:
+                    self._refreshing = None
+                    return
+
+    def search(self, query, k=KNOWLEDGE_TOP_K):
+        """Top-k chunks for `query` as dicts with an added 'score', best first"""
+        chunks, vectors, ann = self._snapshot
+        if not chunks or not query.strip():
+            return []
+        k = min(k, len(chunks))
+        with timed('knowledge_search'):
+            q = self.embedder.embed([query])[0]
+            if ann is not None:
+                labels, distances = ann.knn_query(q, k=k)
+                hits = [(int(i), 1.0 - float(d)) for i, d in zip(labels[0], distances[0])]
+            else:
+                scores = vectors @ q
+                top = np.argpartition(-scores, k - 1)[:k]
+                hits = sorted(((int(i), float(scores[i])) for i in top), key=lambda hit: -hit[1])
+        return [dict(chunks[i], score=score) for i, score in hits]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(agente_dir):
+    """Process-wide index for an agente_ia directory"""
+    with _indexes_lock:
+        index = _indexes.get(agente_dir)
+        if index is None:
+            index = _indexes[agente_dir] = KnowledgeIndex(agente_dir)
+        return index
+
+def retrieve(agente_dir, query, k=None):
+    """
+    Top-k chunks for the query from the current index, or None while the index has never been built.
+    Changed info files are re-indexed in the background; embedding never runs on the caller's thread.
+    """
+    index = get_index(agente_dir)
+    if index.is_stale():
+        index.refresh_async()
+    if index.state is None:
+        return None
+    return index.search(query, k or KNOWLEDGE_TOP_K)
+
+def schedule_refresh(agente_dir, then=None):
+    """Re-index in the background (at startup and after an upload)"""
+    return get_index(agente_dir).refresh_async(then)
+
+if __name__ == "__main__":
+    # Rebuild and query the index: python knowledge_index.py "pregunta"
+    import sys
+    agente_dir = os.getenv('AGENTE_IA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agente_ia')
+    index = get_index(agente_dir)
+    print(f"{index.refresh()} fragmentos embebidos, {len(index.chunks)} en el índice ({index.embedder.name})")
+    if len(sys.argv) > 1:
+        for hit in index.search(' '.join(sys.argv[1:])):
+            print(f"{hit['score']:.3f} {hit['file']}#{hit['ordinal']}: {hit['text'][:100]!r}")
@@ -0,0 +1,137 @@
+#log_utils.py
+
+import gzip
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from app import app, db
+from models import Log
+from sqlalchemy import inspect
+
+# Log lifecycle configuration
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '30'))
+LOG_PRUNE_BATCH = int(os.getenv('LOG_PRUNE_BATCH', '1000'))
+LOG_PRUNE_INTERVAL = int(os.getenv('LOG_PRUNE_INTERVAL', '3600'))  # Seconds between automatic prunes
+LOG_ARCHIVE_DIR = os.getenv('LOG_ARCHIVE_DIR', '')  # Roll pruned rows into daily .jsonl.gz files when set
+
+def _parse_sample_rates(value):
+    """Parse 'INFO:0.1,WARNING:0.5' into {'INFO': 0.1, 'WARNING': 0.5}"""
+    rates = {}
+    for item in value.split(','):
+        if ':' in item:
+            level, rate = item.split(':', 1)
+            rates[level.strip().upper()] = float(rate)
+    return rates
+
+# Fraction of sampled (noisy) logs kept per level; unlisted levels are always kept
+LOG_SAMPLE_RATES = _parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', 'INFO:1,WARNING:1'))
+
+_log_table_ready = False
+_last_prune = 0.0
+
+def ensure_log_table():
+    """Create the Log table if it is missing, checking the schema only once per process"""
+    global _log_table_ready
+    if _log_table_ready:
+        return
+    inspector = inspect(db.engine)
+    if 'log' not in inspector.get_table_names():
+        db.create_all()
+        app.logger.info('Log table created')
+    _log_table_ready = True
+
+def add_log(level, message, sampled=False):
+    """Add a log entry to the database. Sampled entries are kept at the level's LOG_SAMPLE_RATES rate."""
+    if sampled and random.random() >= LOG_SAMPLE_RATES.get(level, 1.0):
+        return
+    try:
+        with app.app_context():
+            ensure_log_table()
+
+            log = Log()
+            log.level = level
+            log.message = message
+            db.session.add(log)
+            db.session.commit()
+    except Exception as e:
+        print(f"Error adding log: {str(e)}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+
+def query_logs(before_id=None, level=None, limit=50):
+    """Keyset-paginated logs, newest first. Returns (logs, next_before_id)."""
+    query = Log.query
+    if level:
+        query = query.filter(Log.level == level)
+    if before_id:
+        query = query.filter(Log.id < before_id)
+    logs = query.order_by(Log.id.desc()).limit(limit + 1).all()
+
+    next_before_id = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_before_id = logs[-1].id
+    return logs, next_before_id
+
+def _archive(logs):
+    """Append logs to one gzip-compressed JSONL file per day"""
+    os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+    by_day = {}
+    for log in logs:
+        by_day.setdefault(log.timestamp.strftime('%Y-%m-%d'), []).append(log)
+    for day, day_logs in by_day.items():
+        path = os.path.join(LOG_ARCHIVE_DIR, f'logs-{day}.jsonl.gz')
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for log in day_logs:
+                f.write(json.dumps({
+                    'id': log.id,
+                    'timestamp': log.timestamp.isoformat(),
+                    'level': log.level,
+                    'message': log.message
+                }, ensure_ascii=False) + '\n')
+
+def prune_logs(retention_days=None, batch_size=None):
+    """Delete logs older than the retention period in small batches. Returns the number deleted."""
+    retention_days = LOG_RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or LOG_PRUNE_BATCH
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+
+    deleted = 0
+    while True:
+        batch = Log.query.filter(Log.timestamp < cutoff).order_by(Log.id).limit(batch_size).all()
+        if not batch:
+            break
+        if LOG_ARCHIVE_DIR:
+            _archive(batch)
+        ids = [log.id for log in batch]
+        Log.query.filter(Log.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+    return deleted
+
+def maybe_prune_logs():
+    """Prune logs if LOG_PRUNE_INTERVAL has elapsed since the last prune in this process"""
+    global _last_prune
+    if time.monotonic() - _last_prune < LOG_PRUNE_INTERVAL:
+        return 0
+    _last_prune = time.monotonic()
+    try:
+        deleted = prune_logs()
+        if deleted:
+            add_log('INFO', f'Pruned {deleted} logs older than {LOG_RETENTION_DAYS} days')
+        return deleted
+    except Exception as e:
+        db.session.rollback()
+        add_log('ERROR', f'Error pruning logs: {str(e)}')
+        return 0
+
+if __name__ == "__main__":
+    # Manual prune: python log_utils.py
+    with app.app_context():
+        print(f"Deleted {prune_logs()} logs")
@@ -1,6 +1,12 @@
 #main.py
 
-from app import app
+from app import app, AGENTE_IA_DIR
+import routes  # Register the agente routes
+import knowledge_index
+
+if knowledge_index.KNOWLEDGE_RETRIEVAL:
+    # Embed new or changed info files now instead of on the first prompt build
+    knowledge_index.schedule_refresh(AGENTE_IA_DIR)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,123 @@
+#metrics.py
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from fast DB commits up to slow GPT calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Number of recent samples kept per stage to compute percentiles
+RECENT_SAMPLES = 1024
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+    def percentile(self, q):
+        if not self.recent:
+            return None
+        samples = sorted(self.recent)
+        index = min(len(samples) - 1, int(round(q * (len(samples) - 1))))
+        return samples[index]
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+
+def observe(stage, seconds):
+    """Record the duration of one execution of a pipeline stage"""
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+def inc(name, amount=1, **labels):
+    """Increment a counter, optionally with labels"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def register_gauge(name, collect):
+    """Expose a gauge computed when metrics are rendered; collect() returns [(labels dict, value)]"""
+    with _lock:
+        _gauges[name] = collect
+
+@contextmanager
+def timed(stage):
+    """Time a block of code as a pipeline stage, counting errors separately"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc('bot_stage_errors_total', stage=stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        lines.append('# HELP bot_stage_duration_seconds Duration of each bot pipeline stage.')
+        lines.append('# TYPE bot_stage_duration_seconds histogram')
+        for stage, histogram in sorted(_histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                lines.append(f'bot_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'bot_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'bot_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'bot_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        names = sorted({name for name, _ in _counters})
+        for name in names:
+            lines.append(f'# TYPE {name} counter')
+            for (counter_name, labels), value in sorted(_counters.items()):
+                if counter_name == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+        gauges = sorted(_gauges.items())
+
+    for name, collect in gauges:
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in collect():
+            lines.append(f'{name}{_format_labels(sorted(labels.items()))} {value}')
+    return '\n'.join(lines) + '\n'
+
+def summary():
+    """Return count, p50 and p95 (in milliseconds) for every stage"""
+    result = {}
+    with _lock:
+        for stage, histogram in sorted(_histograms.items()):
+            p50 = histogram.percentile(0.5)
+            p95 = histogram.percentile(0.95)
+            result[stage] = {
+                'count': histogram.count,
+                'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+                'p95_ms': round(p95 * 1000, 2) if p95 is not None else None
+            }
+    return result
+
+def reset():
+    """Clear all collected metrics"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
@@ -1,8 +1,8 @@
 from app import db
 from flask_login import UserMixin
 from datetime import datetime
-from sqlalchemy import inspect
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
+from auth import verify_password, invalidate_user
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,14 +12,18 @@ class User(UserMixin, db.Model):
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
+        invalidate_user(self.id)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
 class Log(db.Model):
     __tablename__ = 'log'
+    __table_args__ = (
+        db.Index('ix_log_level_id', 'level', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     level = db.Column(db.String(20), nullable=False)
     message = db.Column(db.Text, nullable=False)
 
@@ -39,18 +43,108 @@ class EmailThread(db.Model):
     subject = db.Column(db.String(255))
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     reply_by_ia = db.Column(db.Boolean, nullable=False, default=False)
+    # Set by triage.py from the latest received message: 'reply' or 'skip'
+    triage_status = db.Column(db.String(10), nullable=False, default='reply', index=True)
+    triage_reason = db.Column(db.String(50))
 
 class EmailMessage(db.Model):
     __tablename__ = 'email_message'
     id = db.Column(db.Integer, primary_key=True)
     message_id = db.Column(db.String(255), unique=True, nullable=False)
-    thread_id = db.Column(db.String(255), db.ForeignKey('email_thread.thread_id'), nullable=False)
+    thread_id = db.Column(db.String(255), db.ForeignKey('email_thread.thread_id'), nullable=False, index=True)
     from_name = db.Column(db.String(255))
-    from_email = db.Column(db.String(255), nullable=False)
+    from_email = db.Column(db.String(255), nullable=False, index=True)
     subject = db.Column(db.String(255))
-    body = db.Column(db.Text)
+    body = db.Column(db.Text)  # New content only, see email_utils.split_reply
+    quoted_body = db.Column(db.Text)  # Quoted history, kept only when the quoted message is not stored
+    signature = db.Column(db.Text)
     date = db.Column(db.DateTime, default=datetime.utcnow)
     in_reply_to = db.Column(db.String(255))
     references = db.Column(db.Text)
     folder = db.Column(db.String(50), nullable=False, default='INBOX')
     reply_by_ia = db.Column(db.Boolean, nullable=False, default=False)
+    # Materialized reply tree, maintained by email_threading
+    parent_message_id = db.Column(db.String(255))
+    thread_position = db.Column(db.Integer)
+    thread_depth = db.Column(db.Integer, nullable=False, default=0)
+
+class ThreadReference(db.Model):
+    """Every Message-ID seen (received or only referenced) and the thread it belongs to"""
+    __tablename__ = 'thread_reference'
+    message_id = db.Column(db.String(255), primary_key=True)
+    thread_id = db.Column(db.String(255), db.ForeignKey('email_thread.thread_id'), nullable=False, index=True)
+
+class ThreadSummary(db.Model):
+    """Rolling summary of the older messages of a thread, maintained by thread_summary.py"""
+    __tablename__ = 'thread_summary'
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.String(255), db.ForeignKey('email_thread.thread_id'), unique=True, nullable=False)
+    summary = db.Column(db.Text, nullable=False)
+    message_ids = db.Column(db.Text, nullable=False, default='[]')  # JSON list of EmailMessage.id folded into the summary
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PromptCache(db.Model):
+    """Prompt of a thread built for one version of the resource files, maintained by prompt_cache.py"""
+    __tablename__ = 'prompt_cache'
+    __table_args__ = (db.UniqueConstraint('thread_id', 'resource_version'),)
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.String(255), db.ForeignKey('email_thread.thread_id'), nullable=False)
+    resource_version = db.Column(db.String(40), nullable=False)
+    thread_updated = db.Column(db.DateTime)  # EmailThread.last_updated when the prompt was built
+    summary_pending = db.Column(db.Integer, nullable=False, default=0)  # Older messages not yet in the thread summary
+    prompt = db.Column(db.Text, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Contact(db.Model):
+    """Sender seen in the mailbox with running totals, maintained incrementally by contacts.py"""
+    __tablename__ = 'contact'
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(255), unique=True, nullable=False)  # Normalized (lowercase) address
+    name = db.Column(db.String(255))  # Latest display name used
+    first_seen = db.Column(db.DateTime)  # Message dates, in UTC
+    last_seen = db.Column(db.DateTime, index=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    thread_count = db.Column(db.Integer, nullable=False, default=0)
+    unanswered_threads = db.Column(db.Integer, nullable=False, default=0)
+
+class ContactThread(db.Model):
+    """Threads a contact has written in"""
+    __tablename__ = 'contact_thread'
+    contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), primary_key=True)
+    thread_id = db.Column(db.String(255), db.ForeignKey('email_thread.thread_id'), primary_key=True, index=True)
+
+class ReplyJob(db.Model):
+    __tablename__ = 'reply_job'
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.String(255), db.ForeignKey('email_thread.thread_id'), unique=True, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime, index=True)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ClusterNode(db.Model):
+    """Ingestion node taking part in cluster mode, kept alive by heartbeats (cluster.py)"""
+    __tablename__ = 'cluster_node'
+    node_id = db.Column(db.String(100), primary_key=True)
+    hostname = db.Column(db.String(255))
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    heartbeat_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class IngestLease(db.Model):
+    """Ownership of one mailbox/folder shard. `epoch` grows on every change of owner and fences stale owners."""
+    __tablename__ = 'ingest_lease'
+    shard = db.Column(db.String(255), primary_key=True)
+    owner = db.Column(db.String(100))
+    epoch = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.DateTime)
+    acquired_at = db.Column(db.DateTime)
+
+class StatCounter(db.Model):
+    """Aggregate counters maintained incrementally by stats.py"""
+    __tablename__ = 'stat_counter'
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
@@ -0,0 +1,119 @@
+#poll_scheduler.py
+
+"""
+Planificador del sondeo IMAP de bot_process.
+
+El intervalo se adapta al ritmo de llegada observado: vuelve al mínimo en cuanto llega
+correo y crece gradualmente mientras el buzón está inactivo, sin superar el tiempo
+esperado hasta el siguiente mensaje. Los errores se reintentan con backoff exponencial
+con jitter en lugar de detener el bot, y poll_now() despierta el bucle al instante.
+"""
+
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+# Polling configuration
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', '15'))  # Seconds between polls right after new mail
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', '600'))  # Upper bound for idle mailboxes
+POLL_IDLE_FACTOR = float(os.getenv('POLL_IDLE_FACTOR', '1.5'))  # Growth per empty poll
+POLL_RATE_HALFLIFE = float(os.getenv('POLL_RATE_HALFLIFE', '3600'))  # Seconds for the arrival-rate estimate to halve
+POLL_BACKOFF_BASE = float(os.getenv('POLL_BACKOFF_BASE', '30'))
+POLL_BACKOFF_MAX = float(os.getenv('POLL_BACKOFF_MAX', '900'))
+
+def _iso(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat(timespec='seconds') + 'Z' if timestamp else None
+
+class PollScheduler:
+    def __init__(self, min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start from the minimum interval (called when the bot starts)"""
+        with self._lock:
+            self.interval = self.min_interval
+            self.rate = 0.0  # Exponentially decayed arrivals per second
+            self.failures = 0
+            self.last_error = None
+            self.last_poll = None
+            self.last_arrival = None
+            self.next_poll = None
+            self.polls = 0
+            self.manual_polls = 0
+            self._delay = 0.0
+            self._wake.clear()
+
+    def record_success(self, new_messages):
+        """Update the arrival rate after a successful poll and pick the next interval"""
+        now = time.time()
+        with self._lock:
+            elapsed = max(now - self.last_poll, 1.0) if self.last_poll else self.interval
+            decay = 0.5 ** (elapsed / POLL_RATE_HALFLIFE)
+            self.rate = self.rate * decay + (new_messages / elapsed) * (1 - decay)
+            self.last_poll = now
+            self.polls += 1
+            self.failures = 0
+            self.last_error = None
+
+            if new_messages:
+                self.last_arrival = now
+                self.interval = self.min_interval
+            else:
+                # Grow gradually, but not past the expected time until the next message
+                expected_gap = 1 / self.rate if self.rate > 0 else self.max_interval
+                self.interval = min(self.interval * POLL_IDLE_FACTOR, max(expected_gap, self.min_interval), self.max_interval)
+            self._delay = self.interval
+            return self._delay
+
+    def record_failure(self, error):
+        """Exponential backoff with jitter. Returns the delay before the next attempt."""
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            ceiling = min(POLL_BACKOFF_MAX, POLL_BACKOFF_BASE * 2 ** (self.failures - 1))
+            self._delay = random.uniform(ceiling / 2, ceiling)
+            return self._delay
+
+    def wait(self):
+        """Sleep until the next poll is due or poll_now() is called. Returns True if woken early."""
+        with self._lock:
+            self.next_poll = time.time() + self._delay
+            delay = self._delay
+        woken = self._wake.wait(delay)
+        self._wake.clear()
+        with self._lock:
+            self.next_poll = None
+        return woken
+
+    def wake(self):
+        """Interrupt the current wait (used when stopping the bot)"""
+        self._wake.set()
+
+    def poll_now(self):
+        """Wake the bot loop immediately for an extra poll"""
+        with self._lock:
+            self.manual_polls += 1
+        self._wake.set()
+
+    def state(self):
+        with self._lock:
+            return {
+                'interval': round(self.interval, 1),
+                'next_poll': _iso(self.next_poll),
+                'arrivals_per_hour': round(self.rate * 3600, 2),
+                'failures': self.failures,
+                'backing_off': self.failures > 0,
+                'last_error': self.last_error,
+                'last_poll': _iso(self.last_poll),
+                'last_arrival': _iso(self.last_arrival),
+                'polls': self.polls,
+                'manual_polls': self.manual_polls
+            }
+
+scheduler = PollScheduler()
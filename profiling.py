@@ -0,0 +1,159 @@
+#profiling.py
+
+import cProfile
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from functools import wraps
+from flask import g, request, abort
+from flask_login import current_user
+
+# Profiling configuration. Hooks are only installed when PROFILING_ENABLED is set,
+# so a disabled deployment pays nothing per request.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+PROFILE_ADMIN_EMAILS = {e.strip().lower() for e in os.getenv('PROFILE_ADMIN_EMAILS', '').split(',') if e.strip()}
+PROFILES_DIR = os.getenv('PROFILES_DIR', 'profiles')
+MAX_PROFILES = int(os.getenv('MAX_PROFILES', '50'))
+TOP_FUNCTIONS = 25
+
+_profiles = deque(maxlen=MAX_PROFILES)
+_lock = threading.Lock()
+bot_cycles_remaining = 0
+
+def is_admin():
+    """Only logged-in users listed in PROFILE_ADMIN_EMAILS may profile"""
+    return (
+        current_user.is_authenticated
+        and (current_user.email or '').lower() in PROFILE_ADMIN_EMAILS
+    )
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not PROFILING_ENABLED or not is_admin():
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
+
+def _top_functions(stats, limit=TOP_FUNCTIONS):
+    rows = []
+    for (filename, line, function), (cc, nc, tt, ct, callers) in stats.stats.items():
+        rows.append({
+            'function': f'{function} ({os.path.basename(filename)}:{line})',
+            'calls': nc,
+            'tottime': round(tt, 6),
+            'cumtime': round(ct, 6)
+        })
+    rows.sort(key=lambda r: r['cumtime'], reverse=True)
+    return rows[:limit]
+
+def save_profile(kind, label, profiler, elapsed, profile_id=None):
+    """Dump a finished profiler to a .pstats file and remember its summary"""
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    profile_id = profile_id or uuid.uuid4().hex[:12]
+    path = os.path.join(PROFILES_DIR, f'{profile_id}.pstats')
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(path)
+
+    entry = {
+        'id': profile_id,
+        'kind': kind,
+        'label': label,
+        'created_at': datetime.utcnow(),
+        'elapsed_ms': round(elapsed * 1000, 2),
+        'path': path,
+        'top': _top_functions(stats)
+    }
+    with _lock:
+        if len(_profiles) == _profiles.maxlen:
+            oldest = _profiles[0]
+            try:
+                os.remove(oldest['path'])
+            except OSError:
+                pass
+        _profiles.append(entry)
+    return profile_id
+
+def recent_profiles():
+    with _lock:
+        return list(reversed(_profiles))
+
+def get_profile(profile_id):
+    with _lock:
+        for entry in _profiles:
+            if entry['id'] == profile_id:
+                return entry
+    return None
+
+def _before_request():
+    if request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1':
+        if is_admin():
+            g._profiler = cProfile.Profile()
+            g._profile_start = time.perf_counter()
+            g._profiler.enable()
+
+def _finish_request_profile(profiler, start, label, profile_id=None):
+    profiler.disable()
+    return save_profile('request', label, profiler, time.perf_counter() - start, profile_id)
+
+def _after_request(response):
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        start = g.pop('_profile_start')
+        label = f'{request.method} {request.full_path.rstrip("?")}'
+        if response.is_streamed:
+            # The body is generated after this hook; keep profiling until the server closes the response
+            profile_id = uuid.uuid4().hex[:12]
+            response.call_on_close(lambda: _finish_request_profile(profiler, start, label, profile_id))
+        else:
+            profile_id = _finish_request_profile(profiler, start, label)
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+def _teardown_request(exc):
+    # after_request is skipped when the view raises; never leave the profiler enabled on this thread
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        label = f'{request.method} {request.full_path.rstrip("?")}'
+        if exc is not None:
+            label += f' ({type(exc).__name__})'
+        _finish_request_profile(profiler, g.pop('_profile_start'), label)
+
+def init_app(app):
+    """Install the per-request profiling hooks when profiling is enabled"""
+    if PROFILING_ENABLED:
+        app.before_request(_before_request)
+        app.after_request(_after_request)
+        app.teardown_request(_teardown_request)
+
+def request_bot_profile(cycles):
+    """Profile the next `cycles` bot cycles"""
+    global bot_cycles_remaining
+    with _lock:
+        bot_cycles_remaining = max(0, int(cycles))
+
+def start_bot_cycle():
+    """Return a running (profiler, start) handle if a bot cycle profile was requested, else None"""
+    global bot_cycles_remaining
+    if not bot_cycles_remaining:
+        return None
+    with _lock:
+        if not bot_cycles_remaining:
+            return None
+        bot_cycles_remaining -= 1
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    return profiler, start
+
+def finish_bot_cycle(handle):
+    """Stop the profiler returned by start_bot_cycle and save it"""
+    if handle is None:
+        return
+    profiler, start = handle
+    profiler.disable()
+    save_profile('bot', 'bot_process cycle', profiler, time.perf_counter() - start)
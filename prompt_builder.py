@@ -1,5 +1,7 @@
 # prompt_builder.py
 
+import os
+
 def build_prompt(prompt_files_contents, info_principal_content, message_thread_content):
     """
     Construye el prompt concatenando el contenido de los archivos de prompt, info_principal y el hilo de mensajes.
@@ -16,3 +18,113 @@ def build_prompt(prompt_files_contents, info_principal_content, message_thread_c
     prompt_content += message_thread_content
 
     return prompt_content
+
+def read_prompt_files(agente_dir):
+    """
+    Lee todos los archivos .txt del directorio de prompts.
+    """
+    prompt_files_dir = os.path.join(agente_dir, 'prompt')
+    prompt_files_contents = []
+    if os.path.exists(prompt_files_dir):
+        for filename in os.listdir(prompt_files_dir):
+            if filename.endswith('.txt'):
+                file_path = os.path.join(prompt_files_dir, filename)
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    prompt_files_contents.append(f.read())
+    return prompt_files_contents
+
+def read_info_principal(agente_dir):
+    """
+    Lee el archivo info_principal.txt, o devuelve una cadena vacía si no existe.
+    """
+    info_principal_path = os.path.join(agente_dir, 'info', 'info_principal.txt')
+    if os.path.exists(info_principal_path):
+        with open(info_principal_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    return ''
+
+def format_message_thread(messages):
+    """
+    Formatea una lista de EmailMessage (ya ordenada) como texto para el prompt.
+    """
+    message_thread_content = ''
+    for message in messages:
+        sender = f"{message.from_name} <{message.from_email}>"
+        date_str = message.date.strftime('%Y-%m-%d %H:%M:%S') if message.date else 'Fecha desconocida'
+        subject = message.subject or 'Sin Asunto'
+        message_content = message.body or ''
+        message_thread_content += f"From: {sender}\n"
+        message_thread_content += f"Date: {date_str}\n"
+        message_thread_content += f"Subject: {subject}\n"
+        message_thread_content += f"Body:\n{message_content}\n"
+        if getattr(message, 'quoted_body', None):
+            # Only present when the quoted message itself is not part of the thread
+            message_thread_content += f"Quoted:\n{message.quoted_body}\n"
+        message_thread_content += "-"*80 + "\n"
+    return message_thread_content
+
+def read_relevant_info(agente_dir, query):
+    """
+    Devuelve los fragmentos de agente_ia/info más relevantes para la consulta, en el orden de los archivos.
+    Si la recuperación está desactivada, falla o el índice aún no está construido, devuelve info_principal.txt completo.
+    """
+    import knowledge_index
+
+    if not knowledge_index.KNOWLEDGE_RETRIEVAL:
+        return read_info_principal(agente_dir)
+    try:
+        chunks = knowledge_index.retrieve(agente_dir, query)
+    except Exception as e:
+        print(f"Error en la recuperación de información, se usa info_principal: {e}")
+        return read_info_principal(agente_dir)
+    if chunks is None:
+        # The index is still being built in the background
+        return read_info_principal(agente_dir)
+    chunks.sort(key=lambda chunk: (chunk['file'], chunk['ordinal']))
+    return '\n\n'.join(chunk['text'] for chunk in chunks)
+
+def thread_query(thread, messages, recent=2):
+    """
+    Texto de búsqueda para un hilo: asunto y últimos mensajes recibidos.
+    """
+    received = [m for m in messages if m.folder != 'Sent'][-recent:]
+    return '\n'.join([thread.subject or ''] + [m.body or '' for m in received])
+
+def format_summary(summary):
+    """
+    Formatea el resumen de los mensajes anteriores del hilo para el prompt.
+    """
+    if not summary:
+        return ''
+    return f"Resumen de los mensajes anteriores:\n{summary}\n" + "-"*80 + "\n"
+
+def build_thread_prompt(thread, agente_dir, gpt=None):
+    """
+    Construye el prompt completo para un EmailThread: archivos de prompt, la información relevante,
+    el resumen de los mensajes antiguos y los mensajes recientes del hilo.
+    Si se pasa `gpt`, antes se incorporan al resumen los mensajes antiguos pendientes.
+    """
+    return build_messages_prompt(thread, load_thread_messages(thread), agente_dir, gpt)
+
+def load_thread_messages(thread):
+    """
+    Devuelve los EmailMessage del hilo en el orden del árbol de respuestas.
+    """
+    from models import EmailMessage
+
+    return EmailMessage.query.filter_by(thread_id=thread.thread_id).order_by(EmailMessage.thread_position.asc(), EmailMessage.date.asc()).all()
+
+def build_messages_prompt(thread, messages, agente_dir, gpt=None):
+    """
+    Igual que build_thread_prompt, con los mensajes del hilo ya cargados.
+    """
+    import thread_summary
+
+    if gpt is not None:
+        thread_summary.update_summary(thread, messages, gpt)
+    summary, recent = thread_summary.split_for_prompt(thread, messages)
+    return build_prompt(
+        read_prompt_files(agente_dir),
+        read_relevant_info(agente_dir, thread_query(thread, messages)),
+        format_summary(summary) + format_message_thread(recent)
+    )
@@ -0,0 +1,210 @@
+#prompt_cache.py
+
+"""
+Caché materializada de prompts por hilo.
+
+Cada fila guarda el prompt de un hilo (y su número de tokens) construido con una versión
+concreta de los archivos de agente_ia/prompt y agente_ia/info. Es válida mientras el hilo no
+cambie (EmailThread.last_updated) ni cambien los recursos; el resumen del hilo la invalida
+al actualizarse. Los prompts se precalculan en segundo plano tras la ingesta y las subidas,
+de modo que la vista previa y los workers de respuesta solo hacen una consulta por índice.
+"""
+
+import hashlib
+import os
+import threading
+from sqlalchemy.exc import IntegrityError
+from app import app, db, AGENTE_IA_DIR
+from models import EmailThread, PromptCache
+from metrics import timed
+import metrics
+import triage
+
+try:
+    import tiktoken
+except ImportError:  # Optional dependency, tokens are estimated from the length without it
+    tiktoken = None
+
+# Prompt cache configuration
+PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', '1') == '1'
+PROMPT_CACHE_MODEL = os.getenv('PROMPT_CACHE_MODEL', 'gpt-4o-mini')  # Tokenizer used for token_count
+
+_encoding = {}
+
+def count_tokens(text):
+    """Tokens of `text` for PROMPT_CACHE_MODEL, or an estimate of 4 characters per token"""
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    if 'value' not in _encoding:
+        try:
+            _encoding['value'] = tiktoken.encoding_for_model(PROMPT_CACHE_MODEL)
+        except KeyError:
+            _encoding['value'] = tiktoken.get_encoding('cl100k_base')
+    return len(_encoding['value'].encode(text))
+
+def resource_version(agente_dir):
+    """
+    Hash of the name, mtime and size of every prompt and info file, and of the info files the
+    knowledge index has processed, so prompts built while it re-indexes are not kept afterwards
+    """
+    import knowledge_index
+
+    state = []
+    if knowledge_index.KNOWLEDGE_RETRIEVAL:
+        state.append(('index', knowledge_index.get_index(agente_dir).state))
+    for file_type in ('prompt', 'info'):
+        folder = os.path.join(agente_dir, file_type)
+        if os.path.exists(folder):
+            for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+                if entry.is_file():
+                    stat = entry.stat()
+                    state.append((file_type, entry.name, stat.st_mtime_ns, stat.st_size))
+    return hashlib.sha1(repr(state).encode('utf-8')).hexdigest()
+
+def lookup(thread, version):
+    """The cached entry for the thread if it is still valid, or None"""
+    entry = PromptCache.query.filter_by(thread_id=thread.thread_id, resource_version=version).first()
+    if entry is None or entry.thread_updated != thread.last_updated:
+        return None
+    return entry
+
+def build(thread, agente_dir, version, gpt=None):
+    """Build the prompt for the thread and store it for `version`"""
+    from prompt_builder import load_thread_messages, build_messages_prompt
+    import thread_summary
+
+    thread_updated = thread.last_updated
+    with timed('prompt_build'):
+        messages = load_thread_messages(thread)
+        prompt = build_messages_prompt(thread, messages, agente_dir, gpt)
+        pending = len(thread_summary.pending_messages(messages, thread_summary.get_summary(thread.thread_id)))
+    built = PromptCache(thread_id=thread.thread_id, resource_version=version, thread_updated=thread_updated,
+                        summary_pending=pending, prompt=prompt, token_count=count_tokens(prompt))
+    if not PROMPT_CACHE_ENABLED:
+        return built
+
+    # Entries built for older resource versions are never valid again
+    PromptCache.query.filter(
+        PromptCache.thread_id == thread.thread_id,
+        PromptCache.resource_version != version
+    ).delete(synchronize_session=False)
+    entry = PromptCache.query.filter_by(thread_id=thread.thread_id, resource_version=version).first()
+    try:
+        with db.session.begin_nested():
+            if entry is None:
+                entry = built
+                db.session.add(entry)
+            else:
+                entry.thread_updated = built.thread_updated
+                entry.summary_pending = built.summary_pending
+                entry.prompt = built.prompt
+                entry.token_count = built.token_count
+    except IntegrityError:
+        # Stored concurrently by another builder; use ours without storing it
+        db.session.commit()
+        return built
+    db.session.commit()
+    return entry
+
+def get_entry(thread, agente_dir=AGENTE_IA_DIR, gpt=None):
+    """
+    Cached prompt entry for the thread, rebuilt when missing or stale.
+    With `gpt`, an entry whose thread summary is due for an update is rebuilt so the summary is folded first.
+    """
+    import thread_summary
+
+    version = resource_version(agente_dir)
+    if PROMPT_CACHE_ENABLED:
+        entry = lookup(thread, version)
+        if entry is not None and (gpt is None or entry.summary_pending < thread_summary.THREAD_SUMMARY_BATCH):
+            metrics.inc('prompt_cache_total', result='hit')
+            return entry
+        metrics.inc('prompt_cache_total', result='miss')
+    return build(thread, agente_dir, version, gpt)
+
+def get_prompt(thread, agente_dir=AGENTE_IA_DIR, gpt=None):
+    return get_entry(thread, agente_dir, gpt).prompt
+
+# ---------------------------------------------------------------------------
+# Background precomputation
+# ---------------------------------------------------------------------------
+
+_pending = set()
+_pending_all = threading.Event()
+_pending_lock = threading.Lock()
+_wake = threading.Event()
+_worker = None
+
+def schedule(thread_ids):
+    """Precompute the prompts of these threads in the background"""
+    if not PROMPT_CACHE_ENABLED:
+        return
+    with _pending_lock:
+        _pending.update(thread_ids)
+    _start()
+
+def schedule_all():
+    """Precompute the prompts of every open thread in the background, e.g. after a resource upload"""
+    if not PROMPT_CACHE_ENABLED:
+        return
+    _pending_all.set()
+    _start()
+
+def _start():
+    global _worker
+    with _pending_lock:
+        _wake.set()
+        if _worker is None:
+            _worker = threading.Thread(target=_run, name='prompt-cache')
+            _worker.daemon = True
+            _worker.start()
+
+def _open_threads(thread_ids=None):
+    """Threads that are waiting for a reply: the only ones whose prompt will be needed"""
+    query = db.session.query(EmailThread.thread_id).filter(
+        EmailThread.reply_by_ia.is_(False),
+        EmailThread.triage_status != triage.SKIP
+    )
+    if thread_ids is not None:
+        query = query.filter(EmailThread.thread_id.in_(thread_ids))
+    return [row[0] for row in query.order_by(EmailThread.last_updated.desc())]
+
+def precompute(thread_ids=None):
+    """Build the missing or stale prompts of the given open threads (all open threads if None)"""
+    version = resource_version(AGENTE_IA_DIR)
+    built = 0
+    for thread_id in _open_threads(thread_ids):
+        thread = EmailThread.query.filter_by(thread_id=thread_id).first()
+        if thread is None or lookup(thread, version) is not None:
+            continue
+        build(thread, AGENTE_IA_DIR, version)
+        built += 1
+    return built
+
+def _run():
+    global _worker
+    from log_utils import add_log
+
+    with app.app_context():
+        while True:
+            # Exit after a quiet minute; schedule() starts a new worker when needed
+            if not _wake.wait(timeout=60):
+                with _pending_lock:
+                    if not _wake.is_set():
+                        _worker = None
+                        return
+            _wake.clear()
+            with _pending_lock:
+                thread_ids = list(_pending)
+                _pending.clear()
+            refresh_all = _pending_all.is_set()
+            _pending_all.clear()
+            try:
+                built = precompute(None if refresh_all else thread_ids)
+                if built:
+                    add_log('INFO', f'Precomputed {built} thread prompts', sampled=True)
+            except Exception as e:
+                db.session.rollback()
+                add_log('ERROR', f'Error precomputing prompts: {str(e)}')
+            finally:
+                db.session.remove()
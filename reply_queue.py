@@ -0,0 +1,318 @@
+#reply_queue.py
+
+import os
+import json
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_, update, func
+from sqlalchemy.exc import IntegrityError
+from app import app, db, AGENTE_IA_DIR
+from models import EmailThread, EmailMessage, ReplyJob
+from email_client import EmailClient
+from log_utils import add_log
+import stats
+import triage
+import prompt_cache
+from config_service import config, EMAIL_KEYS
+
+# Queue configuration
+REPLY_WORKERS = int(os.getenv('REPLY_WORKERS', '2'))
+REPLY_VISIBILITY_TIMEOUT = int(os.getenv('REPLY_VISIBILITY_TIMEOUT', '300'))  # Seconds a claim stays valid
+REPLY_MAX_ATTEMPTS = int(os.getenv('REPLY_MAX_ATTEMPTS', '5'))
+REPLY_RETRY_DELAY = int(os.getenv('REPLY_RETRY_DELAY', '60'))  # Base delay before a failed job is retried
+REPLY_POLL_INTERVAL = int(os.getenv('REPLY_POLL_INTERVAL', '10'))
+
+# Global variables for worker control
+worker_threads = []
+workers_stop = threading.Event()
+workers_lock = threading.Lock()
+
+# Config version of the settings each kind of client was built from; workers rebuild theirs when it moves
+config_versions = {'email': 0, 'openai': 0}
+config.subscribe(lambda changed, version: config_versions.update(email=version), EMAIL_KEYS)
+config.subscribe(lambda changed, version: config_versions.update(openai=version), ['API_OPENAI'])
+
+def enqueue_thread(thread_id):
+    """Create or re-arm the reply job for a thread. The caller commits."""
+    job = ReplyJob.query.filter_by(thread_id=thread_id).first()
+    if job is None:
+        try:
+            with db.session.begin_nested():
+                job = ReplyJob()
+                job.thread_id = thread_id
+                job.status = 'pending'
+                db.session.add(job)
+        except IntegrityError:
+            # Another process enqueued the same thread first
+            pass
+    elif job.status in ('done', 'dead'):
+        job.status = 'pending'
+        job.attempts = 0
+        job.locked_by = None
+        job.locked_until = None
+        job.last_error = None
+
+def enqueue_unanswered_threads():
+    """Enqueue every replyable thread with reply_by_ia=False that has no active job"""
+    threads = db.session.query(EmailThread.thread_id).outerjoin(
+        ReplyJob,
+        EmailThread.thread_id == ReplyJob.thread_id
+    ).filter(
+        EmailThread.reply_by_ia == False,
+        EmailThread.triage_status != triage.SKIP,
+        or_(ReplyJob.id == None, ReplyJob.status == 'done')
+    ).all()
+
+    for (thread_id,) in threads:
+        enqueue_thread(thread_id)
+    db.session.commit()
+    return len(threads)
+
+def _claimable(now):
+    """Pending jobs whose retry delay has elapsed, or processing jobs whose claim expired"""
+    return or_(
+        and_(ReplyJob.status == 'pending', or_(ReplyJob.locked_until == None, ReplyJob.locked_until <= now)),
+        and_(ReplyJob.status == 'processing', ReplyJob.locked_until < now)
+    )
+
+def reap_expired_jobs():
+    """Dead-letter jobs whose claim expired after using up all their attempts"""
+    result = db.session.execute(
+        update(ReplyJob).where(
+            ReplyJob.status == 'processing',
+            ReplyJob.locked_until < datetime.utcnow(),
+            ReplyJob.attempts >= REPLY_MAX_ATTEMPTS
+        ).values(
+            status='dead',
+            locked_by=None,
+            locked_until=None,
+            last_error='Visibility timeout exceeded on last attempt'
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+def claim_jobs(worker_id, limit=1):
+    """Claim up to `limit` jobs for this worker and return their ids"""
+    reap_expired_jobs()
+
+    now = datetime.utcnow()
+    locked_until = now + timedelta(seconds=REPLY_VISIBILITY_TIMEOUT)
+
+    if db.engine.dialect.name == 'postgresql':
+        jobs = ReplyJob.query.filter(_claimable(now)).order_by(ReplyJob.id).limit(limit).with_for_update(skip_locked=True).all()
+        for job in jobs:
+            job.status = 'processing'
+            job.locked_by = worker_id
+            job.locked_until = locked_until
+            job.attempts += 1
+        job_ids = [job.id for job in jobs]
+        db.session.commit()
+        return job_ids
+
+    # SQLite has no row locks: claim with a conditional UPDATE per candidate
+    # and keep only the rows this worker actually won.
+    candidates = db.session.query(ReplyJob.id).filter(_claimable(now)).order_by(ReplyJob.id).limit(limit * 4).all()
+    job_ids = []
+    for (job_id,) in candidates:
+        result = db.session.execute(
+            update(ReplyJob).where(ReplyJob.id == job_id, _claimable(now)).values(
+                status='processing',
+                locked_by=worker_id,
+                locked_until=locked_until,
+                attempts=ReplyJob.attempts + 1
+            )
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            job_ids.append(job_id)
+            if len(job_ids) >= limit:
+                break
+    return job_ids
+
+def _still_owned(job_id, worker_id):
+    """Check that our claim has not expired and been taken by another worker"""
+    job = db.session.get(ReplyJob, job_id, populate_existing=True)
+    return job is not None and job.status == 'processing' and job.locked_by == worker_id
+
+def fail_job(job_id, worker_id, error):
+    """Schedule a retry with backoff, or dead-letter the job once attempts run out"""
+    db.session.rollback()
+    job = db.session.get(ReplyJob, job_id)
+    if job is None or job.locked_by != worker_id:
+        return
+    job.last_error = error
+    job.locked_by = None
+    if job.attempts >= REPLY_MAX_ATTEMPTS:
+        job.status = 'dead'
+        job.locked_until = None
+        add_log('ERROR', f'Reply job for thread {job.thread_id} moved to dead-letter after {job.attempts} attempts: {error}')
+    else:
+        job.status = 'pending'
+        job.locked_until = datetime.utcnow() + timedelta(seconds=REPLY_RETRY_DELAY * 2 ** (job.attempts - 1))
+        add_log('WARNING', f'Reply job for thread {job.thread_id} failed (attempt {job.attempts}): {error}')
+    db.session.commit()
+
+def process_job(job_id, worker_id, client, gpt):
+    """Build the prompt, generate the reply, send it and mark the thread as answered"""
+    claimed_at = datetime.utcnow()
+    job = db.session.get(ReplyJob, job_id)
+    thread = EmailThread.query.filter_by(thread_id=job.thread_id).first()
+
+    if not thread or thread.reply_by_ia or thread.triage_status == triage.SKIP:
+        job.status = 'done'
+        job.locked_by = None
+        job.locked_until = None
+        db.session.commit()
+        return
+
+    last_message = EmailMessage.query.filter(
+        EmailMessage.thread_id == thread.thread_id,
+        EmailMessage.folder != 'Sent'
+    ).order_by(EmailMessage.date.desc()).first()
+    if not last_message:
+        job.status = 'done'
+        job.locked_by = None
+        job.locked_until = None
+        db.session.commit()
+        return
+
+    last_message_pk = db.session.query(func.max(EmailMessage.id)).filter(
+        EmailMessage.thread_id == thread.thread_id
+    ).scalar()
+
+    prompt = prompt_cache.get_prompt(thread, AGENTE_IA_DIR, gpt)
+    reply = gpt.gpt4_request(prompt)
+    if not reply:
+        raise RuntimeError('Empty response from GPT')
+
+    if not _still_owned(job_id, worker_id):
+        add_log('WARNING', f'Reply job for thread {thread.thread_id} was reclaimed by another worker, discarding reply')
+        return
+
+    references = json.loads(last_message.references or '[]') + [last_message.message_id]
+    subject = last_message.subject or thread.subject or ''
+    if not subject.lower().startswith('re:'):
+        subject = f'Re: {subject}'
+
+    if not client.send_email(last_message.from_email, subject, reply,
+                             in_reply_to=last_message.message_id,
+                             references=' '.join(references)):
+        raise RuntimeError(f'Could not send reply to {last_message.from_email}')
+
+    # Only the messages that were part of the prompt count as answered
+    EmailMessage.query.filter(
+        EmailMessage.thread_id == thread.thread_id,
+        EmailMessage.id <= last_message_pk
+    ).update({'reply_by_ia': True}, synchronize_session=False)
+
+    db.session.refresh(thread)
+    job = db.session.get(ReplyJob, job_id)
+    job.locked_by = None
+    job.locked_until = None
+    job.last_error = None
+    if thread.last_updated and thread.last_updated > claimed_at:
+        # New mail arrived while we were replying: answer again
+        job.status = 'pending'
+        job.attempts = 0
+    else:
+        stats.set_thread_answered(thread, True)
+        job.status = 'done'
+    db.session.commit()
+    add_log('SUCCESS', f'AI reply sent to {last_message.from_email} for thread {thread.thread_id}')
+
+def worker_loop(worker_id, sweep=False):
+    """Claim and process jobs until the stop event is set"""
+    from api_gpt import ApiGPT
+
+    with app.app_context():
+        try:
+            gpt = ApiGPT()
+        except Exception as e:
+            add_log('ERROR', f'Reply worker {worker_id} could not start: {str(e)}')
+            return
+
+        client = EmailClient()
+        versions = dict(config_versions)
+        add_log('INFO', f'Reply worker {worker_id} started')
+
+        while not workers_stop.is_set():
+            try:
+                if versions != config_versions:
+                    # Settings changed: rebuild only the clients whose settings moved
+                    if versions['email'] != config_versions['email']:
+                        client.close_connection()
+                        client = EmailClient()
+                    if versions['openai'] != config_versions['openai']:
+                        gpt = ApiGPT()
+                    versions = dict(config_versions)
+                    add_log('INFO', f'Reply worker {worker_id} reloaded its settings')
+
+                if sweep:
+                    enqueue_unanswered_threads()
+
+                job_ids = claim_jobs(worker_id)
+                if not job_ids:
+                    workers_stop.wait(REPLY_POLL_INTERVAL)
+                    continue
+
+                if not client.smtp_connection:
+                    client.reconnect_smtp()
+
+                for job_id in job_ids:
+                    try:
+                        process_job(job_id, worker_id, client, gpt)
+                    except Exception as e:
+                        fail_job(job_id, worker_id, str(e))
+            except Exception as e:
+                db.session.rollback()
+                add_log('ERROR', f'Reply worker {worker_id} error: {str(e)}')
+                workers_stop.wait(REPLY_POLL_INTERVAL)
+
+        client.close_connection()
+        add_log('INFO', f'Reply worker {worker_id} stopped')
+
+def start_workers(concurrency=None):
+    """Start the reply workers for this process"""
+    global worker_threads
+
+    with workers_lock:
+        if any(t.is_alive() for t in worker_threads):
+            return False
+
+        workers_stop.clear()
+        node = f'{socket.gethostname()}-{os.getpid()}'
+        worker_threads = []
+        for index in range(concurrency or REPLY_WORKERS):
+            worker_id = f'{node}-{index}-{uuid.uuid4().hex[:6]}'
+            t = threading.Thread(target=worker_loop, args=(worker_id, index == 0))
+            t.daemon = True
+            t.start()
+            worker_threads.append(t)
+        return True
+
+def stop_workers(timeout=2):
+    """Signal the reply workers to stop"""
+    with workers_lock:
+        workers_stop.set()
+        for t in worker_threads:
+            t.join(timeout=timeout)
+
+def workers_running():
+    return any(t.is_alive() for t in worker_threads)
+
+def queue_status():
+    """Return job counts per status"""
+    counts = dict(db.session.query(ReplyJob.status, func.count(ReplyJob.id)).group_by(ReplyJob.status).all())
+    return {status: counts.get(status, 0) for status in ('pending', 'processing', 'done', 'dead')}
+
+if __name__ == "__main__":
+    # Run a standalone worker process: python reply_queue.py
+    start_workers()
+    try:
+        for t in worker_threads:
+            t.join()
+    except KeyboardInterrupt:
+        stop_workers()
@@ -1,41 +1,60 @@
 #routes.py
 
-from flask import render_template, redirect, url_for, request, flash, jsonify
-from app import app, db
+from flask import render_template, redirect, url_for, request, flash, jsonify, Response, send_file, abort, stream_template
+from app import app, db, AGENTE_IA_DIR
 import os
-from dotenv import load_dotenv, set_key
-from pathlib import Path
 from email_client import EmailClient
-from models import Log, EmailThread, EmailMessage
+from models import Log, EmailThread, EmailMessage, ReplyJob, Contact, ThreadSummary
 from datetime import datetime
 from email.utils import parseaddr, parsedate_to_datetime
-from email_utils import decode_str, get_email_body
+from email_utils import decode_str, get_email_body, split_reply
 import threading
-import time
 import uuid
 import json
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import inspect, or_, and_
+from sqlalchemy import func
 from werkzeug.utils import secure_filename
-from prompt_builder import build_prompt
+from prompt_builder import build_prompt, read_prompt_files, read_info_principal
+from log_utils import add_log, ensure_log_table, query_logs, maybe_prune_logs
+import reply_queue
+import email_threading
+import stats
+import contacts
+import metrics
+from metrics import timed
+import profiling
+import http_cache
+import poll_scheduler
+import knowledge_index
+import triage
+import prompt_cache
+import cluster
+from config_service import config, EMAIL_KEYS
+from db_routing import read_only
 
 
-# Load environment variables
-load_dotenv()
-
 # Global variables for bot control
 email_bot_thread = None
 bot_running = False
 email_client = None
+email_client_stale = False  # Set when the mail settings change; the bot reconnects on its next cycle
 bot_lock = threading.Lock()
 
 # Upload configuration
-AGENTE_IA_FOLDER = 'agente_ia'
 ALLOWED_EXTENSIONS = {'txt'}
 
+# Rows fetched per round-trip when streaming the database page
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '100'))
+
 # Create uploads directory if it doesn't exist
-os.makedirs(os.path.join(app.root_path, AGENTE_IA_FOLDER, 'prompt'), exist_ok=True)
-os.makedirs(os.path.join(app.root_path, AGENTE_IA_FOLDER, 'info'), exist_ok=True)
+os.makedirs(os.path.join(AGENTE_IA_DIR, 'prompt'), exist_ok=True)
+os.makedirs(os.path.join(AGENTE_IA_DIR, 'info'), exist_ok=True)
+
+# Opt-in request profiling (no hooks are installed unless PROFILING_ENABLED is set)
+profiling.init_app(app)
+
+# ETag revalidation helpers and gzip/brotli compression of large responses
+http_cache.init_app(app)
 
 def allowed_file(filename):
     if filename is None:
@@ -43,53 +62,25 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def load_email_config():
-    """Load email configuration from environment variables"""
-    return {
-        'IMAP_SERVER': os.getenv('IMAP_SERVER', ''),
-        'IMAP_PORT': os.getenv('IMAP_PORT', ''),
-        'SMTP_SERVER': os.getenv('SMTP_SERVER', ''),
-        'SMTP_PORT': os.getenv('SMTP_PORT', ''),
-        'EMAIL_ADDRESS': os.getenv('EMAIL_ADDRESS', ''),
-        'EMAIL_PASSWORD': os.getenv('EMAIL_PASSWORD', '')
-    }
+    """Current email configuration (loaded once by the config service)"""
+    return config.email_settings()
 
 def save_to_env_file(config_data):
-    """Save configuration to .env file"""
-    env_path = Path('.env')
-    
-    # Create .env file if it doesn't exist
-    if not env_path.exists():
-        env_path.touch()
-    
-    # Update each configuration value
-    for key, value in config_data.items():
-        set_key(str(env_path), key, str(value))
+    """Save configuration to .env file in one atomic write. Returns the keys that changed."""
+    return config.update(config_data)
 
-def add_log(level, message):
-    """Add a log entry to the database"""
-    try:
-        with app.app_context():
-            # Check if Log table exists
-            inspector = inspect(db.engine)
-            if 'log' not in inspector.get_table_names():
-                db.create_all()
-                app.logger.info('Log table created')
-            
-            log = Log()
-            log.level = level
-            log.message = message
-            db.session.add(log)
-            db.session.commit()
-    except Exception as e:
-        print(f"Error adding log: {str(e)}")
-        try:
-            db.session.rollback()
-        except:
-            pass
+def on_email_config_changed(changed, version):
+    """Have the running bot reconnect with the new mail settings"""
+    global email_client_stale
+    email_client_stale = True
+    if bot_running:
+        poll_scheduler.scheduler.wake()
+
+config.subscribe(on_email_config_changed, EMAIL_KEYS)
 
 def read_file_content(file_type, filename):
     try:
-        file_path = os.path.join(app.root_path, AGENTE_IA_FOLDER, file_type, filename)
+        file_path = os.path.join(AGENTE_IA_DIR, file_type, filename)
         if os.path.exists(file_path):
             with open(file_path, 'r', encoding='utf-8') as f:
                 return f.read()
@@ -97,8 +88,36 @@ def read_file_content(file_type, filename):
         app.logger.error(f'Error reading {file_type} file: {str(e)}')
     return None
 
-def process_emails(emails):
-    """Process incoming emails and store them in the database"""
+def resources_state(*file_types):
+    """Name, mtime and size of every resource file, used to build ETags"""
+    state = []
+    for file_type in file_types:
+        folder = os.path.join(AGENTE_IA_DIR, file_type)
+        if os.path.exists(folder):
+            for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+                stat = entry.stat()
+                state.append((file_type, entry.name, stat.st_mtime_ns, stat.st_size))
+    return state
+
+def mail_state():
+    """Cheap aggregate that changes whenever threads, messages or reply jobs change"""
+    last_updated, thread_count = db.session.query(
+        func.max(EmailThread.last_updated), func.count(EmailThread.id)
+    ).one()
+    return (
+        last_updated,
+        thread_count,
+        db.session.query(func.max(EmailMessage.id)).scalar(),
+        db.session.query(func.max(ReplyJob.updated_at)).scalar()
+    )
+
+def process_emails(emails, fence=None):
+    """
+    Process incoming emails and store them in the database. Returns the number of new messages stored.
+    `fence(folder)` is called before each commit in cluster mode and raises cluster.LeaseLost to stop.
+    """
+    stored = 0
+    touched = set()
     for email_id, msg, folder in emails:
         try:
             # Parse email headers
@@ -117,7 +136,12 @@ def process_emails(emails):
             in_reply_to = msg.get("In-Reply-To")
             references = msg.get("References", "").split()
             date_str = msg.get("Date")
-            body = get_email_body(msg)
+            with timed('get_email_body'):
+                body = get_email_body(msg)
+            with timed('split_reply'):
+                body, quoted_body, signature = split_reply(body)
+            with timed('triage'):
+                triage_status, triage_reason = triage.classify(msg, from_email, subject, body)
             
             try:
                 date = parsedate_to_datetime(date_str)
@@ -130,33 +154,23 @@ def process_emails(emails):
 
                 existing_message = EmailMessage.query.filter_by(message_id=message_id).first()
                 if existing_message:
-                    add_log('WARNING', f'Email with message_id {message_id} already exists, skipping')
+                    # End the transaction, not just the savepoint: each stored message commits and each failure
+                    # rolls back, so nothing else is pending, and an open transaction would keep the SQLite
+                    # lock that add_log needs to write from its own session
+                    db.session.rollback()
+                    add_log('WARNING', f'Email with message_id {message_id} already exists, skipping', sampled=True)
                     continue
 
-                thread_id = None
-                if in_reply_to:
-                    ref_email = EmailMessage.query.filter_by(message_id=in_reply_to).first()
-                    if ref_email:
-                        thread_id = ref_email.thread_id
-                
-                if not thread_id and references:
-                    for ref in references:
-                        ref_email = EmailMessage.query.filter_by(message_id=ref).first()
-                        if ref_email:
-                            thread_id = ref_email.thread_id
-                            break
-
-                if not thread_id:
-                    thread_id = str(uuid.uuid4())
-                    thread = EmailThread()
-                    thread.thread_id = thread_id
-                    thread.subject = subject
-                    db.session.add(thread)
-                    db.session.flush()
-                else:
-                    thread = EmailThread.query.filter_by(thread_id=thread_id).first()
-                    if thread:
+                with timed('thread_resolution'):
+                    chain = email_threading.reference_chain(references, in_reply_to)
+                    thread, created, merged = email_threading.resolve_thread(message_id, chain, subject)
+                    thread_id = thread.thread_id
+                    if created:
+                        stats.on_thread_created()
+                    else:
                         thread.last_updated = datetime.utcnow()
+                        # New mail in the thread needs a new reply
+                        stats.set_thread_answered(thread, False)
 
                 email_msg = EmailMessage()
                 email_msg.message_id = message_id
@@ -165,16 +179,44 @@ def process_emails(emails):
                 email_msg.from_email = from_email
                 email_msg.subject = subject
                 email_msg.body = body
+                email_msg.signature = signature or None
+                # The quoted history duplicates the parent message; keep it only if we never stored that one
+                if quoted_body and not (in_reply_to and db.session.query(EmailMessage.id).filter_by(message_id=in_reply_to).first()):
+                    email_msg.quoted_body = quoted_body
                 email_msg.date = date
                 email_msg.in_reply_to = in_reply_to
                 email_msg.references = json.dumps(references)
                 email_msg.folder = folder
                 
                 db.session.add(email_msg)
-                db.session.commit()
-
-                add_log('INFO', f'New email processed:\nThread ID: {thread_id}\nFrom: {from_name} <{from_email}>\nDate: {date_str}\nSubject: {subject}\nMessage-ID: {message_id}\nIn-Reply-To: {in_reply_to or "N/A"}\n----------------------------------------\n{body[:50] + "..." if len(body) > 50 else body}')
-
+                db.session.flush()
+                new_sender = contacts.on_message_stored(from_email, from_name, thread, date)
+                stats.on_message_stored(folder, new_sender)
+                with timed('thread_tree'):
+                    email_threading.attach_message(email_msg, merged=bool(merged))
+                if folder != 'Sent':
+                    # Bulk, automated and no-reply mail never reaches the reply queue
+                    stats.set_thread_triage(thread, triage_status, triage_reason)
+                    metrics.inc('triage_messages_total', status=triage_status, reason=triage_reason or 'none')
+                if thread.triage_status != triage.SKIP:
+                    reply_queue.enqueue_thread(thread_id)
+                if fence:
+                    fence(folder)
+                with timed('db_commit'):
+                    db.session.commit()
+                metrics.inc('bot_emails_processed_total', folder=folder)
+                stored += 1
+                touched.add(thread_id)
+                if merged:
+                    add_log('INFO', f'Merged threads {", ".join(merged)} into {thread_id}')
+
+                add_log('INFO', f'New email processed:\nThread ID: {thread_id}\nFrom: {from_name} <{from_email}>\nDate: {date_str}\nSubject: {subject}\nMessage-ID: {message_id}\nIn-Reply-To: {in_reply_to or "N/A"}\n----------------------------------------\n{body[:50] + "..." if len(body) > 50 else body}', sampled=True)
+
+            except cluster.LeaseLost as e:
+                # Another node owns the folder now; it will store these messages
+                db.session.rollback()
+                add_log('WARNING', f'Stopped processing: {str(e)}')
+                break
             except SQLAlchemyError as e:
                 db.session.rollback()
                 add_log('ERROR', f'Database error processing email {message_id}: {str(e)}')
@@ -188,57 +230,62 @@ def process_emails(emails):
             add_log('ERROR', f'Error processing email {email_id}: {str(e)}')
             continue
 
+    if touched:
+        # Have the prompts ready before the reply workers or the preview ask for them
+        prompt_cache.schedule(touched)
+    return stored
+
 def bot_process():
     """Email bot process that runs in the background"""
-    global bot_running, email_client
+    global email_client, email_client_stale
     
     with app.app_context():
         add_log('INFO', 'Bot started')
-        connection_retry_count = 0
-        max_retries = 3
-        check_interval = 60  # Check every minute
+        poll_scheduler.scheduler.reset()
+        node = None
+        if cluster.CLUSTER_MODE:
+            # Only the folders whose lease this node holds are fetched
+            node = cluster.IngestNode(on_gain=poll_scheduler.scheduler.wake).start()
+            add_log('INFO', f'Cluster node {node.node_id} joined')
         
         while bot_running:
             try:
+                if email_client_stale:
+                    email_client_stale = False
+                    if email_client:
+                        email_client.close_connection()
+                        email_client = None
+                        add_log('INFO', 'Email settings changed, reconnecting')
                 if not email_client:
                     email_client = EmailClient()
-                    try:
-                        email_client.connect()
-                        add_log('SUCCESS', 'Connection established with email server')
-                        connection_retry_count = 0
-                    except Exception as e:
-                        connection_retry_count += 1
-                        add_log('ERROR', f'Connection error (attempt {connection_retry_count}): {str(e)}')
-                        if connection_retry_count >= max_retries:
-                            add_log('ERROR', 'Maximum connection attempts reached')
-                            bot_running = False
-                            break
-                        time.sleep(check_interval)
-                        continue
+                    email_client.connect()
+                    add_log('SUCCESS', 'Connection established with email server')
                 
+                profile = profiling.start_bot_cycle()
                 try:
-                    emails = email_client.fetch_emails()
+                    fence = None
+                    if node:
+                        owned = node.owned_folders()
+                        emails = email_client.fetch_emails(list(owned)) if owned else []
+                        fence = lambda folder: node.fence(folder, owned[folder])
+                    else:
+                        emails = email_client.fetch_emails()
+                    new_messages = 0
                     if emails:
-                        add_log('INFO', f'Retrieved {len(emails)} new emails')
-                        process_emails(emails)
+                        add_log('INFO', f'Retrieved {len(emails)} new emails', sampled=True)
+                        new_messages = process_emails(emails, fence)
                     else:
-                        add_log('INFO', 'No new emails to process')
-                except Exception as e:
-                    add_log('ERROR', f'Error fetching/processing emails: {str(e)}')
-                    if email_client:
-                        try:
-                            email_client.close_connection()
-                            add_log('WARNING', 'Connection closed due to error')
-                        except:
-                            pass
-                    email_client = None
-                    time.sleep(check_interval)
-                    continue
-                
-                time.sleep(check_interval)
+                        add_log('INFO', 'No new emails to process', sampled=True)
+                finally:
+                    profiling.finish_bot_cycle(profile)
+                poll_scheduler.scheduler.record_success(new_messages)
+                maybe_prune_logs()
                 
             except Exception as e:
-                add_log('ERROR', f'Bot error: {str(e)}')
+                # Transient outages back off and retry instead of stopping the bot
+                delay = poll_scheduler.scheduler.record_failure(e)
+                failures = poll_scheduler.scheduler.failures
+                add_log('ERROR', f'Bot error (attempt {failures}), retrying in {delay:.0f}s: {str(e)}')
                 if email_client:
                     try:
                         email_client.close_connection()
@@ -246,14 +293,20 @@ def bot_process():
                     except:
                         pass
                 email_client = None
-                time.sleep(check_interval)
+            
+            if bot_running:
+                poll_scheduler.scheduler.wait()
         
+        if node:
+            node.stop()
+            add_log('INFO', f'Cluster node {node.node_id} left')
         if email_client:
             try:
                 email_client.close_connection()
                 add_log('INFO', 'Connection closed successfully')
             except Exception as e:
                 add_log('ERROR', f'Error closing connection: {str(e)}')
+            email_client = None
         add_log('INFO', 'Bot stopped')
 
 @app.route('/')
@@ -290,9 +343,8 @@ def agente_configuracion():
             return render_template('agente/agente_configuracion.html', config=config_data)
         
         try:
-            save_to_env_file(config_data)
-            app.config.update(config_data)
-            flash('Configuration saved successfully', 'success')
+            changed = save_to_env_file(config_data)
+            flash('Configuration saved successfully' if changed else 'No changes to save', 'success')
             return redirect(url_for('agente_configuracion'))
         except Exception as e:
             app.logger.error(f'Error saving configuration: {str(e)}')
@@ -317,6 +369,8 @@ def clear_database():
         # Stop bot if running
         global bot_running
         bot_running = False
+        poll_scheduler.scheduler.wake()
+        reply_queue.stop_workers()
         
         # Drop and recreate all tables
         db.drop_all()
@@ -357,53 +411,144 @@ def toggle_bot():
                 return jsonify({'status': 'success', 'message': 'Bot started', 'running': True})
             else:
                 bot_running = False
+                poll_scheduler.scheduler.wake()
                 if email_bot_thread:
                     email_bot_thread.join(timeout=2)
                 return jsonify({'status': 'success', 'message': 'Bot stopped', 'running': False})
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error: {str(e)}'})
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/agente/metrics/summary')
+def metrics_summary():
+    return jsonify({'status': 'success', 'stages': metrics.summary()})
+
+@app.route('/agente/profiles')
+@profiling.admin_required
+def agente_profiles():
+    return render_template('agente/agente_profiles.html',
+                         profiles=profiling.recent_profiles(),
+                         bot_cycles_remaining=profiling.bot_cycles_remaining)
+
+@app.route('/agente/profiles/<profile_id>/download')
+@profiling.admin_required
+def download_profile(profile_id):
+    profile = profiling.get_profile(profile_id)
+    if not profile or not os.path.exists(profile['path']):
+        abort(404)
+    return send_file(os.path.abspath(profile['path']), as_attachment=True,
+                     download_name=f'{profile_id}.pstats')
+
+@app.route('/agente/profiles/bot', methods=['POST'])
+@profiling.admin_required
+def profile_bot():
+    try:
+        cycles = int(request.form.get('cycles', 1))
+    except ValueError:
+        flash('Cycles must be a number.', 'danger')
+        return redirect(url_for('agente_profiles'))
+    profiling.request_bot_profile(cycles)
+    flash(f'Profiling the next {cycles} bot cycles', 'success')
+    return redirect(url_for('agente_profiles'))
+
+@app.route('/agente/stats')
+@read_only
+def agente_stats():
+    try:
+        return jsonify({'status': 'success', 'stats': stats.get_stats()})
+    except Exception as e:
+        app.logger.error(f'Error fetching stats: {str(e)}')
+        return jsonify({'status': 'error', 'message': str(e)})
+
 @app.route('/agente/bot/status')
 def bot_status():
-    return jsonify({'running': bot_running})
+    status = {'running': bot_running, 'scheduler': poll_scheduler.scheduler.state()}
+    if cluster.CLUSTER_MODE:
+        status['cluster'] = cluster.cluster_status()
+    return jsonify(status)
+
+@app.route('/agente/bot/poll-now', methods=['POST'])
+def bot_poll_now():
+    if not bot_running:
+        return jsonify({'status': 'error', 'message': 'Bot is not running'})
+    poll_scheduler.scheduler.poll_now()
+    return jsonify({'status': 'success', 'message': 'Poll triggered'})
+
+LOG_LEVELS = ('INFO', 'SUCCESS', 'WARNING', 'ERROR')
+
+def _log_filters():
+    """Read the keyset cursor and level filter from the query string"""
+    before_id = request.args.get('before_id', type=int)
+    level = request.args.get('level', '').upper() or None
+    if level not in LOG_LEVELS:
+        level = None
+    return before_id, level
 
 @app.route('/agente/logs')
+@read_only
 def agente_logs():
+    before_id, level = _log_filters()
     try:
-        # Check if Log table exists
-        inspector = inspect(db.engine)
-        if 'log' not in inspector.get_table_names():
-            db.create_all()
-            app.logger.info('Log table created')
-        
-        logs = Log.query.order_by(Log.timestamp.desc()).limit(50).all()
-        return render_template('agente/agente_logs.html', logs=logs)
+        ensure_log_table()
+        logs, next_before_id = query_logs(before_id=before_id, level=level, limit=50)
+        return render_template('agente/agente_logs.html', logs=logs, level=level,
+                             levels=LOG_LEVELS, next_before_id=next_before_id)
     except Exception as e:
         app.logger.error(f'Error loading logs: {str(e)}')
-        return render_template('agente/agente_logs.html', logs=[])
-
-@app.route('/agente/logs/latest')
-def latest_logs():
+        return render_template('agente/agente_logs.html', logs=[], level=level,
+                             levels=LOG_LEVELS, next_before_id=None)
+
+@app.route('/agente/logs/api')
+@read_only
+def logs_api():
+    before_id, level = _log_filters()
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
     try:
-        # Check if Log table exists
-        inspector = inspect(db.engine)
-        if 'log' not in inspector.get_table_names():
-            db.create_all()
-            app.logger.info('Log table created')
-            
-        logs = Log.query.order_by(Log.timestamp.desc()).limit(5).all()
-        log_list = []
-        for log in logs:
-            log_list.append({
+        ensure_log_table()
+        logs, next_before_id = query_logs(before_id=before_id, level=level, limit=limit)
+        return jsonify({
+            'status': 'success',
+            'logs': [{
+                'id': log.id,
                 'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
                 'level': log.level,
                 'level_class': log.level_class,
                 'message': log.message
-            })
-        return jsonify({
-            'status': 'success',
-            'logs': log_list
+            } for log in logs],
+            'next_before_id': next_before_id
         })
+    except Exception as e:
+        app.logger.error(f'Error fetching logs: {str(e)}')
+        return jsonify({'status': 'error', 'message': str(e), 'logs': []})
+
+@app.route('/agente/logs/latest')
+@read_only
+def latest_logs():
+    try:
+        ensure_log_table()
+        last_id = db.session.query(func.max(Log.id)).scalar()
+
+        def render():
+            logs = Log.query.order_by(Log.id.desc()).limit(5).all()
+            log_list = []
+            for log in logs:
+                log_list.append({
+                    'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                    'level': log.level,
+                    'level_class': log.level_class,
+                    'message': log.message
+                })
+            return jsonify({
+                'status': 'success',
+                'logs': log_list
+            }).get_data()
+
+        response = http_cache.cached_response(http_cache.make_etag('logs', last_id), render)
+        response.mimetype = 'application/json'
+        return response
     except Exception as e:
         app.logger.error(f'Error fetching latest logs: {str(e)}')
         return jsonify({
@@ -417,73 +562,67 @@ def agente_dashboard():
     return render_template('agente/agente_dashboard.html')
 
 @app.route('/agente/database')
+@read_only
 def agente_database():
     try:
-        # Get all unique senders
-        senders = db.session.query(
-            EmailMessage.from_email, 
-            EmailMessage.from_name
-        ).distinct().all()
-        
-        sender_data = []
-        for from_email, from_name in senders:
-            # Get all threads where this person is either sender or recipient
-            threads = db.session.query(EmailThread).join(
-                EmailMessage,
-                EmailThread.thread_id == EmailMessage.thread_id
-            ).filter(
-                or_(
-                    EmailMessage.from_email == from_email,
-                    and_(
-                        EmailMessage.folder == 'Sent',
-                        EmailMessage.thread_id.in_(
-                            db.session.query(EmailMessage.thread_id).filter(
-                                EmailMessage.from_email == from_email
-                            )
-                        )
-                    )
-                )
-            ).distinct().order_by(EmailThread.last_updated.desc()).all()
-            
-            if threads:
-                thread_data = []
-                for thread in threads:
-                    # Get all messages in this thread
-                    messages = EmailMessage.query.filter(
-                        EmailMessage.thread_id == thread.thread_id,
-                        or_(
-                            EmailMessage.from_email == from_email,
-                            EmailMessage.folder == 'Sent'
-                        )
-                    ).order_by(EmailMessage.date.asc()).all()
-                    
-                    if messages:
-                        thread_data.append({
-                            'thread': thread,
-                            'messages': messages
-                        })
-                
-                if thread_data:
-                    sender_data.append({
-                        'email': from_email,
-                        'name': from_name or from_email,
-                        'threads': thread_data
-                    })
-        
-        return render_template('agente/agente_database.html', sender_data=sender_data)
+        state = mail_state()
+        return http_cache.cached_response(
+            http_cache.make_etag('database', state),
+            lambda: render_template('agente/agente_database.html', sender_data=build_sender_data()),
+            last_modified=state[0]
+        )
     except Exception as e:
         app.logger.error(f'Error in agente_database: {str(e)}')
         flash(f'Error loading data: {str(e)}', 'danger')
         return render_template('agente/agente_database.html', sender_data=[])
 
+def sender_entry(contact, threads):
+    return {
+        'contact': contact,
+        'email': contact.email,
+        'name': contact.name or contact.email,
+        'threads': threads
+    }
+
+def build_sender_data():
+    """Every contact with its threads and messages, most recently active first"""
+    return [
+        sender_entry(contact, list(contacts.contact_threads(contact)))
+        for contact in Contact.query.order_by(Contact.last_seen.desc(), Contact.id.desc())
+    ]
+
+def iter_sender_data():
+    """Lazy version of build_sender_data: contacts and threads are read from the database as the page renders"""
+    for contact in Contact.query.order_by(Contact.last_seen.desc(), Contact.id.desc()).yield_per(STREAM_BATCH_SIZE):
+        yield sender_entry(contact, contacts.contact_threads(contact, yield_per=STREAM_BATCH_SIZE))
+
+@app.route('/agente/database/contact/<int:contact_id>')
+@read_only
+def agente_contact(contact_id):
+    # Drill-down: one contact row and its linked threads
+    contact = db.get_or_404(Contact, contact_id)
+    return render_template('agente/agente_database.html',
+                           sender_data=[sender_entry(contact, list(contacts.contact_threads(contact)))],
+                           single_contact=True)
+
+@app.route('/agente/database/stream')
+@read_only
+def agente_database_stream():
+    # Chunked response: the browser starts painting the first senders while the rest are still being read
+    return stream_template('agente/agente_database.html', sender_data=iter_sender_data(), streaming=True)
+
 @app.route('/agente/recursos')
 def agente_recursos():
+    state = resources_state('prompt', 'info')
+    return http_cache.cached_response(http_cache.make_etag('recursos', state), render_recursos)
+
+def render_recursos():
     # Get list of files and their contents
     prompt_files = []
     info_files = []
     
-    prompt_dir = os.path.join(app.root_path, AGENTE_IA_FOLDER, 'prompt')
-    info_dir = os.path.join(app.root_path, AGENTE_IA_FOLDER, 'info')
+    prompt_dir = os.path.join(AGENTE_IA_DIR, 'prompt')
+    info_dir = os.path.join(AGENTE_IA_DIR, 'info')
     
     if os.path.exists(prompt_dir):
         for filename in os.listdir(prompt_dir):
@@ -530,8 +669,13 @@ def handle_upload(upload_type):
     if allowed_file(file.filename):
         if file.filename:
             filename = secure_filename(file.filename)
-            file_path = os.path.join(app.root_path, AGENTE_IA_FOLDER, upload_type, filename)
+            file_path = os.path.join(AGENTE_IA_DIR, upload_type, filename)
             file.save(file_path)
+            if upload_type == 'info':
+                # Only the new or changed chunks are embedded; prompts are rebuilt once the index is ready
+                knowledge_index.schedule_refresh(AGENTE_IA_DIR, then=prompt_cache.schedule_all)
+            else:
+                prompt_cache.schedule_all()
             flash(f'File uploaded successfully', 'success')
             add_log('SUCCESS', f'File {filename} uploaded to {upload_type} directory')
     else:
@@ -543,46 +687,88 @@ def handle_upload(upload_type):
 
 @app.route('/agente/prompt')
 def agente_prompt():
-    # Leer archivos de prompt
-    prompt_files_dir = os.path.join(app.root_path, AGENTE_IA_FOLDER, 'prompt')
-    prompt_files_contents = []
-    if os.path.exists(prompt_files_dir):
-        for filename in os.listdir(prompt_files_dir):
-            if filename.endswith('.txt'):
-                file_path = os.path.join(prompt_files_dir, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    prompt_files_contents.append(content)
-
-    # Leer info_principal
-    info_principal_path = os.path.join(app.root_path, AGENTE_IA_FOLDER, 'info', 'info_principal.txt')
-    if os.path.exists(info_principal_path):
-        with open(info_principal_path, 'r', encoding='utf-8') as f:
-            info_principal_content = f.read()
-    else:
-        info_principal_content = ''
-
-    # Obtener un hilo de mensajes "no procesado"
+    # resource_version also changes when the knowledge index finishes a refresh
+    state = (
+        prompt_cache.resource_version(AGENTE_IA_DIR),
+        mail_state(),
+        db.session.query(func.max(ThreadSummary.updated_at)).scalar()
+    )
+    return http_cache.cached_response(http_cache.make_etag('prompt', state), render_prompt_preview)
+
+def render_prompt_preview():
+    agente_dir = AGENTE_IA_DIR
+
+    # Obtener un hilo de mensajes "no procesado" y construir su prompt como lo harán los workers
     thread = EmailThread.query.filter_by(reply_by_ia=False).first()
+    token_count = None
     if thread:
-        # Obtener mensajes en este hilo
-        messages = EmailMessage.query.filter_by(thread_id=thread.thread_id).order_by(EmailMessage.date.asc()).all()
-        # Construir el contenido del hilo de mensajes
-        message_thread_content = ''
-        for message in messages:
-            sender = f"{message.from_name} <{message.from_email}>"
-            date_str = message.date.strftime('%Y-%m-%d %H:%M:%S') if message.date else 'Fecha desconocida'
-            subject = message.subject or 'Sin Asunto'
-            message_content = message.body or ''
-            message_thread_content += f"From: {sender}\n"
-            message_thread_content += f"Date: {date_str}\n"
-            message_thread_content += f"Subject: {subject}\n"
-            message_thread_content += f"Body:\n{message_content}\n"
-            message_thread_content += "-"*80 + "\n"
+        entry = prompt_cache.get_entry(thread, agente_dir)
+        prompt, token_count = entry.prompt, entry.token_count
     else:
-        message_thread_content = 'No se encontraron hilos no procesados.'
+        prompt = build_prompt(read_prompt_files(agente_dir), read_info_principal(agente_dir),
+                              'No se encontraron hilos no procesados.')
+
+    return render_template('agente/agente_prompt.html', prompt=prompt, thread=thread, token_count=token_count)
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Events message"""
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(data)}\n\n'
+
+@app.route('/agente/prompt/generate')
+def generate_reply_stream():
+    """Stream a GPT reply for a thread to the browser as Server-Sent Events"""
+    thread = EmailThread.query.filter_by(thread_id=request.args.get('thread_id', '')).first()
+    if thread is None:
+        abort(404)
+
+    # Build the prompt inside the request; the stream itself does not touch the database
+    prompt = prompt_cache.get_prompt(thread, AGENTE_IA_DIR)
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    try:
+        from api_gpt import ApiGPT
+        gpt = ApiGPT()
+    except Exception as e:
+        return Response(sse_event({'message': str(e)}, 'error'), mimetype='text/event-stream', headers=headers)
+
+    def events():
+        tokens = gpt.gpt4_stream(prompt)
+        outcome = 'cancelled'
+        try:
+            for text in tokens:
+                yield sse_event({'text': text})
+            outcome = 'done'
+            yield sse_event({}, 'done')
+        except Exception as e:
+            outcome = 'error'
+            yield sse_event({'message': str(e)}, 'error')
+        finally:
+            # On client disconnect the server closes this generator, which closes the OpenAI stream
+            tokens.close()
+            metrics.inc('gpt_streams_total', outcome=outcome)
+
+    return Response(events(), mimetype='text/event-stream', headers=headers)
 
-    # Construir el prompt
-    prompt = build_prompt(prompt_files_contents, info_principal_content, message_thread_content)
+@app.route('/agente/queue/status')
+def queue_status():
+    try:
+        return jsonify({
+            'status': 'success',
+            'running': reply_queue.workers_running(),
+            'jobs': reply_queue.queue_status()
+        })
+    except Exception as e:
+        app.logger.error(f'Error fetching queue status: {str(e)}')
+        return jsonify({'status': 'error', 'message': str(e)})
 
-    return render_template('agente/agente_prompt.html', prompt=prompt)
+@app.route('/agente/queue/toggle', methods=['POST'])
+def toggle_queue():
+    try:
+        if reply_queue.workers_running():
+            reply_queue.stop_workers()
+            return jsonify({'status': 'success', 'message': 'Reply workers stopped', 'running': False})
+
+        reply_queue.start_workers()
+        return jsonify({'status': 'success', 'message': 'Reply workers started', 'running': True})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error: {str(e)}'})
@@ -0,0 +1,142 @@
+#stats.py
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update, func
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import StatCounter, EmailThread, EmailMessage
+import contacts
+
+# Stats configuration
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '5'))  # Seconds the dashboard numbers are cached in-process
+INGEST_HOURS_KEPT = 48
+
+HOUR_PREFIX = 'ingest:hour:'
+
+_cache = {'expires': 0.0, 'value': None}
+_cache_lock = threading.Lock()
+
+def _hour_key(moment):
+    return HOUR_PREFIX + moment.strftime('%Y%m%d%H')
+
+def increment(key, amount=1):
+    """Add `amount` to a counter inside the caller's transaction"""
+    result = db.session.execute(
+        update(StatCounter).where(StatCounter.key == key).values(value=StatCounter.value + amount)
+    )
+    if result.rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            counter = StatCounter()
+            counter.key = key
+            counter.value = amount
+            db.session.add(counter)
+    except IntegrityError:
+        # Created concurrently by another writer
+        db.session.execute(
+            update(StatCounter).where(StatCounter.key == key).values(value=StatCounter.value + amount)
+        )
+        return
+
+    if key.startswith(HOUR_PREFIX):
+        # A new hour started: drop buckets that no longer feed any rate
+        cutoff = _hour_key(datetime.utcnow() - timedelta(hours=INGEST_HOURS_KEPT))
+        StatCounter.query.filter(
+            StatCounter.key.startswith(HOUR_PREFIX), StatCounter.key < cutoff
+        ).delete(synchronize_session=False)
+
+def on_thread_created():
+    increment('threads:total')
+    increment('threads:unanswered')
+
+def on_thread_removed(was_unanswered, was_skipped=False):
+    increment('threads:total', -1)
+    if was_unanswered:
+        increment('threads:unanswered', -1)
+    if was_skipped:
+        increment('threads:skipped', -1)
+
+def set_thread_answered(thread, answered):
+    """Set EmailThread.reply_by_ia and keep the unanswered counters (global and per contact) in step"""
+    if bool(thread.reply_by_ia) != answered:
+        increment('threads:unanswered', -1 if answered else 1)
+        contacts.on_thread_answered(thread.thread_id, answered)
+    thread.reply_by_ia = answered
+
+def set_thread_triage(thread, status, reason):
+    """Set EmailThread.triage_status/triage_reason and keep the skipped counter in step"""
+    if (thread.triage_status == 'skip') != (status == 'skip'):
+        increment('threads:skipped', 1 if status == 'skip' else -1)
+    thread.triage_status = status
+    thread.triage_reason = reason
+
+def on_message_stored(folder, new_sender):
+    increment('messages:total')
+    increment(f'messages:folder:{folder}')
+    increment(_hour_key(datetime.utcnow()))
+    if new_sender:
+        increment('senders:distinct')
+
+def _read_counters():
+    counters = dict(db.session.query(StatCounter.key, StatCounter.value).all())
+    now = datetime.utcnow()
+
+    return {
+        'messages_total': counters.get('messages:total', 0),
+        'messages_per_folder': {
+            key.split(':', 2)[2]: value for key, value in counters.items() if key.startswith('messages:folder:')
+        },
+        'threads_total': counters.get('threads:total', 0),
+        'threads_unanswered': counters.get('threads:unanswered', 0),
+        'threads_skipped': counters.get('threads:skipped', 0),
+        'threads_processed': counters.get('threads:total', 0) - counters.get('threads:skipped', 0),
+        'senders_distinct': counters.get('senders:distinct', 0),
+        'ingest_last_hour': counters.get(_hour_key(now), 0),
+        'ingest_last_24h': sum(counters.get(_hour_key(now - timedelta(hours=h)), 0) for h in range(24))
+    }
+
+def get_stats():
+    """Dashboard numbers, served from an in-process cache for STATS_CACHE_TTL seconds"""
+    with _cache_lock:
+        if _cache['value'] is not None and _cache['expires'] > time.monotonic():
+            return _cache['value']
+    value = _read_counters()
+    with _cache_lock:
+        _cache['value'] = value
+        _cache['expires'] = time.monotonic() + STATS_CACHE_TTL
+    return value
+
+def rebuild_stats():
+    """Recompute every counter from the mail tables (for existing databases or after drift)"""
+    StatCounter.query.filter(~StatCounter.key.startswith(HOUR_PREFIX)).delete(synchronize_session=False)
+
+    values = {
+        'messages:total': db.session.query(func.count(EmailMessage.id)).scalar(),
+        'threads:total': db.session.query(func.count(EmailThread.id)).scalar(),
+        'threads:unanswered': db.session.query(func.count(EmailThread.id)).filter(EmailThread.reply_by_ia == False).scalar(),
+        'threads:skipped': db.session.query(func.count(EmailThread.id)).filter(EmailThread.triage_status == 'skip').scalar(),
+        # Same normalization as contacts.normalize_email
+        'senders:distinct': db.session.query(func.count(func.distinct(func.lower(func.trim(EmailMessage.from_email))))).scalar()
+    }
+    for folder, count in db.session.query(EmailMessage.folder, func.count(EmailMessage.id)).group_by(EmailMessage.folder):
+        values[f'messages:folder:{folder}'] = count
+
+    for key, value in values.items():
+        counter = StatCounter()
+        counter.key = key
+        counter.value = value
+        db.session.add(counter)
+    db.session.commit()
+
+    with _cache_lock:
+        _cache['value'] = None
+    return values
+
+if __name__ == "__main__":
+    # Recompute counters: python stats.py
+    with app.app_context():
+        print(rebuild_stats())
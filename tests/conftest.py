@@ -0,0 +1,30 @@
+#tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Point the app at throwaway storage before anything imports it
+_workdir = tempfile.mkdtemp(prefix='tests-')
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{os.path.join(_workdir, "test.db")}',
+    'ENV_FILE': os.path.join(_workdir, '.env'),
+    'AGENTE_IA_DIR': os.path.join(_workdir, 'agente_ia'),
+    'KNOWLEDGE_EMBEDDER': 'hashing',
+    'PROMPT_CACHE_ENABLED': '0'
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def app_db():
+    """App context over an empty database"""
+    from app import app, db
+    import models  # noqa: F401
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app, db
+        db.session.remove()
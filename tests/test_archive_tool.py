@@ -0,0 +1,51 @@
+#tests/test_archive_tool.py
+
+import json
+from datetime import datetime
+
+def add_thread(db, thread_id, from_email):
+    from models import EmailThread, EmailMessage, ReplyJob
+
+    thread = EmailThread()
+    thread.thread_id = thread_id
+    thread.subject = f'Consulta {thread_id}'
+    db.session.add(thread)
+    db.session.flush()
+    message = EmailMessage()
+    message.message_id = f'<{thread_id}@example.com>'
+    message.thread_id = thread_id
+    message.from_email = from_email
+    message.body = 'Hola'
+    message.references = json.dumps([])
+    message.date = datetime(2024, 1, 1)
+    db.session.add(message)
+    job = ReplyJob()
+    job.thread_id = thread_id
+    db.session.add(job)
+    db.session.commit()
+
+def test_replace_import_keeps_users(app_db, tmp_path):
+    import archive_tool
+    import stats
+    from models import User, EmailThread, ReplyJob, Contact
+
+    _, db = app_db
+    user = User(username='admin', email='admin@example.com')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    add_thread(db, 'archived', 'a@example.com')
+
+    archive_tool.export_archive(str(tmp_path / 'backup'))
+    add_thread(db, 'after-export', 'b@example.com')
+    archive_tool.import_archive(str(tmp_path / 'backup'), replace=True)
+    db.session.remove()
+
+    assert [u.email for u in User.query.all()] == ['admin@example.com']
+    assert User.query.first().check_password('secret')
+    assert [t.thread_id for t in EmailThread.query.all()] == ['archived']
+    # Rows that referenced the replaced threads are gone and the derived tables match the archive
+    assert ReplyJob.query.count() == 0
+    assert [c.email for c in Contact.query.all()] == ['a@example.com']
+    counters = stats._read_counters()
+    assert (counters['threads_total'], counters['messages_total'], counters['senders_distinct']) == (1, 1, 1)
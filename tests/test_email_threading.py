@@ -0,0 +1,50 @@
+#tests/test_email_threading.py
+
+import json
+from datetime import datetime, timedelta
+
+import email_threading
+
+def store(db, thread_id, message_id, references, date):
+    from models import EmailMessage
+
+    message = EmailMessage()
+    message.message_id = message_id
+    message.thread_id = thread_id
+    message.from_email = 'cliente@example.com'
+    message.references = json.dumps(references)
+    message.date = date
+    db.session.add(message)
+    db.session.flush()
+    email_threading.attach_message(message)
+    db.session.commit()
+    return message
+
+def tree(thread_id):
+    from models import EmailMessage
+
+    return {
+        m.message_id: (m.parent_message_id, m.thread_depth, m.thread_position)
+        for m in EmailMessage.query.filter_by(thread_id=thread_id)
+    }
+
+def test_attach_links_through_phantom_references(app_db):
+    """M only names ids we never received, but N already linked one of them under Y"""
+    from models import EmailThread
+
+    _, db = app_db
+    thread = EmailThread()
+    thread.thread_id = 't1'
+    db.session.add(thread)
+    db.session.flush()
+
+    start = datetime(2024, 1, 1)
+    store(db, 't1', '<Y>', [], start)
+    store(db, 't1', '<N>', ['<Y>', '<A>'], start + timedelta(minutes=1))
+    store(db, 't1', '<M>', ['<A>', '<X>'], start + timedelta(minutes=2))
+    attached = tree('t1')
+
+    assert attached['<M>'][:2] == ('<Y>', 1)
+    email_threading.rebuild_thread_tree('t1')
+    db.session.commit()
+    assert tree('t1') == attached
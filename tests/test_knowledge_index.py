@@ -0,0 +1,44 @@
+#tests/test_knowledge_index.py
+
+import os
+import threading
+
+import knowledge_index
+
+class BlockingEmbedder(knowledge_index.HashingEmbedder):
+    """Holds the first embed call until `release` is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def embed(self, texts):
+        self.started.set()
+        self.release.wait(10)
+        return super().embed(texts)
+
+def write_info(agente_dir, name, text):
+    os.makedirs(os.path.join(agente_dir, 'info'), exist_ok=True)
+    with open(os.path.join(agente_dir, 'info', name), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def test_refresh_requested_during_a_refresh_runs_again_and_keeps_callbacks(app_db, tmp_path):
+    agente_dir = str(tmp_path)
+    write_info(agente_dir, 'envios.txt', 'El envío tarda tres días.')
+    embedder = BlockingEmbedder()
+    index = knowledge_index.KnowledgeIndex(agente_dir, embedder)
+    called = []
+
+    running = index.refresh_async(then=lambda: called.append('first'))
+    assert embedder.started.wait(10)
+    # An upload while the first pass is embedding
+    write_info(agente_dir, 'garantia.txt', 'La garantía cubre dos años.')
+    assert index.refresh_async(then=lambda: called.append('second')) is running
+    embedder.release.set()
+    running.join(10)
+
+    assert not running.is_alive()
+    assert sorted(called) == ['first', 'second']
+    assert {chunk['file'] for chunk in index.chunks} == {'envios.txt', 'garantia.txt'}
+    assert not index.is_stale()
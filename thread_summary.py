@@ -0,0 +1,104 @@
+#thread_summary.py
+
+"""
+Resúmenes incrementales de hilos largos.
+
+Cuando un hilo alcanza THREAD_SUMMARY_MIN_MESSAGES mensajes, los más antiguos (todos salvo
+los THREAD_SUMMARY_KEEP_RECENT últimos) se condensan en un resumen persistente. Al llegar
+correo nuevo solo se incorporan al resumen los mensajes que aún no contiene, nunca se
+vuelve a resumir el hilo completo. El prompt usa el resumen más los mensajes no resumidos.
+"""
+
+import json
+import os
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import ThreadSummary, PromptCache
+from metrics import timed
+from prompt_builder import format_message_thread
+
+# Summary configuration
+THREAD_SUMMARY_MIN_MESSAGES = int(os.getenv('THREAD_SUMMARY_MIN_MESSAGES', '12'))  # Threads shorter than this are sent in full
+THREAD_SUMMARY_KEEP_RECENT = int(os.getenv('THREAD_SUMMARY_KEEP_RECENT', '6'))  # Latest messages always sent in full
+THREAD_SUMMARY_BATCH = int(os.getenv('THREAD_SUMMARY_BATCH', '4'))  # Fold older messages once this many are pending
+THREAD_SUMMARY_MAX_FOLD = int(os.getenv('THREAD_SUMMARY_MAX_FOLD', '40'))  # Messages per summarization request
+THREAD_SUMMARY_MAX_WORDS = int(os.getenv('THREAD_SUMMARY_MAX_WORDS', '300'))
+
+def get_summary(thread_id):
+    return ThreadSummary.query.filter_by(thread_id=thread_id).first()
+
+def _covered(summary):
+    return set(json.loads(summary.message_ids)) if summary else set()
+
+def pending_messages(messages, summary):
+    """Older messages (in thread order) that should be in the summary but are not yet"""
+    if len(messages) < THREAD_SUMMARY_MIN_MESSAGES:
+        return []
+    covered = _covered(summary)
+    return [m for m in messages[:-THREAD_SUMMARY_KEEP_RECENT or None] if m.id not in covered]
+
+def build_summary_prompt(previous_summary, messages):
+    prompt = (
+        "Mantienes el resumen de una conversación de soporte por correo electrónico. "
+        f"Escribe un resumen actualizado de como máximo {THREAD_SUMMARY_MAX_WORDS} palabras que conserve "
+        "quién es el cliente, qué ha pedido, qué se le ha respondido o prometido y qué queda pendiente "
+        "(datos concretos como números de pedido, fechas e importes). Devuelve solo el resumen.\n\n"
+    )
+    if previous_summary:
+        prompt += f"Resumen actual:\n{previous_summary}\n\n"
+    prompt += f"Mensajes nuevos a incorporar:\n{format_message_thread(messages)}"
+    return prompt
+
+def update_summary(thread, messages, gpt):
+    """
+    Fold pending older messages into the thread summary with `gpt` and commit.
+    `messages` is the whole thread in thread order. Returns the (possibly unchanged) summary.
+    """
+    summary = get_summary(thread.thread_id)
+    pending = pending_messages(messages, summary)
+    if len(pending) < THREAD_SUMMARY_BATCH:
+        return summary
+
+    text = summary.summary if summary else ''
+    covered = _covered(summary)
+    folded = 0
+    for start in range(0, len(pending), THREAD_SUMMARY_MAX_FOLD):
+        batch = pending[start:start + THREAD_SUMMARY_MAX_FOLD]
+        with timed('thread_summary'):
+            result = gpt.gpt4_request(build_summary_prompt(text, batch))
+        if not result:
+            # Keep what we have; the unsummarized messages are sent in full meanwhile
+            break
+        text = result
+        covered.update(m.id for m in batch)
+        folded += len(batch)
+
+    if not folded:
+        return summary
+
+    if summary is None:
+        try:
+            with db.session.begin_nested():
+                summary = ThreadSummary()
+                summary.thread_id = thread.thread_id
+                summary.summary = text
+                summary.message_ids = json.dumps(sorted(covered))
+                db.session.add(summary)
+        except IntegrityError:
+            # Created concurrently; ours covers the same messages
+            summary = get_summary(thread.thread_id)
+    else:
+        summary.summary = text
+        summary.message_ids = json.dumps(sorted(covered))
+    # Cached prompts were built with the previous summary
+    PromptCache.query.filter_by(thread_id=thread.thread_id).delete(synchronize_session=False)
+    db.session.commit()
+    return summary
+
+def split_for_prompt(thread, messages):
+    """Return (summary text or None, messages not covered by the summary)"""
+    summary = get_summary(thread.thread_id)
+    if summary is None:
+        return None, messages
+    covered = _covered(summary)
+    return summary.summary, [m for m in messages if m.id not in covered]
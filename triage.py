@@ -0,0 +1,171 @@
+#triage.py
+
+"""
+Clasificación previa a GPT: detecta correo masivo, automático o sin respuesta posible
+(boletines, respuestas automáticas, rebotes, remitentes no-reply) para que esos hilos no
+lleguen a la cola de respuestas.
+
+Usa cabeceras (List-Unsubscribe, Auto-Submitted, Precedence, X-Autoreply, DSN de rebote),
+patrones de remitente y asunto y, opcionalmente, un clasificador Naive Bayes local
+entrenado con los propios hilos ya clasificados (python triage.py train).
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+
+# Triage configuration
+TRIAGE_ENABLED = os.getenv('TRIAGE_ENABLED', '1') == '1'
+TRIAGE_CLASSIFIER_PATH = os.getenv('TRIAGE_CLASSIFIER_PATH', 'triage_model.json')
+TRIAGE_CLASSIFIER_THRESHOLD = float(os.getenv('TRIAGE_CLASSIFIER_THRESHOLD', '0.9'))  # Probability of bulk needed to skip
+
+REPLY = 'reply'
+SKIP = 'skip'
+
+SENDER_RE = re.compile(
+    r'^(no[-_.]?reply|do[-_.]?not[-_.]?reply|mailer-daemon|postmaster|bounces?|notifications?|newsletters?|news)([+\-.@]|$)',
+    re.IGNORECASE
+)
+SUBJECT_RE = re.compile(
+    r'^\s*(out of office|automatic reply|auto[- ]?reply|autoreply|respuesta autom[áa]tica|fuera de (la )?oficina'
+    r'|undeliverable|undelivered mail|delivery status notification|mail delivery (failed|failure)'
+    r'|no se puede entregar|notificaci[óo]n de estado de entrega)',
+    re.IGNORECASE
+)
+TOKEN_RE = re.compile(r'\w{3,}')
+
+def header_reason(msg):
+    """Reason from the message headers, or None"""
+    auto_submitted = (msg.get('Auto-Submitted') or '').strip().lower()
+    if auto_submitted and auto_submitted != 'no':
+        return 'auto-submitted'
+    if msg.get('X-Autoreply') or msg.get('X-Autorespond') or msg.get('X-Autogenerated'):
+        return 'autoreply-header'
+    if (msg.get('Precedence') or '').strip().lower() in ('bulk', 'list', 'junk'):
+        return 'precedence'
+    if msg.get('List-Unsubscribe') or msg.get('List-Id'):
+        return 'mailing-list'
+    if msg.get_content_type() == 'multipart/report' or (msg.get('Return-Path') or '').strip() == '<>':
+        return 'bounce'
+    return None
+
+def classify(msg, from_email, subject, body):
+    """Return (status, reason): REPLY with reason None, or SKIP with the rule that matched"""
+    if not TRIAGE_ENABLED:
+        return REPLY, None
+
+    reason = header_reason(msg)
+    if reason:
+        return SKIP, reason
+    if SENDER_RE.match(from_email or ''):
+        return SKIP, 'sender'
+    if SUBJECT_RE.match(subject or ''):
+        return SKIP, 'subject'
+
+    classifier = get_classifier()
+    if classifier and classifier.probability(f'{subject}\n{body}') >= TRIAGE_CLASSIFIER_THRESHOLD:
+        return SKIP, 'classifier'
+    return REPLY, None
+
+# ---------------------------------------------------------------------------
+# Optional local classifier
+# ---------------------------------------------------------------------------
+
+def _tokens(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+class NaiveBayes:
+    """Multinomial Naive Bayes over words: bulk vs. personal mail"""
+
+    def __init__(self, prior, weights, default_weight):
+        self.prior = prior  # log P(bulk) - log P(personal)
+        self.weights = weights  # token -> log P(token|bulk) - log P(token|personal)
+        self.default_weight = default_weight
+
+    @classmethod
+    def train(cls, samples, alpha=1.0):
+        """samples: iterable of (text, is_bulk)"""
+        counts = {True: Counter(), False: Counter()}
+        docs = Counter()
+        for text, is_bulk in samples:
+            counts[bool(is_bulk)].update(_tokens(text))
+            docs[bool(is_bulk)] += 1
+        if not docs[True] or not docs[False]:
+            raise ValueError('Training needs examples of both bulk and personal mail')
+
+        vocabulary = set(counts[True]) | set(counts[False])
+        totals = {label: sum(counts[label].values()) + alpha * (len(vocabulary) + 1) for label in (True, False)}
+        weights = {
+            token: math.log((counts[True][token] + alpha) / totals[True]) - math.log((counts[False][token] + alpha) / totals[False])
+            for token in vocabulary
+        }
+        default_weight = math.log(alpha / totals[True]) - math.log(alpha / totals[False])
+        return cls(math.log(docs[True] / docs[False]), weights, default_weight)
+
+    def probability(self, text):
+        score = self.prior + sum(self.weights.get(token, self.default_weight) for token in _tokens(text))
+        if score < -50:
+            return 0.0
+        return 1.0 / (1.0 + math.exp(-min(score, 50)))
+
+    def save(self, path):
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'prior': self.prior, 'weights': self.weights, 'default_weight': self.default_weight}, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['prior'], data['weights'], data['default_weight'])
+
+_classifier = {'mtime': None, 'model': None}
+
+def get_classifier():
+    """The trained model at TRIAGE_CLASSIFIER_PATH, reloaded when the file changes, or None"""
+    try:
+        mtime = os.path.getmtime(TRIAGE_CLASSIFIER_PATH)
+    except OSError:
+        return None
+    if _classifier['mtime'] != mtime:
+        try:
+            _classifier['model'] = NaiveBayes.load(TRIAGE_CLASSIFIER_PATH)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error al cargar el clasificador de triage: {e}")
+            _classifier['model'] = None
+        _classifier['mtime'] = mtime
+    return _classifier['model']
+
+def train_from_database(path=TRIAGE_CLASSIFIER_PATH):
+    """Train on stored mail: threads skipped by the header rules are bulk, answered threads are personal"""
+    from app import db
+    from models import EmailThread, EmailMessage
+
+    def samples():
+        rows = db.session.query(EmailThread.triage_status, EmailThread.triage_reason, EmailThread.reply_by_ia,
+                                EmailMessage.subject, EmailMessage.body).join(
+            EmailMessage, EmailMessage.thread_id == EmailThread.thread_id
+        ).filter(EmailMessage.folder != 'Sent').yield_per(500)
+        for status, reason, answered, subject, body in rows:
+            if status == SKIP and reason != 'classifier':
+                yield f'{subject}\n{body}', True
+            elif status == REPLY and answered:
+                yield f'{subject}\n{body}', False
+
+    model = NaiveBayes.train(samples())
+    model.save(path)
+    return model
+
+if __name__ == "__main__":
+    # Train the optional classifier from the database: python triage.py train
+    import sys
+    from app import app
+
+    if sys.argv[1:] == ['train']:
+        with app.app_context():
+            model = train_from_database()
+        print(f"Clasificador guardado en {TRIAGE_CLASSIFIER_PATH} ({len(model.weights)} términos)")
+    else:
+        print("Uso: python triage.py train")